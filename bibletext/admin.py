@@ -2,9 +2,10 @@ from django import forms
 from django.contrib import admin
 from django.contrib.contenttypes import generic
 
-from bible import Verse, RangeError # python-bible
+from bible import RangeError # python-bible
 
 from models import Scripture
+from references import parse_verse
 
 
 class ScriptureForm(forms.ModelForm):
@@ -17,13 +18,13 @@ class ScriptureForm(forms.ModelForm):
         version = self.cleaned_data['version'].model_class().translation
         if 'start_verse' in self.cleaned_data:
             try:
-                verse = Verse(self.cleaned_data['start_verse']+' '+version)
+                verse = parse_verse(self.cleaned_data['start_verse'], version)
             except (RangeError, Exception) as err:
                 self._errors['start_verse'] = self.error_class([err.__str__()])
                 del self.cleaned_data['start_verse']
         if 'end_verse' in self.cleaned_data and self.cleaned_data['end_verse']:
             try:
-                verse = Verse(self.cleaned_data['end_verse']+' '+version)
+                verse = parse_verse(self.cleaned_data['end_verse'], version)
             except (RangeError, Exception) as err:
                 self._errors['end_verse'] = self.error_class([err.__str__()])
                 del self.cleaned_data['end_verse']
@@ -0,0 +1,217 @@
+"""
+A read-only JSON API of the text, next to the HTML views (see urls.py)::
+
+    api/KJV/43/3/                                   John 3
+    api/KJV/43/3/16/                                John 3:16
+    api/KJV/passage/?ref=John 3:16-18               Anything KJV.objects.passage() takes.
+    api/KJV/passage/?ref=Ps 119&per_page=50         A page at a time, see passage.
+    api/KJV/references/?ref=Rom 3:23&ref=Jn 3:16    Many references, each answered (or not) on its own.
+
+The text is read through the chapter cache (and the text store, see bibletext.store), and the
+book and chapter details (names, verse counts, next and previous) come from the canon, so a
+warm process answers without touching the database. Responses carry ETags like the pages do
+(with BIBLETEXT_CONDITIONAL_GET on, see bibletext.views.page_etag).
+
+Passages longer than BIBLETEXT_API_STREAM_VERSES (1000 by default) are streamed instead, see
+stream_verses_data.
+"""
+import json
+from itertools import groupby
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.utils.http import urlencode
+from django.views.decorators.http import condition, require_GET
+
+from bible import RangeError # python-bible module.
+
+from utils import lookup_translation
+from views import query_etag, version_etag, StreamingHttpResponse
+
+
+def to_json(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def json_response(data, status=200):
+    return HttpResponse(to_json(data), status=status, content_type='application/json')
+
+
+def book_data(book):
+    return {
+        'number': book.number,
+        'name': book.name,
+        'testament': book.testament,
+        'num_chapters': len(book),
+        'num_verses': book.num_verses,
+        'next': book.next and book.next.number,
+        'prev': book.prev and book.prev.number,
+    }
+
+
+def chapter_data(chapter):
+    " The canon's details of a chapter; next and prev are None at either end of the bible. "
+    translation = chapter.book.bible.translation
+    data = {
+        'book': book_data(chapter.book),
+        'number': chapter.number,
+        'name': chapter.name,
+        'num_verses': chapter.num_verses,
+        'url': chapter_url(translation, chapter.book.number, chapter.number),
+    }
+    for name in ('next', 'prev'):
+        try:
+            other = getattr(chapter, name)
+        except TypeError: # Past either end of the bible.
+            data[name] = None
+        else:
+            data[name] = {'book': other.book.number, 'chapter': other.number,
+                          'url': chapter_url(translation, other.book.number, other.number)}
+    return data
+
+
+def chapter_url(translation, book_id, chapter_id):
+    return reverse('bibletext_api_chapter', kwargs={'version': translation, 'book_id': book_id, 'chapter_id': chapter_id})
+
+
+def verse_data(verse):
+    return {'book': verse.book_id, 'chapter': verse.chapter_id, 'verse': verse.verse_id,
+            'ordinal': verse.ordinal, 'text': verse.text}
+
+
+def verses_data(bible, verse_list):
+    " The verses, and the details of the chapters they're in. "
+    chapters = []
+    for verse in verse_list:
+        if not chapters or chapters[-1] != (verse.book_id, verse.chapter_id):
+            chapters.append((verse.book_id, verse.chapter_id))
+    return {
+        'chapters': [chapter_data(bible.bible[book_id][chapter_id]) for book_id, chapter_id in chapters],
+        'verses': [verse_data(verse) for verse in verse_list],
+    }
+
+
+def stream_verses_data(bible, verses, **data):
+    """
+    Yields the JSON of data plus verses_data(bible, verses) a chapter at a time, reading the
+    verses as it goes. The chapters come after the verses, gathered on the way.
+    """
+    yield to_json(data)[:-1] + u',"verses":['
+    chapters = []
+    for (book_id, chapter_id), verse_list in groupby(verses, lambda verse: (verse.book_id, verse.chapter_id)):
+        chapters.append(chapter_data(bible.bible[book_id][chapter_id]))
+        yield (u',' if len(chapters) > 1 else u'') + u','.join(to_json(verse_data(verse)) for verse in verse_list)
+    yield u'],"chapters":%s}' % to_json(chapters)
+
+
+@require_GET
+@condition(etag_func=version_etag)
+def chapter(request, version, book_id, chapter_id):
+    " The verses of a chapter. "
+    bible = lookup_translation(version)
+    try:
+        chapter = bible.bible[int(book_id)][int(chapter_id)]
+    except IndexError:
+        return json_response({'error': u"Chapter not found in the given book of %s." % bible.translation}, status=404)
+    return json_response({
+        'translation': bible.translation,
+        'chapter': chapter_data(chapter),
+        'verses': [verse_data(verse) for verse in bible.objects.chapter(chapter.book.number, chapter.number)],
+    })
+
+
+@require_GET
+@condition(etag_func=version_etag)
+def verse(request, version, book_id, chapter_id, verse_id):
+    " A single verse. "
+    bible = lookup_translation(version)
+    try:
+        verse = bible.objects.get_verse(int(book_id), int(chapter_id), int(verse_id))
+    except (IndexError, bible.DoesNotExist):
+        return json_response({'error': u"Verse not found in the %s." % bible.translation}, status=404)
+    return json_response({
+        'translation': bible.translation,
+        'chapter': chapter_data(verse.chapter),
+        'verse': verse_data(verse),
+    })
+
+
+@require_GET
+@condition(etag_func=query_etag)
+def passage(request, version):
+    """
+    The verses of GET[ref], eg: `John 3:16-18`, `Rom 3:23; 6:23; 10:9-13`, with the details
+    of the chapters they're in. A reference that can't be read answers 400.
+    
+    Passages of more than BIBLETEXT_API_STREAM_VERSES verses (eg: `Psalm 1:1-150:6`) are
+    streamed as they're read, see BiblePassageManager.iter_ranges.
+    
+    Given GET[per_page] (up to BIBLETEXT_API_MAX_PAGE_SIZE, 500 by default) or GET[from], answers a
+    page of the passage instead (see BiblePassageManager.page), with the URL of the next one in
+    `next` (or null): GET[from] is the ordinal of the page's first verse.
+    """
+    bible = lookup_translation(version)
+    reference = request.GET.get('ref', u'').strip()
+    try:
+        ranges = bible.objects.ordinal_ranges(reference)
+    except (RangeError, IndexError) as e:
+        return json_response({'error': unicode(e) or u"Not in the %s: %s" % (bible.translation, reference)}, status=400)
+    if 'per_page' in request.GET or 'from' in request.GET:
+        return passage_page(request, bible, reference, ranges)
+    if sum(end - start + 1 for start, end in ranges) > getattr(settings, 'BIBLETEXT_API_STREAM_VERSES', 1000):
+        return StreamingHttpResponse(stream_verses_data(bible, bible.objects.iter_ranges(ranges),
+            translation=bible.translation, reference=reference), content_type='application/json')
+    verse_list = bible.objects.verses_in_ranges([ranges])[0]
+    return json_response(dict(verses_data(bible, verse_list), translation=bible.translation, reference=reference))
+
+
+def passage_page(request, bible, reference, ranges):
+    " A page of the passage view. The next page's URL keeps the parameters in the same order. "
+    try:
+        per_page = int(request.GET.get('per_page', 0)) or None
+        start = int(request.GET['from']) if 'from' in request.GET else None
+    except ValueError:
+        return json_response({'error': u"per_page and from must be numbers."}, status=400)
+    limit = getattr(settings, 'BIBLETEXT_API_MAX_PAGE_SIZE', 500)
+    if per_page is not None and not 0 < per_page <= limit:
+        return json_response({'error': u"Ask for at most %d verses a page." % limit}, status=400)
+    verse_list, following = bible.objects.page(ranges, start, per_page)
+    next_url = None
+    if following:
+        query = [('ref', reference.encode('utf-8')), ('from', following)]
+        if per_page:
+            query.append(('per_page', per_page))
+        next_url = u'%s?%s' % (request.path, urlencode(query))
+    return json_response(dict(verses_data(bible, verse_list), translation=bible.translation, reference=reference,
+                              next=next_url))
+
+
+@require_GET
+@condition(etag_func=query_etag)
+def references(request, version):
+    """
+    The verses of each GET[ref] (up to BIBLETEXT_API_MAX_REFERENCES, 50 by default) read
+    together, as a list of results in the same order. A reference that can't be read gets an
+    error instead of verses, and doesn't stop the others.
+    """
+    bible = lookup_translation(version)
+    requested = request.GET.getlist('ref')
+    limit = getattr(settings, 'BIBLETEXT_API_MAX_REFERENCES', 50)
+    if len(requested) > limit:
+        return json_response({'error': u"Ask for at most %d references at a time." % limit}, status=400)
+    ranges, errors = [], {}
+    for i, reference in enumerate(requested):
+        try:
+            ranges.append(bible.objects.ordinal_ranges(reference))
+        except (RangeError, IndexError) as e:
+            ranges.append([])
+            errors[i] = unicode(e) or u"Not in the %s: %s" % (bible.translation, reference)
+    found = bible.objects.verses_in_ranges(ranges) if ranges else []
+    results = []
+    for i, reference in enumerate(requested):
+        if i in errors:
+            results.append({'reference': reference, 'error': errors[i]})
+        else:
+            results.append(dict(verses_data(bible, found[i]), reference=reference))
+    return json_response({'translation': bible.translation, 'results': results})
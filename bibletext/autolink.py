@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Finds the scripture references in free text or HTML and links them to the verses, eg::
+
+    from bibletext.autolink import link_references
+    link_references(u'see Jn 3:16 and Rom. 8:28-30', KJV)
+    # u'see <a href="/bible/KJV/43/3/16/" class="bibletext-reference">Jn 3:16</a> and <a ...>Rom. 8:28-30</a>'
+
+The text is read once, from left to right: an Aho-Corasick automaton of every book's name,
+short name and abbreviations finds the book names, and the chapter and verse after each one
+are read by hand. So no regular expressions, and python-bible is never asked, however many
+candidates there are. Markup is skipped, as are the insides of <a>, <script> and <style> tags.
+
+Understood: 'John 3:16', 'Jn. 3:16-18', '1 Cor 2:3-3:4', 'Psalm 23', 'Psalm 23-25', 'Jude 5',
+and lists of them carrying the book and chapter over, 'Rom 3:23; 6:23, 8:28, 30'. To keep
+words like 'is' and 'he' from being taken for books, the book must be capitalized, and a
+chapter without a verse must follow a book name of at least three letters.
+"""
+from collections import deque
+
+from django.utils.html import escape
+
+from bibletext.caching import chapter_cache
+from bibletext.models import KJV
+from bibletext.models.bibles import book_key
+
+
+class Reference(object):
+    """
+    A reference found in some text: text[start:end] refers to the Verses first to last.
+    `chapters` is True when it names whole chapters, eg: 'Psalm 23'.
+    """
+    __slots__ = ('start', 'end', 'first', 'last', 'chapters')
+
+    def __init__(self, start, end, first, last, chapters=False):
+        self.start = start
+        self.end = end
+        self.first = first
+        self.last = last
+        self.chapters = chapters
+
+    def __unicode__(self):
+        first, last = self.first, self.last
+        if self.chapters:
+            if first.chapter == last.chapter:
+                return unicode(first.chapter)
+            return u'%s-%d' % (first.chapter, last.chapter.number)
+        if first == last:
+            return unicode(first)
+        if first.chapter == last.chapter:
+            return u'%s-%d' % (first, last.number)
+        return u'%s-%s' % (first, last.name)
+
+    def __repr__(self):
+        return '<Reference: %s>' % unicode(self).encode('utf-8')
+
+    def get_absolute_url(self):
+        " The url of the first verse, or of the first chapter for whole chapters. "
+        if self.chapters:
+            return self.first.chapter.get_absolute_url()
+        return self.first.get_absolute_url()
+
+
+# Automata by translation, built on first use: (goto, fail, outputs, alphabet), see _build_automaton.
+_automata = {}
+
+def _automaton(bible):
+    automaton = _automata.get(bible.translation)
+    if automaton is None:
+        automaton = _automata[bible.translation] = _build_automaton(bible)
+    return automaton
+
+def _build_automaton(bible):
+    """
+    goto[state] maps a (lowercased) character to the next state, fail[state] is the state of
+    the longest proper suffix, and outputs[state] lists (length, letters, Book) of the names
+    ending there, longest first. alphabet is the set of characters the names use. goto gains the
+    other transitions of those characters as they're used, see _transition, so the automaton
+    becomes a DFA of the characters actually seen; no other character is ever stored.
+    """
+    patterns = {}
+    for book in bible:
+        for name in [book.name, book.shortname] + list(book.abbreviations or []):
+            name = u' '.join(name.lower().split())
+            for pattern in (name, name.replace(u'.', u''), name.replace(u' ', u'')):
+                # The same lookup as Bible.find_book, so eg: 'ez' is whatever find_book says.
+                patterns[pattern] = bible.find_book(pattern)
+
+    goto, fail, outputs = [{}], [0], [[]]
+    for pattern, book in patterns.items():
+        state = 0
+        for character in pattern:
+            following = goto[state].get(character)
+            if following is None:
+                following = goto[state][character] = len(goto)
+                goto.append({})
+                fail.append(0)
+                outputs.append([])
+            state = following
+        outputs[state].append((len(pattern), len(book_key(pattern)), book))
+
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for character, following in goto[state].items():
+            queue.append(following)
+            suffix = fail[state]
+            while suffix and character not in goto[suffix]:
+                suffix = fail[suffix]
+            fail[following] = goto[suffix].get(character, 0)
+            outputs[following] = sorted(outputs[following] + outputs[fail[following]], reverse=True)
+    alphabet = frozenset(character for transitions in goto for character in transitions)
+    return goto, fail, outputs, alphabet
+
+
+def _transition(goto, fail, alphabet, state, character):
+    """
+    Follows the fail links from state for a character, remembering the result in goto. Characters
+    no name uses go back to state 0, unremembered, so goto doesn't grow with every text read.
+    """
+    read = u' ' if character.isspace() else character
+    if read not in alphabet:
+        return 0
+    suffix = state
+    while suffix and read not in goto[suffix]:
+        suffix = fail[suffix]
+    following = goto[state][character] = goto[suffix].get(read, 0)
+    return following
+
+# Tags whose insides are left alone.
+SKIPPED_TAGS = ('a', 'script', 'style')
+
+def _skip_markup(lower, i):
+    " Where the text resumes after the markup starting at lower[i] ('<'), or None if it isn't markup. "
+    n = len(lower)
+    following = lower[i+1:i+2]
+    if following == u'!' and lower.startswith(u'<!--', i):
+        end = lower.find(u'-->', i + 4)
+        return n if end == -1 else end + 3
+    if not (following.isalpha() or following in (u'/', u'!')):
+        return None
+    end = lower.find(u'>', i)
+    if end == -1:
+        return None
+    for tag in SKIPPED_TAGS:
+        if lower.startswith(tag, i + 1) and not lower[i+1+len(tag)].isalnum():
+            close = lower.find(u'</%s' % tag, end)
+            if close == -1:
+                return n
+            end = lower.find(u'>', close)
+            return n if end == -1 else end + 1
+    return end + 1
+
+
+def _number(text, i):
+    " (The number of up to three digits at text[i], the index after it), or (None, i). "
+    j = i
+    n = len(text)
+    while j < n and text[j].isdigit() and j - i < 4:
+        j += 1
+    if j == i or j - i > 3:
+        return None, i
+    return int(text[i:j]), j
+
+def _skip_spaces(text, i):
+    n = len(text)
+    while i < n and text[i].isspace():
+        i += 1
+    return i
+
+
+DASHES = u'-–—'
+
+def _part(text, i):
+    " Reads 'a', 'a:b', 'a-c', 'a:b-c' or 'a:b-c:d' at text[i]: ((a, b, c, d), the index after it) or None. "
+    n = len(text)
+    a, i = _number(text, i)
+    if a is None:
+        return None
+    b = c = d = None
+    if i + 1 < n and text[i] in u':.' and text[i+1].isdigit():
+        b, i = _number(text, i + 1)
+        if b is None:
+            return None
+    j = _skip_spaces(text, i)
+    if j < n and text[j] in DASHES:
+        c, k = _number(text, _skip_spaces(text, j + 1))
+        if c is not None:
+            i = k
+            if k + 1 < n and text[k] in u':.' and text[k+1].isdigit():
+                d, k = _number(text, k + 1)
+                if d is None:
+                    return None
+                i = k
+    return (a, b, c, d), i
+
+def _verses(book, numbers, chapter):
+    """
+    The (first, last, chapters) of a part read by _part, given the chapter it's in (when it
+    may be only a verse, after a ','), or None if the canon doesn't have those verses.
+    """
+    a, b, c, d = numbers
+    try:
+        if b is not None: # chapter:verse...
+            start = book[a][b]
+            if c is None:
+                return start, start, False
+            if d is None:
+                return start, book[a][c], False
+            return start, book[c][d], False
+        if chapter is not None or book.has_one_chapter: # verse...
+            chapter = book[chapter or 1]
+            if c is None:
+                return chapter[a], chapter[a], False
+            if d is None:
+                return chapter[a], chapter[c], False
+            return chapter[a], book[c][d], False
+        if d is not None: # chapter-chapter:verse
+            return book[a][1], book[c][d], False
+        return book[a][1], book[c or a][-1], True # Whole chapters.
+    except IndexError:
+        return None
+
+def _ordered(found):
+    if found is None or found[1].ordinal < found[0].ordinal:
+        return None
+    return found
+
+def _scan(text, start, i, book, letters):
+    """
+    Reads the chapters and verses after a book name (text[start:i]), returning
+    ([Reference, ...], the index after them). The list is empty if there are none.
+    """
+    n = len(text)
+    if i < n and text[i] == u'.':
+        i += 1
+    i = _skip_spaces(text, i)
+    part = _part(text, i)
+    if part is None:
+        return [], i
+    numbers, end = part
+    if numbers[1] is None and not book.has_one_chapter and letters < 3:
+        return [], i # eg: 'he 3', 'Is 5'.
+    found = _ordered(_verses(book, numbers, None))
+    if found is None:
+        return [], i
+    references = [Reference(start, end, *found)]
+
+    while True: # '; 6:23', ', 30', ...
+        j = _skip_spaces(text, end)
+        if j >= n or text[j] not in u',;':
+            break
+        separator = text[j]
+        k = _skip_spaces(text, j + 1)
+        part = _part(text, k)
+        if part is None:
+            break
+        numbers, following = part
+        last = references[-1]
+        verse_chapter = None
+        if numbers[1] is None and separator == u',' and not last.chapters:
+            verse_chapter = last.last.chapter.number
+        after = _skip_spaces(text, following)
+        if numbers[1:] == (None, None, None) and after > following and text[after:after+1].isupper():
+            break # eg: the '2' of 'Gen 1:1, 2 Kings 3:4'.
+        found = _ordered(_verses(book, numbers, verse_chapter))
+        if found is None:
+            break
+        references.append(Reference(k, following, *found))
+        end = following
+    return references, end
+
+
+def find_references(text, bible=KJV):
+    """
+    Yields a Reference for each scripture reference in the text (or HTML), in order.
+
+    @args::
+
+        `text`: Plain text or HTML. Tags, and the text of links, scripts and styles, are skipped.
+
+        `bible`: The translation whose book names to look for. Defaults to the KJV.
+
+    """
+    goto, fail, outputs, alphabet = _automaton(bible.bible)
+    lower = text.lower()
+    n = len(text)
+    state = 0
+    i = 0
+    while i < n:
+        character = lower[i]
+        if character == u'<':
+            resume = _skip_markup(lower, i)
+            if resume is not None:
+                i = resume
+                state = 0
+                continue
+        following = goto[state].get(character)
+        if following is None:
+            following = _transition(goto, fail, alphabet, state, character)
+        state = following
+        i += 1
+        for length, letters, book in outputs[state]:
+            start = i - length
+            if start and lower[start-1].isalnum():
+                continue # The end of another word.
+            first_letter = start
+            while not text[first_letter].isalpha():
+                first_letter += 1
+            if not text[first_letter].isupper():
+                continue
+            references, end = _scan(text, start, i, book, letters)
+            if references:
+                for reference in references:
+                    yield reference
+                i = end
+                state = 0
+                break
+
+
+def link_references(text, bible=KJV, preview=False):
+    """
+    Returns the text (or HTML) with each scripture reference in it linked to its verse, in
+    <a class="bibletext-reference"> tags. The text isn't escaped, do that first if it's plain text.
+
+    With `preview` the links also carry a hover preview: the reference in full in a
+    data-reference attribute, and the text of its first verse in the title. The verses are
+    read through the chapter cache, all at once.
+    """
+    references = list(find_references(text, bible))
+    titles = {}
+    if preview and references:
+        chapters = chapter_cache.get_many(bible, set((reference.first.book.number, reference.first.chapter.number)
+                                                     for reference in references))
+        for reference in references:
+            verse = reference.first
+            for verse_text in chapters.get((verse.book.number, verse.chapter.number), ()):
+                if verse_text.verse_id == verse.number:
+                    titles[reference] = verse_text.text + (u' …' if reference.last != verse else u'')
+
+    urls = {} # Reversing urls is slow, and notes tend to repeat their references.
+    parts = []
+    end = 0
+    for reference in references:
+        key = (reference.first.ordinal, reference.chapters)
+        url = urls.get(key)
+        if url is None:
+            url = urls[key] = escape(reference.get_absolute_url())
+        attributes = u''
+        if preview:
+            attributes = u' data-reference="%s"' % escape(unicode(reference))
+            if reference in titles:
+                attributes += u' title="%s"' % escape(titles[reference])
+        parts.append(text[end:reference.start])
+        parts.append(u'<a href="%s" class="bibletext-reference"%s>%s</a>' % (
+            url, attributes, text[reference.start:reference.end]))
+        end = reference.end
+    parts.append(text[end:])
+    return u''.join(parts)
@@ -0,0 +1,192 @@
+"""
+Caching of scripture text a chapter at a time, and of the HTML rendered from it.
+
+The text of a translation practically never changes, so every read of the verse
+table goes through ``chapter_cache``. It has two tiers: an in-process LRU of
+model instances, and Django's cache (shared between processes) holding
+(pk, verse_id, ordinal, text) tuples. Keys include the translation and its
+content version, see VerseText.get_content_version().
+
+Settings::
+
+    BIBLETEXT_CACHE_BACKEND: The CACHES alias to use. Defaults to 'default'.
+    BIBLETEXT_CACHE_TIMEOUT: Seconds to keep chapters in that cache. Defaults to 30 days.
+    BIBLETEXT_CHAPTER_CACHE_SIZE: How many chapters each process keeps. Defaults to 256.
+    BIBLETEXT_FRAGMENT_CACHE_SIZE: How many rendered fragments each process keeps. Defaults to 256.
+    BIBLETEXT_FRAGMENT_CACHE: Set to False to render fragments uncached. Defaults to True.
+
+Chapters the database has only some of the verses of (eg: while a translation is being imported)
+aren't cached, and bibletext_import drops the chapters of the translation it imports from both
+tiers of the process it runs in (other processes keep theirs in memory until they restart).
+The verses handed out are copies: changing one (eg: next_verse memoizes) doesn't change what
+other requests and threads read.
+
+Run ``manage.py bibletext_warm_cache`` after deploying to fill the shared tier. Or, with
+BIBLETEXT_TEXT_STORE set, chapters missing from the in-process tier are read from the packed
+text files of bibletext.store rather than the shared tier and the database.
+
+``fragment_cache`` keeps rendered fragments (eg: a chapter's verse list) in the same
+two tiers, so the detail views don't re-render and reverse() every verse on every hit.
+Fragments are rendered from a plain context, without the context processors; see
+bibletext.views.render_verses for when they aren't cached.
+"""
+from copy import copy
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from bibletext.lru import LRUCache
+from bibletext.store import get_store
+
+
+def copy_verse(verse):
+    " A shallow copy of a cached verse, so what's set on it isn't shared. "
+    clone = verse.__class__.__new__(verse.__class__)
+    clone.__dict__.update(verse.__dict__)
+    clone._state = copy(verse._state)
+    return clone
+
+
+class TieredCache(object):
+    " An in-process LRU in front of a Django cache backend. "
+
+    def __init__(self, backend='default', timeout=60*60*24*30, maxsize=256):
+        self.backend = get_cache(backend)
+        self.timeout = timeout
+        self.local = LRUCache(maxsize)
+
+    def clear(self):
+        " Empties this process' tier. Bump the content version to retire the shared tier. "
+        self.local.clear()
+
+    def close(self):
+        " Closes the shared tier's connections, if it keeps any (eg: memcached), before forking. "
+        if hasattr(self.backend, 'close'):
+            self.backend.close()
+
+
+class ChapterCache(TieredCache):
+    " Two tier cache of the verses in each chapter of each translation. "
+
+    def key(self, version, book_id, chapter_id):
+        return 'bibletext:%s:%s:%d:%d' % (version.translation, version.get_content_version(), book_id, chapter_id)
+
+    def get_chapter(self, version, book_id, chapter_id):
+        " Returns the list of verses in the given chapter. "
+        return self.get_many(version, [(book_id, chapter_id)])[(book_id, chapter_id)]
+
+    def get_many(self, version, chapters):
+        """
+        Returns a dict of (book_id, chapter_id) -> list of (copies of the) verses for the given
+        chapters. Chapters found in neither tier are read from the database in a single query,
+        or from the translation's text store when there is one.
+        """
+        found = {}
+        keys = {}
+        for chapter in chapters:
+            key = self.key(version, *chapter)
+            verse_list = self.local.get(key)
+            if verse_list is None:
+                keys[key] = chapter
+            else:
+                found[chapter] = verse_list
+
+        store = keys and get_store(version)
+        if store:
+            fetched = store.chapters(version, keys.values())
+            for key, chapter in keys.items():
+                found[chapter] = fetched[chapter]
+                self.local.set(key, fetched[chapter])
+            keys = {}
+
+        if keys:
+            for key, rows in self.backend.get_many(keys.keys()).items():
+                chapter = keys.pop(key)
+                found[chapter] = self._set_local(version, key, chapter, rows)
+
+        if keys:
+            fetched = version.objects.fetch_chapters(keys.values())
+            rows = {}
+            for key, chapter in keys.items():
+                found[chapter] = fetched.get(chapter, [])
+                if self.is_complete(version, chapter, found[chapter]):
+                    rows[key] = self._rows(found[chapter])
+                    self.local.set(key, found[chapter])
+            if rows:
+                self.backend.set_many(rows, self.timeout)
+        return dict((chapter, [copy_verse(verse) for verse in verse_list]) for chapter, verse_list in found.items())
+
+    def is_complete(self, version, chapter, verse_list):
+        " Whether verse_list has every verse of the chapter the canon expects. Only those are cached. "
+        canon = version.bible[chapter[0]][chapter[1]]
+        return len(verse_list) >= canon.num_verses - len(canon.omissions)
+
+    def invalidate(self, version):
+        " Drops every chapter of the given translation from both tiers, eg: after importing its text. "
+        keys = [self.key(version, book.number, chapter.number) for book in version.bible for chapter in book]
+        self.backend.delete_many(keys)
+        for key in keys:
+            self.local.delete(key)
+
+    def _rows(self, verse_list):
+        return [(verse.pk, verse.verse_id, verse.ordinal, verse.text) for verse in verse_list]
+
+    def _set_local(self, version, key, chapter, rows):
+        book_id, chapter_id = chapter
+        verse_list = [version(pk=pk, book_id=book_id, chapter_id=chapter_id, verse_id=verse_id, ordinal=ordinal,
+                              text=text) for pk, verse_id, ordinal, text in rows]
+        self.local.set(key, verse_list)
+        return verse_list
+
+    def warm(self, version):
+        """
+        Puts every complete chapter of the given translation in the shared tier, a book at a time.
+        Returns the number of chapters cached.
+        """
+        count = 0
+        for book in version.bible:
+            chapters = [(book.number, chapter.number) for chapter in book]
+            fetched = version.objects.fetch_chapters(chapters)
+            rows = dict((self.key(version, *chapter), self._rows(fetched.get(chapter, []))) for chapter in chapters
+                        if self.is_complete(version, chapter, fetched.get(chapter, [])))
+            self.backend.set_many(rows, self.timeout)
+            count += len(rows)
+        return count
+
+
+class FragmentCache(TieredCache):
+    " Two tier cache of rendered template fragments. "
+
+    def key(self, version, template_name, parts):
+        return 'bibletext:html:%s:%s:%s:%s' % (version.translation, version.get_content_version(),
+                                              template_name, ':'.join(str(part) for part in parts))
+
+    def render(self, version, template_name, parts, context):
+        """
+        Returns template_name rendered with the context dict, from the cache when possible.
+        parts (eg: the page's template name, book and chapter) must identify what the context holds.
+        """
+        key = self.key(version, template_name, parts)
+        html = self.local.get(key)
+        if html is None:
+            html = self.backend.get(key)
+            if html is None:
+                html = render_to_string(template_name, context)
+                self.backend.set(key, html, self.timeout)
+            self.local.set(key, html)
+        return mark_safe(html)
+
+
+chapter_cache = ChapterCache(
+    backend=getattr(settings, 'BIBLETEXT_CACHE_BACKEND', 'default'),
+    timeout=getattr(settings, 'BIBLETEXT_CACHE_TIMEOUT', 60*60*24*30),
+    maxsize=getattr(settings, 'BIBLETEXT_CHAPTER_CACHE_SIZE', 256),
+)
+
+fragment_cache = FragmentCache(
+    backend=getattr(settings, 'BIBLETEXT_CACHE_BACKEND', 'default'),
+    timeout=getattr(settings, 'BIBLETEXT_CACHE_TIMEOUT', 60*60*24*30),
+    maxsize=getattr(settings, 'BIBLETEXT_FRAGMENT_CACHE_SIZE', 256),
+)
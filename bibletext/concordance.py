@@ -0,0 +1,282 @@
+"""
+A concordance of each translation: every word, the verses it's in, and how often it's used in
+each book. Built ahead of time by ``manage.py bibletext_concordance``, so looking a word up
+never scans the verse table, eg::
+
+    from bibletext.concordance import lookup
+    grace = lookup(KJV, 'Grace')
+    grace.occurrences, grace.verse_count, grace.book_counts # Counts, straight from the directory.
+    grace.verses # Python-bible style Verse objects, decompressed on first use.
+
+Files live in BIBLETEXT_CONCORDANCE_DIR (or BIBLETEXT_SEARCH_INDEX_DIR), one per translation::
+
+    header      HEADER, below.
+    directory   zlib compressed marshal of {'hashes': {'book:chapter': md5 of its text},
+                'words': {word: (occurrences, verses, (book, count, book, count, ...), offset, length)},
+                'frequency': [words, most used first]}
+    blocks      Per word, zlib compressed: uint32 differences between its verses' ordinals,
+                then uint16 occurrences in each of those verses.
+
+Rebuilding only re-reads the words of the chapters whose text hash changed.
+"""
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from bibletext.lru import LRUCache
+from bibletext.search.query import normalize, tokenize
+from bibletext.utils import ConcordanceError, chapter_hash, chapter_texts
+
+
+HEADER = struct.Struct('<4sHI')
+MAGIC = 'BTCC'
+FORMAT_VERSION = 1
+
+
+def concordance_path(version):
+    directory = getattr(settings, 'BIBLETEXT_CONCORDANCE_DIR', None) or \
+                getattr(settings, 'BIBLETEXT_SEARCH_INDEX_DIR', None)
+    if not directory:
+        raise ImproperlyConfigured("Set BIBLETEXT_CONCORDANCE_DIR to the directory to keep the concordances in.")
+    return os.path.join(directory, '%s.concordance' % version.translation)
+
+
+def _encode(ordinals, occurrences):
+    deltas = array('I', ordinals)
+    for i in xrange(len(deltas) - 1, 0, -1):
+        deltas[i] -= deltas[i-1]
+    occurrences = array('H', occurrences)
+    if sys.byteorder != 'little':
+        deltas.byteswap()
+        occurrences.byteswap()
+    return zlib.compress(deltas.tostring() + occurrences.tostring())
+
+
+def _decode(block, count):
+    data = zlib.decompress(block)
+    ordinals, occurrences = array('I'), array('H')
+    ordinals.fromstring(data[:count * 4])
+    occurrences.fromstring(data[count * 4:])
+    if sys.byteorder != 'little':
+        ordinals.byteswap()
+        occurrences.byteswap()
+    total = 0
+    for i, delta in enumerate(ordinals):
+        total += delta
+        ordinals[i] = total
+    return ordinals, occurrences
+
+
+class ConcordanceEntry(object):
+    " A word of a translation's concordance. "
+
+    def __init__(self, concordance, word, occurrences, verse_count, book_counts):
+        self.concordance = concordance
+        self.word = word
+        self.occurrences = occurrences
+        self.verse_count = verse_count
+        self._book_counts = book_counts
+
+    def __unicode__(self):
+        return self.word
+
+    @property
+    def book_counts(self):
+        " [(Book, occurrences in it), ...] in canonical order. "
+        bible = self.concordance.bible
+        counts = self._book_counts
+        return [(bible[counts[i]], counts[i+1]) for i in xrange(0, len(counts), 2)]
+
+    @property
+    def ordinals(self):
+        " The ordinals of the verses the word is in. "
+        return self.concordance.postings(self.word)[0]
+
+    @property
+    def verses(self):
+        " The Verses the word is in, eg: for linking to them. "
+        verse_at = self.concordance.bible.verse_at
+        return [verse_at(ordinal) for ordinal in self.ordinals]
+
+
+class Concordance(object):
+    " A concordance file, see build_concordance(). Safe to share between threads. "
+
+    def __init__(self, path, bible):
+        self.bible = bible
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ConcordanceError("%s isn't a concordance this version of bibletext can read, rebuild it." % path)
+        directory = marshal.loads(zlib.decompress(self._map[HEADER.size:HEADER.size + length]))
+        self.hashes = directory['hashes']
+        self.words = directory['words']
+        self.frequency = directory['frequency']
+        self._blocks_offset = HEADER.size + length
+        self._postings = LRUCache(getattr(settings, 'BIBLETEXT_CONCORDANCE_CACHE_SIZE', 256))
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return normalize(word) in self.words
+
+    def close(self):
+        self._map.close()
+
+    def block(self, word):
+        " The word's compressed block, as stored. "
+        offset, length = self.words[word][3:5]
+        start = self._blocks_offset + offset
+        return self._map[start:start + length]
+
+    def lookup(self, word):
+        " The ConcordanceEntry for a word (in any case), or None if the translation never uses it. "
+        word = normalize(word)
+        entry = self.words.get(word)
+        if entry is None:
+            return None
+        return ConcordanceEntry(self, word, entry[0], entry[1], entry[2])
+
+    def postings(self, word):
+        " (ordinals, occurrences in each) arrays for a normalized word. "
+        postings = self._postings.get(word)
+        if postings is None:
+            postings = _decode(self.block(word), self.words[word][1])
+            self._postings.set(word, postings)
+        return postings
+
+    def most_common(self, count=None):
+        " [(word, occurrences), ...] for the count (or all) most used words. "
+        words = self.words
+        return [(word, words[word][0]) for word in self.frequency[:count]]
+
+
+def build_concordance(version, path=None, incremental=True):
+    """
+    Writes the concordance of a translation (atomically). When there's one already, only the
+    chapters whose text changed since are read again. Returns (chapters read, words changed).
+    """
+    path = path or concordance_path(version)
+    bible = version.bible
+    old = None
+    if incremental and os.path.exists(path):
+        try:
+            old = Concordance(path, bible)
+        except ConcordanceError:
+            pass
+
+    hashes = {}
+    changed = {} # (book_id, chapter_id) -> [(verse_id, text), ...]
+    for book_id, chapter_id, verses in chapter_texts(version):
+        key = '%d:%d' % (book_id, chapter_id)
+        hashes[key] = chapter_hash(verses)
+        if old is None or old.hashes.get(key) != hashes[key]:
+            changed[(book_id, chapter_id)] = verses
+    if old is not None: # Chapters deleted since.
+        for key in set(old.hashes) - set(hashes):
+            changed[tuple(int(number) for number in key.split(':'))] = []
+
+    # Word counts of the changed chapters, and the ordinals they span.
+    counts = {} # word -> {ordinal: occurrences}
+    spans = []
+    for (book_id, chapter_id), verses in changed.items():
+        try:
+            first = bible.ordinal_of(book_id, chapter_id, 1)
+        except IndexError:
+            continue # Not in the canon, so never in the concordance.
+        spans.append((first, first + bible[book_id][chapter_id].num_verses - 1))
+        for verse_id, text in verses:
+            try:
+                ordinal = bible.ordinal_of(book_id, chapter_id, verse_id)
+            except IndexError:
+                continue
+            for word in tokenize(text):
+                found = counts.setdefault(word, {})
+                found[ordinal] = found.get(ordinal, 0) + 1
+    spans.sort()
+    changed_books = set(book_id for book_id, chapter_id in changed)
+
+    book_starts = [bible.ordinal_of(book.number, 1, 1) for book in bible]
+    words = {}
+    blocks = []
+    offset = 0
+    changed_words = 0
+    for word in set(old.words if old else ()) | set(counts):
+        entry = old and old.words.get(word)
+        if entry and word not in counts and not changed_books.intersection(entry[2][::2]):
+            block = old.block(word) # Untouched: copied as it is.
+            words[word] = entry[:3] + (offset, len(block))
+            blocks.append(block)
+            offset += len(block)
+            continue
+        changed_words += 1
+        pairs = counts.get(word, {}).items()
+        if entry:
+            ordinals, occurrences = old.postings(word)
+            start = 0
+            for first, last in spans: # Keep what's outside of the changed chapters.
+                end = bisect_left(ordinals, first, start)
+                pairs.extend(zip(ordinals[start:end], occurrences[start:end]))
+                start = bisect_right(ordinals, last, end)
+            pairs.extend(zip(ordinals[start:], occurrences[start:]))
+        if not pairs:
+            continue # No longer used.
+        pairs.sort()
+        ordinals = [ordinal for ordinal, count in pairs]
+        occurrences = [min(count, 0xffff) for ordinal, count in pairs]
+        book_counts = []
+        for number, book_start in enumerate(book_starts, 1):
+            i = bisect_left(ordinals, book_start)
+            j = bisect_left(ordinals, book_starts[number]) if number < len(book_starts) else len(ordinals)
+            if j > i:
+                book_counts.extend((number, sum(occurrences[i:j])))
+        block = _encode(ordinals, occurrences)
+        words[word] = (sum(occurrences), len(ordinals), tuple(book_counts), offset, len(block))
+        blocks.append(block)
+        offset += len(block)
+
+    frequency = sorted(words, key=lambda word: (-words[word][0], word))
+    directory = zlib.compress(marshal.dumps({'hashes': hashes, 'words': words, 'frequency': frequency}, 2))
+    if old is not None:
+        old.close()
+
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(directory)))
+        f.write(directory)
+        for block in blocks:
+            f.write(block)
+    os.rename(temporary, path)
+    return len(changed), changed_words
+
+
+_concordances = {} # translation -> (modification time, Concordance)
+
+def get_concordance(version):
+    " The Concordance of a translation, reopened when it has been rebuilt. "
+    path = concordance_path(version)
+    try:
+        modified = os.stat(path).st_mtime
+    except OSError:
+        raise ConcordanceError("There's no concordance of the %s, run manage.py bibletext_concordance." % version.translation)
+    opened = _concordances.get(version.translation)
+    if opened is None or opened[0] != modified:
+        opened = _concordances[version.translation] = (modified, Concordance(path, version.bible))
+    return opened[1]
+
+
+def lookup(version, word):
+    " The ConcordanceEntry for a word of the given translation, or None if it's never used. "
+    return get_concordance(version).lookup(word)
@@ -0,0 +1,171 @@
+"""
+Static export of a translation: every page the bibletext views serve, written out as
+<path>/index.html files for nginx (or any web server) to serve directly. eg::
+
+    location /bible/ {
+        root /srv/bible-export;
+        try_files $uri $uri/index.html @django;
+    }
+
+See the bibletext_export management command.
+"""
+import os
+import shutil
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection
+from django.test.client import RequestFactory
+from django.utils import simplejson
+
+from bibletext.caching import chapter_cache, fragment_cache
+from bibletext.paging import split_pages
+from bibletext.utils import chapter_hash, chapter_texts
+from bibletext.views import chapter_page_url
+
+
+MANIFEST_NAME = '.bibletext-export-%s.json' # Chapter text hashes, per translation.
+PAGES_KEY = 'pages' # The manifest's record of how the chapters were paged, see chapter_page_size.
+
+
+def chapter_hashes(version):
+    " Returns {'book_id:chapter_id': md5 of the chapter's text} for the whole translation, in one query. "
+    return dict(('%d:%d' % (book_id, chapter_id), chapter_hash(verses))
+                for book_id, chapter_id, verses in chapter_texts(version))
+
+
+def chapter_page_size(version):
+    " The (per_page, max_length) chapters are paged by, from the chapter URL's kwargs or the settings. "
+    view, args, kwargs = resolve(version.bible[1][1].get_absolute_url())
+    return (kwargs.get('per_page') or getattr(settings, 'BIBLETEXT_CHAPTER_PAGE_SIZE', None),
+            kwargs.get('max_length') or getattr(settings, 'BIBLETEXT_CHAPTER_PAGE_LENGTH', None))
+
+
+def chapter_paths(version, book_id, chapter_id):
+    """
+    The URLs of a chapter page and its verse pages (and the book page, which shows chapter 1).
+    When chapters are paged (see bibletext.views.chapter), the URLs of the chapter's other pages too.
+    """
+    chapter = version.bible[book_id][chapter_id]
+    paths = [chapter.get_absolute_url()]
+    per_page, max_length = chapter_page_size(version)
+    if per_page or max_length:
+        verse_list = version.objects.chapter(book_id, chapter_id)
+        paths.extend(chapter_page_url(chapter, page[0].verse_id)
+                     for page in split_pages(verse_list, per_page or len(verse_list), max_length)[1:])
+    if chapter_id == 1:
+        paths.append(chapter.book.get_absolute_url())
+    paths.extend(verse.get_absolute_url() for verse in chapter)
+    return paths
+
+
+def render_page(path):
+    " Renders path through the view it resolves to, returning (status_code, content). "
+    request = RequestFactory().get(path)
+    if 'django.contrib.auth' in settings.INSTALLED_APPS:
+        from django.contrib.auth.models import AnonymousUser
+        request.user = AnonymousUser() # As seen by the auth context processor.
+    view, args, kwargs = resolve(path)
+    response = view(request, *args, **kwargs)
+    return response.status_code, response.content
+
+
+def write_page(output_dir, path, content):
+    " Writes the page to output_dir/path/index.html, atomically so it can be served while exporting. "
+    directory = os.path.join(output_dir, *[part for part in path.split('/') if part])
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filename = os.path.join(directory, 'index.html')
+    temporary = '%s.%d.tmp' % (filename, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.rename(temporary, filename)
+
+
+def remove_stale_pages(output_dir, paths):
+    " Removes the directories of the chapter's pages (from/<n>/) that aren't in its paths, see chapter_paths. "
+    directory = os.path.join(output_dir, *[part for part in paths[0].split('/') if part] + ['from'])
+    if os.path.isdir(directory):
+        current = set(path.rstrip('/').rsplit('/', 1)[-1] for path in paths if path.startswith(paths[0] + 'from/'))
+        for name in os.listdir(directory):
+            if name not in current:
+                shutil.rmtree(os.path.join(directory, name))
+
+
+def export_paths(task):
+    """
+    Pool worker: renders and writes a list of pages. Returns (pages written, [failed paths]), the
+    pages that didn't render (a status other than 200, or an exception) being failed.
+    """
+    output_dir, paths = task
+    written, failed = 0, []
+    for path in paths:
+        try:
+            status_code, content = render_page(path)
+        except Exception: # eg: Http404 or a template error, which would end the whole export.
+            status_code = None
+        if status_code == 200:
+            write_page(output_dir, path, content)
+            written += 1
+        else:
+            failed.append(path)
+    return written, failed
+
+
+def export(version, output_dir, processes=None, incremental=False, progress=None):
+    """
+    Exports the bible list, the translation's index, and all its book, chapter and verse pages.
+
+    With incremental=True only the chapters whose text changed since the last export (according
+    to the manifest kept in output_dir) are rendered again, or every chapter when the chapters
+    are paged differently. Returns (pages written, [failed paths]).
+    """
+    manifest_file = os.path.join(output_dir, MANIFEST_NAME % version.translation)
+    previous = {}
+    if incremental and os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            previous = simplejson.load(f)
+    hashes = chapter_hashes(version)
+    hashes[PAGES_KEY] = list(chapter_page_size(version))
+    if previous.get(PAGES_KEY) != hashes[PAGES_KEY]:
+        previous = {} # Every chapter page links to the others.
+
+    tasks = [(output_dir, [reverse('bibletext_bible_list'), version.bible.get_absolute_url()])]
+    for book in version.bible:
+        for chapter in book:
+            key = '%d:%d' % (book.number, chapter.number)
+            if not incremental or previous.get(key) != hashes.get(key):
+                tasks.append((output_dir, chapter_paths(version, book.number, chapter.number)))
+
+    written, failed = 0, []
+    if processes == 1:
+        results = (export_paths(task) for task in tasks)
+    else:
+        # Each worker opens its own connections, to the database and to the cache backend.
+        connection.close()
+        chapter_cache.close()
+        fragment_cache.close()
+        pool = Pool(processes)
+        results = pool.imap_unordered(export_paths, tasks, chunksize=4)
+    for i, (count, failures) in enumerate(results):
+        written += count
+        failed.extend(failures)
+        if progress:
+            progress(i + 1, len(tasks))
+    if processes != 1:
+        pool.close()
+        pool.join()
+    for output_dir, paths in tasks[1:]:
+        remove_stale_pages(output_dir, paths)
+
+    # Chapters that failed to render are left out of the manifest, so they are tried again next time.
+    for path in failed:
+        try:
+            view, args, kwargs = resolve(path)
+            hashes.pop('%s:%s' % (kwargs['book_id'], kwargs['chapter_id']), None)
+        except KeyError:
+            pass
+    with open(manifest_file, 'w') as f:
+        simplejson.dump(hashes, f)
+    return written, failed
@@ -0,0 +1,524 @@
+"""
+Streaming import of a translation's text, instead of ``loaddata`` (which reads the whole
+fixture into memory and saves the verses one at a time), eg::
+
+    python manage.py bibletext_import KJV kjv.json
+    python manage.py bibletext_import MyTranslation usfm/*.usfm --replace
+
+The readers below yield (book, chapter, verse, text) while reading the file, so memory use
+doesn't depend on its size. Books are numbers or anything Bible.find_book understands.
+
+    json    A Django fixture (what ``dumpdata`` writes), a list of {'book', 'chapter', 'verse',
+            'text'} objects, or one such object per line. book_id etc. work as well.
+    csv     book,chapter,verse,text rows, with or without a header row naming the columns.
+    osis    OSIS XML, with either <verse osisID> containers or sID/eID milestones. Notes are left out.
+    usfm    USFM, one or more files of books. Footnotes, cross references, headings and word
+            attributes are left out.
+
+A gzipped file (.gz) is read as it is. import_verses writes the verses in batches inside a
+single transaction (COPY on PostgreSQL, bulk_create elsewhere), fills in the ordinal, and
+checks each chapter against the canon's verse counts as soon as it has been read; any
+difference raises TextImportError and nothing is imported. Once the verses are in, the
+translation's chapters are dropped from the chapter cache (see bibletext.caching).
+
+import_scripture does the same for Scripture (eg: the references of a sermon archive, see
+``manage.py bibletext_import_scripture``), filling in the fields populate_scripture_details
+would on each save.
+"""
+import codecs
+import csv
+import gzip
+import json
+import os
+import re
+import xml.sax
+from cStringIO import StringIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Model
+
+from bibletext.caching import chapter_cache
+from bibletext.models import KJV, Scripture, VerseText, scripture_index
+from bibletext.models.scripture import scripture_details
+from bibletext.references import parse_verse
+from bibletext.utils import TextImportError
+
+
+BATCH_SIZE = 2000
+CHUNK_SIZE = 64 * 1024
+
+# Book ids of the OSIS and USFM standards, in canonical order.
+OSIS_BOOKS = ('Gen Exod Lev Num Deut Josh Judg Ruth 1Sam 2Sam 1Kgs 2Kgs 1Chr 2Chr Ezra Neh Esth Job Ps Prov '
+              'Eccl Song Isa Jer Lam Ezek Dan Hos Joel Amos Obad Jonah Mic Nah Hab Zeph Hag Zech Mal '
+              'Matt Mark Luke John Acts Rom 1Cor 2Cor Gal Eph Phil Col 1Thess 2Thess 1Tim 2Tim Titus Phlm '
+              'Heb Jas 1Pet 2Pet 1John 2John 3John Jude Rev').split()
+USFM_BOOKS = ('GEN EXO LEV NUM DEU JOS JDG RUT 1SA 2SA 1KI 2KI 1CH 2CH EZR NEH EST JOB PSA PRO '
+              'ECC SNG ISA JER LAM EZK DAN HOS JOL AMO OBA JON MIC NAM HAB ZEP HAG ZEC MAL '
+              'MAT MRK LUK JHN ACT ROM 1CO 2CO GAL EPH PHP COL 1TH 2TH 1TI 2TI TIT PHM '
+              'HEB JAS 1PE 2PE 1JN 2JN 3JN JUD REV').split()
+
+
+def read_json(f):
+    " Yields the verses of a JSON list of verses, or of JSON lines, decoding one at a time. "
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = u''
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+        buffer += text.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in u'[], \t\r\n':
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break # Read some more.
+            yield _json_verse(value)
+        buffer = buffer[position:]
+    if buffer.strip(u'[], \t\r\n'):
+        raise TextImportError("The JSON ends with something that isn't a verse: %s" % buffer[:80])
+
+def _json_verse(value):
+    fields = value.get('fields', value) if isinstance(value, dict) else None
+    try:
+        return (_get(fields, 'book'), _get(fields, 'chapter'), _get(fields, 'verse'), fields['text'])
+    except (KeyError, TypeError):
+        raise TextImportError("Not a verse: %r" % (value,))
+
+def _get(fields, name):
+    return fields[name] if name in fields else fields['%s_id' % name]
+
+
+def read_csv(f):
+    " Yields the verses of book,chapter,verse,text rows. "
+    columns = (0, 1, 2, 3)
+    reader = csv.reader(f)
+    for number, row in enumerate(reader):
+        if not row:
+            continue
+        row = [value.decode('utf-8-sig' if number == 0 else 'utf-8') for value in row]
+        if number == 0 and len(row) > 1 and not row[1].strip().isdigit(): # A header.
+            names = [name.strip().lower() for name in row]
+            try:
+                columns = tuple(names.index(name) if name in names else names.index('%s_id' % name)
+                                for name in ('book', 'chapter', 'verse', 'text'))
+            except ValueError:
+                raise TextImportError("The CSV header needs book, chapter, verse and text columns: %s" % row)
+            continue
+        try:
+            yield tuple(row[column] for column in columns)
+        except IndexError:
+            raise TextImportError("Line %d has %d columns, not 4: %s" % (reader.line_num, len(row), row))
+
+
+class _OSISHandler(xml.sax.ContentHandler):
+    " Collects (book, chapter, verse, text) in self.verses as the verses end. "
+    skipped = ('note',)
+
+    def __init__(self):
+        xml.sax.ContentHandler.__init__(self)
+        self.verses = []
+        self.current = None # [osisID, ...] of the verse being read.
+        self.container = False
+        self.text = []
+        self.skipping = 0 # Depth inside notes.
+
+    def startElement(self, name, attrs):
+        name = name.rsplit(':', 1)[-1]
+        if self.skipping or name in self.skipped or (name == 'title' and attrs.get('canonical') != 'true'):
+            self.skipping += 1
+        elif name == 'verse':
+            if 'eID' in attrs:
+                self.finish()
+            elif 'osisID' in attrs or 'sID' in attrs:
+                self.finish()
+                self.current = (attrs.get('osisID') or attrs.get('sID')).split()
+                self.container = 'sID' not in attrs
+
+    def endElement(self, name):
+        if self.skipping:
+            self.skipping -= 1
+        elif name.rsplit(':', 1)[-1] == 'verse' and self.container:
+            self.finish()
+
+    def characters(self, content):
+        if self.current and not self.skipping:
+            self.text.append(content)
+
+    def finish(self):
+        if self.current:
+            text = u' '.join(u''.join(self.text).split())
+            for osis_id in self.current: # Verses joined into one get the text in the first of them.
+                try:
+                    book, chapter, verse = osis_id.split('.')[:3]
+                    book = OSIS_BOOKS.index(book) + 1
+                except ValueError:
+                    raise TextImportError("Not an OSIS verse id: %s" % osis_id)
+                self.verses.append((book, chapter, verse, text))
+                text = u''
+        self.current = None
+        self.container = False
+        self.text = []
+
+def read_osis(f):
+    " Yields the verses of an OSIS document as they're parsed. "
+    handler = _OSISHandler()
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+        parser.feed(chunk)
+        for verse in handler.verses:
+            yield verse
+        del handler.verses[:]
+    parser.close()
+    handler.finish()
+    for verse in handler.verses:
+        yield verse
+
+
+# Markers, eg: '\v ', '\add ', '\add*'. The space after a closing marker is part of the text.
+usfm_marker_re = re.compile(r'\\(\+?[a-z]+[0-9]*(?:\*|[ \t]?))')
+USFM_NOTES = ('f', 'fe', 'x', 'ef', 'ex')
+# Markers whose text (up to the next marker) isn't part of a verse: identification, headings, titles.
+USFM_SKIPPED = set('id ide h h1 h2 h3 toc1 toc2 toc3 toca1 toca2 toca3 rem sts usfm restore '
+                   'mt mt1 mt2 mt3 mt4 mte mte1 mte2 ms ms1 ms2 ms3 mr s s1 s2 s3 s4 sr r d sp cl cd '
+                   'imt imt1 imt2 is is1 is2 ip ipi im imi ipq imq ipr iq iq1 iq2 ib ili ili1 ili2 iot io '
+                   'io1 io2 ior iex ie'.split())
+
+def read_usfm(f):
+    " Yields the verses of a USFM file of one or more books. "
+    book = chapter = verse = None
+    text = []
+    note = None # The footnote or cross reference marker being skipped, eg: 'f'.
+    skipping = attributes = False
+    for line in codecs.getreader('utf-8-sig')(f):
+        parts = usfm_marker_re.split(line) # [text, marker, text, marker, ..., text]
+        for i, part in enumerate(parts):
+            if i % 2 == 0:
+                if verse is not None and not note and not skipping:
+                    text.append(part.split(u'|', 1)[0] if attributes else part)
+                continue
+            marker = part.strip().lstrip(u'+')
+            if note:
+                if marker == note + u'*':
+                    note = None
+                continue
+            skipping = attributes = False
+            if marker in USFM_NOTES:
+                note = marker
+            elif marker in (u'id', u'c', u'v'):
+                if verse is not None:
+                    yield book, chapter, verse, u' '.join(u''.join(text).split())
+                verse, text = None, []
+                words = parts[i+1].split(None, 1)
+                value = words[0] if words else u''
+                parts[i+1] = words[1] if len(words) > 1 else u''
+                if marker == u'id':
+                    if value.upper() not in USFM_BOOKS:
+                        raise TextImportError("Not a USFM book id: %s" % value)
+                    book = USFM_BOOKS.index(value.upper()) + 1
+                    skipping = True
+                elif marker == u'c':
+                    chapter = value
+                else:
+                    verse = value
+            elif marker in USFM_SKIPPED:
+                skipping = True
+            else:
+                attributes = marker == u'w' # \w word|lemma="..."\w*
+        text.append(u' ')
+    if verse is not None:
+        yield book, chapter, verse, u' '.join(u''.join(text).split())
+
+
+READERS = {
+    'json': read_json,
+    'csv': read_csv,
+    'osis': read_osis,
+    'usfm': read_usfm,
+}
+EXTENSIONS = {
+    '.json': 'json', '.jsonl': 'json',
+    '.csv': 'csv',
+    '.xml': 'osis', '.osis': 'osis',
+    '.usfm': 'usfm', '.sfm': 'usfm', '.ptx': 'usfm',
+}
+
+def read(path, format=None):
+    " Yields the verses of a file, in the given format or the one its extension suggests. "
+    name = path[:-3] if path.endswith('.gz') else path
+    format = format or EXTENSIONS.get(os.path.splitext(name)[1].lower())
+    if format not in READERS:
+        raise TextImportError("Can't tell the format of %s, give one of: %s." % (path, ', '.join(sorted(READERS))))
+    f = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    try:
+        for verse in READERS[format](f):
+            yield verse
+    finally:
+        f.close()
+
+
+def _copy(cursor, table, rows, columns=('book_id', 'chapter_id', 'verse_id', 'ordinal', 'text')):
+    " PostgreSQL's COPY, the fastest way in. "
+    data = StringIO()
+    for row in rows:
+        data.write(u'\t'.join(u'\\N' if value is None else
+                              unicode(value).replace(u'\\', u'\\\\').replace(u'\t', u'\\t').replace(u'\n', u'\\n')
+                              .replace(u'\r', u'\\r') for value in row).encode('utf-8'))
+        data.write('\n')
+    data.seek(0)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN' % (table, ', '.join(columns)), data)
+
+
+def import_verses(version, verses, replace=False, batch_size=BATCH_SIZE, progress=None):
+    """
+    Writes verses into a translation's table in one transaction, returning (the number of
+    verses, [(book_id, chapter_id), ...] of the canon's chapters that weren't given).
+
+    @args::
+
+        `version`: The VerseText implementation, eg: KJV.
+
+        `verses`: (book, chapter, verse, text) in canonical order, eg: from read(path).
+        Each chapter is checked against the canon once it's complete.
+
+        `replace`: Delete the translation's verses first. Otherwise it must have none.
+
+        `progress`: Called with (verses written, verses in the canon) after each batch.
+
+    """
+    using = version.objects.db
+    connection = connections[using]
+    bible = version.bible
+    table = connection.ops.quote_name(version._meta.db_table)
+    total = bible.num_verses
+    written = 0
+    seen = set()
+
+    def check(key, numbers):
+        book_id, chapter_id = key
+        if key in seen:
+            raise TextImportError("%s %s is given twice, or the verses aren't in order." % (bible[book_id], chapter_id))
+        seen.add(key)
+        chapter = bible[book_id][chapter_id]
+        expected = set(xrange(1, chapter.num_verses + 1)) - set(chapter.omissions)
+        if numbers != expected:
+            missing, extra = sorted(expected - numbers), sorted(numbers - expected)
+            raise TextImportError("%s has %d verses, the canon has %d.%s%s" % (
+                chapter, len(numbers), len(expected),
+                " Missing: %s." % ', '.join(map(str, missing)) if missing else '',
+                " Not in the canon: %s." % ', '.join(map(str, extra)) if extra else ''))
+
+    with transaction.commit_on_success(using=using):
+        cursor = connection.cursor()
+        if replace:
+            cursor.execute('DELETE FROM %s' % table)
+        elif version.objects.exists():
+            raise TextImportError("The %s already has verses, replace them or delete them first." % version.translation)
+
+        batch = []
+        current, numbers = None, set()
+        for book, chapter_id, verse_id, text in verses:
+            try:
+                book_id = int(book)
+            except ValueError:
+                found = bible.find_book(book)
+                if found is None:
+                    raise TextImportError("Could not find that book of the %s: %s." % (version.translation, book))
+                book_id = found.number
+            try:
+                chapter_id, verse_id = int(chapter_id), int(verse_id)
+            except ValueError:
+                raise TextImportError("Not a chapter and verse: %s:%s" % (chapter_id, verse_id))
+            if (book_id, chapter_id) != current:
+                if current:
+                    check(current, numbers)
+                current, numbers = (book_id, chapter_id), set()
+            if verse_id in numbers:
+                raise TextImportError("%s %d:%d is given twice." % (bible[book_id], chapter_id, verse_id))
+            numbers.add(verse_id)
+            try:
+                ordinal = bible.ordinal_of(book_id, chapter_id, verse_id)
+            except IndexError:
+                raise TextImportError("%s %d:%d isn't in the canon." % (book, chapter_id, verse_id))
+            batch.append((book_id, chapter_id, verse_id, ordinal, text))
+
+            if len(batch) >= batch_size:
+                written += _write(version, connection, cursor, table, batch)
+                batch = []
+                if progress:
+                    progress(written, total)
+        if current:
+            check(current, numbers)
+        if batch:
+            written += _write(version, connection, cursor, table, batch)
+            if progress:
+                progress(written, total)
+    chapter_cache.invalidate(version)
+
+    missing = [(book.number, chapter.number) for book in bible for chapter in book
+               if (book.number, chapter.number) not in seen]
+    return written, missing
+
+def _write(version, connection, cursor, table, batch):
+    if connection.vendor == 'postgresql':
+        _copy(cursor, table, batch)
+    else: # bulk_create skips pre_save, which is why the ordinal is filled in above.
+        _bulk_create(version, connection, [version(book_id=book_id, chapter_id=chapter_id, verse_id=verse_id,
+                                                   ordinal=ordinal, text=text)
+                                           for book_id, chapter_id, verse_id, ordinal, text in batch])
+    return len(batch)
+
+def _bulk_create(model, connection, objects):
+    """
+    bulk_create, in as many statements as SQLite needs: Django 1.4 writes each call as one
+    INSERT ... SELECT ... UNION ..., and SQLite takes at most 999 variables and 500 SELECTs.
+    """
+    size = len(objects)
+    if connection.vendor == 'sqlite':
+        size = min(500, 999 // len(model._meta.local_fields))
+    for start in range(0, len(objects), size or 1):
+        model.objects.bulk_create(objects[start:start + size])
+
+
+SCRIPTURE_COLUMNS = ('content_type', 'object_id', 'start_verse', 'end_verse', 'version')
+MAX_ERRORS = 20 # Reported by import_scripture.
+
+def read_scripture_csv(f):
+    """
+    Yields (content_type, object_id, start_verse, end_verse, version) of CSV rows, eg:
+    ``sermons.sermon,12,John 3:16,John 3:18,KJV``. end_verse and version may be left out, and a
+    header row naming the columns lets them come in any order.
+    """
+    columns = range(len(SCRIPTURE_COLUMNS))
+    for number, row in enumerate(csv.reader(f)):
+        if not row:
+            continue
+        row = [value.decode('utf-8-sig' if number == 0 else 'utf-8').strip() for value in row]
+        if number == 0 and len(row) > 1 and not row[1].isdigit(): # A header.
+            names = [name.lower() for name in row]
+            if not set(SCRIPTURE_COLUMNS[:3]) <= set(names):
+                raise TextImportError("The CSV header needs content_type, object_id and start_verse columns: %s" % row)
+            columns = [names.index(name) if name in names else None for name in SCRIPTURE_COLUMNS]
+            continue
+        if len(row) < 3:
+            raise TextImportError("Row %d has %d columns, not at least 3: %s" % (number + 1, len(row), row))
+        yield tuple(row[column] if column is not None and column < len(row) else u'' for column in columns)
+
+
+def import_scripture(scripture, version=None, batch_size=BATCH_SIZE, progress=None):
+    """
+    Writes Scripture with bulk_create, skipping the pre_save parsing of each, in one
+    transaction. Returns the number written.
+
+    @args::
+
+        `scripture`: (content_type, object_id, start_verse, end_verse, version) rows, eg: from
+        read_scripture_csv. The content type is a ContentType, a model or 'app_label.model';
+        end_verse and version may be empty.
+
+        `version`: The version of rows without one, a VerseText model or translation code. KJV by default.
+
+        `progress`: Called with the number of Scripture written after each batch.
+
+    Each batch is checked against the canon before it's written. Every row is still checked
+    after a bad one, and TextImportError then lists (the first MAX_ERRORS of) them, with
+    nothing written. References are parsed once each, however many rows share them.
+    """
+    using = Scripture.objects.db
+    default_version = version or KJV
+    parsed = {} # reference -> python-bible Verse, or the error parsing it.
+    content_types = {}
+    versions = {}
+    errors = []
+    written = 0
+    fields = [field.attname for field in Scripture._meta.fields] # Made positionally, it's twice as fast.
+
+    def verse(reference):
+        if reference not in parsed:
+            try:
+                parsed[reference] = parse_verse(reference)
+            except Exception as e: # python-bible raises all sorts.
+                parsed[reference] = TextImportError(u"%s: %s" % (reference, e))
+        if isinstance(parsed[reference], Exception):
+            raise parsed[reference]
+        return parsed[reference]
+
+    def content_type(value):
+        if value not in content_types:
+            if isinstance(value, ContentType):
+                content_types[value] = value
+            elif isinstance(value, type) and issubclass(value, Model):
+                content_types[value] = ContentType.objects.get_for_model(value)
+            else:
+                try:
+                    content_types[value] = ContentType.objects.get_by_natural_key(*value.lower().split('.'))
+                except (ContentType.DoesNotExist, TypeError):
+                    raise TextImportError("No such content type (app_label.model): %s" % value)
+        return content_types[value]
+
+    def version_of(value):
+        value = value or default_version
+        if value not in versions:
+            model = VerseText.registry.get(value) if isinstance(value, basestring) else value
+            if model not in VerseText.registry.values():
+                raise TextImportError("Not a registered version: %s" % value)
+            versions[value] = (ContentType.objects.get_for_model(model), model.bible)
+        return versions[value]
+
+    def check(batch):
+        " The batch as Scripture, recording the errors of the bad rows instead. "
+        found = []
+        for number, (kind, object_id, start_verse, end_verse, version) in batch:
+            try:
+                try:
+                    object_id = int(object_id)
+                except (TypeError, ValueError):
+                    raise TextImportError("Not an object id: %s" % object_id)
+                version, canon = version_of(version)
+                start, end = verse(start_verse), end_verse and verse(end_verse) or None
+                try:
+                    details = scripture_details(start, end, canon)
+                except IndexError:
+                    raise TextImportError(u"%s isn't in the canon of the %s." % (
+                        u' - '.join(filter(None, [start_verse, end_verse])), version.model_class().translation))
+                if details['end_ordinal'] < details['start_ordinal']:
+                    raise TextImportError(u"%s ends before it starts." % u' - '.join([start_verse, end_verse]))
+                details.update(content_type_id=content_type(kind).pk, object_id=object_id, version_id=version.pk,
+                               start_verse=start_verse, end_verse=end_verse or u'')
+                found.append(Scripture(*[details.get(name) for name in fields]))
+            except TextImportError as e:
+                errors.append(u"Row %d: %s" % (number, unicode(e)))
+        return found
+
+    with transaction.commit_on_success(using=using):
+        batch = []
+        for row in enumerate(scripture, 1):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                written += _write_scripture(check(batch), errors, progress, written)
+                batch = []
+        written += _write_scripture(check(batch), errors, progress, written)
+        if errors:
+            raise TextImportError(u"%d of the Scripture can't be imported, so none were:\n%s%s" % (
+                len(errors), u'\n'.join(errors[:MAX_ERRORS]), u'\n...' if len(errors) > MAX_ERRORS else u''))
+    scripture_index.clear()
+    return written
+
+def _write_scripture(batch, errors, progress, written):
+    if errors or not batch: # Nothing will be kept, the rest is only checked.
+        return 0
+    connection = connections[Scripture.objects.db]
+    if connection.vendor == 'postgresql':
+        fields = [field for field in Scripture._meta.fields if field is not Scripture._meta.pk]
+        _copy(connection.cursor(), connection.ops.quote_name(Scripture._meta.db_table),
+              [[getattr(scripture, field.attname) for field in fields] for scripture in batch],
+              [connection.ops.quote_name(field.column) for field in fields])
+    else:
+        _bulk_create(Scripture, connection, batch)
+    if progress:
+        progress(written + len(batch))
+    return len(batch)
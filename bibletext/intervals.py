@@ -0,0 +1,69 @@
+"""
+A static interval tree over closed integer intervals, such as the (start, end) verse ordinals
+of Scripture passages. See bibletext.models.scripture.ScriptureIndex for its use.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+
+class IntervalTree(object):
+    """
+    Built once from [(start, end, value), ...], then queried for the values whose intervals
+    overlap, contain, or lie within another interval; results come in order of start.
+
+    The intervals are sorted by start and read as an implicit balanced binary tree (each
+    index is the middle of one subtree), where every node keeps the greatest end under it.
+    Queries skip the subtrees ending too early, so take O(log n + results).
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=itemgetter(0, 1))
+        self.starts = array('l', [start for start, end, value in intervals])
+        self.ends = array('l', [end for start, end, value in intervals])
+        self.values = [value for start, end, value in intervals]
+        self._max_ends = array('l', self.ends)
+        self._build(0, len(self.ends))
+
+    def __len__(self):
+        return len(self.values)
+
+    def _build(self, lo, hi):
+        " Fills in _max_ends for the subtree of [lo, hi), returning its greatest end. "
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        self._max_ends[mid] = max(self.ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self._max_ends[mid]
+
+    def _search(self, limit, least_end):
+        " The indexes below limit (so starting early enough) whose intervals end at least_end or later. "
+        found = []
+        starts, ends, max_ends = self.starts, self.ends, self._max_ends
+        def search(lo, hi):
+            if lo >= hi or lo >= limit:
+                return
+            mid = (lo + hi) // 2
+            if max_ends[mid] < least_end:
+                return
+            search(lo, mid)
+            if mid < limit:
+                if ends[mid] >= least_end:
+                    found.append(mid)
+                search(mid + 1, hi)
+        search(0, len(starts))
+        return found
+
+    def overlapping(self, start, end):
+        " The values of the intervals sharing a point with start-end. "
+        return [self.values[i] for i in self._search(bisect_right(self.starts, end), start)]
+
+    def containing(self, start, end):
+        " The values of the intervals covering all of start-end, eg: containing(n, n) for a point. "
+        return [self.values[i] for i in self._search(bisect_right(self.starts, start), end)]
+
+    def within(self, start, end):
+        " The values of the intervals lying inside start-end. "
+        ends = self.ends
+        return [self.values[i] for i in xrange(bisect_left(self.starts, start), bisect_right(self.starts, end))
+                if ends[i] <= end]
@@ -0,0 +1,66 @@
+"""
+A small thread-safe least-recently-used cache with hit/miss statistics.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """
+    Maps keys to values, discarding the least recently used entries past ``maxsize``.
+
+    Safe to share between threads; values are computed outside of the lock so a slow
+    miss never blocks the other threads' hits.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value # Now the most recently used.
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, function, *args):
+        " Returns the cached value for key, calling function(*args) to fill it in on a miss. "
+        missing = self._missing
+        value = self.get(key, missing)
+        if value is missing:
+            value = function(*args)
+            self.set(key, value)
+        return value
+    _missing = object()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        " Statistics, eg: {'hits': 10, 'misses': 2, 'size': 2, 'maxsize': 1024} "
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
@@ -0,0 +1,87 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.models import VerseText
+from bibletext.store import BLOCK_SIZE, TextStore, pack
+
+
+class Command(BaseCommand):
+    args = '[translation ...]'
+    help = ("Packs the given translations (default: all registered versions) raw and compressed into "
+            "a temporary directory, and compares their sizes and the time reading chapters and "
+            "passages from them takes. See bibletext.store.")
+    option_list = BaseCommand.option_list + (
+        make_option('--reads', type='int', dest='reads', default=2000,
+            help='Random chapters (and passages) read from each file, 2000 by default.'),
+        make_option('--block-size', type='int', dest='block_size', default=BLOCK_SIZE,
+            help='The least text in a compressed block, %d bytes by default (0: a block per chapter).' % BLOCK_SIZE),
+        make_option('--seed', type='int', dest='seed', default=0,
+            help='Seeds the random reads, so runs can be compared.'),
+    )
+    
+    def handle(self, *translations, **options):
+        versions = VerseText.registry.values()
+        if translations:
+            missing = set(translations) - set(VerseText.registry)
+            if missing:
+                raise CommandError("Unknown translation(s): %s" % ', '.join(sorted(missing)))
+            versions = [VerseText.registry[translation] for translation in translations]
+        
+        directory = tempfile.mkdtemp()
+        try:
+            for version in versions:
+                self.benchmark(version, directory, options)
+        finally:
+            shutil.rmtree(directory)
+    
+    def benchmark(self, version, directory, options):
+        bible = version.bible
+        rand = random.Random(options['seed'])
+        chapters = [(book.number, chapter.number) for book in bible for chapter in book]
+        chapters = [rand.choice(chapters) for i in xrange(options['reads'])]
+        # Passages of 1 to 30 verses starting anywhere, some of them across chapters.
+        passages = []
+        for i in xrange(options['reads']):
+            first = rand.randint(1, bible.num_verses)
+            passages.append((first, min(first + rand.randint(0, 29), bible.num_verses)))
+        
+        self.stdout.write("%s, %d reads of each:\n" % (version.translation, options['reads']))
+        self.stdout.write("    %-12s %10s %12s %12s %12s %12s\n" % (
+            '', 'size', 'chapter', 'with LRU', 'passage', 'with LRU'))
+        for compress in (False, True):
+            path = os.path.join(directory, '%s.%s.text' % (version.translation, 'compressed' if compress else 'raw'))
+            pack(version, path, compress=compress, block_size=options['block_size'])
+            store = TextStore(path)
+            try:
+                timings = []
+                for workload in (self.read_chapters, self.read_passages):
+                    reads = chapters if workload == self.read_chapters else passages
+                    for warm in (False, True):
+                        if warm and not compress:
+                            timings.append('-') # No blocks to keep.
+                            continue
+                        start = time.time()
+                        workload(version, store, reads, warm)
+                        timings.append('%.1fus' % ((time.time() - start) * 1000000 / len(reads)))
+            finally:
+                store.close()
+            self.stdout.write("    %-12s %9.1fM %12s %12s %12s %12s\n" % (
+                (('compressed' if compress else 'raw'), os.path.getsize(path) / 1048576.0) + tuple(timings)))
+    
+    def read_chapters(self, version, store, chapters, warm):
+        for chapter in chapters:
+            if store.compressed and not warm:
+                store._blocks.clear()
+            store.chapters(version, [chapter])
+    
+    def read_passages(self, version, store, passages, warm):
+        for first, last in passages:
+            if store.compressed and not warm:
+                store._blocks.clear()
+            store.verses(first, last)
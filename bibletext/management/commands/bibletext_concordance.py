@@ -0,0 +1,29 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.concordance import build_concordance
+from bibletext.models import VerseText
+
+
+class Command(BaseCommand):
+    args = '[translation ...]'
+    help = ("Builds the concordance of the given translations (default: all registered versions), "
+            "only reading the chapters changed since the last build. See bibletext.concordance.")
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_false', dest='incremental', default=True,
+            help='Read every chapter again, rather than just the changed ones.'),
+    )
+    
+    def handle(self, *translations, **options):
+        versions = VerseText.registry.values()
+        if translations:
+            missing = set(translations) - set(VerseText.registry)
+            if missing:
+                raise CommandError("Unknown translation(s): %s" % ', '.join(sorted(missing)))
+            versions = [VerseText.registry[translation] for translation in translations]
+        
+        for version in versions:
+            chapters, words = build_concordance(version, incremental=options['incremental'])
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write("%s: read %d chapters, %d words changed.\n" % (version.translation, chapters, words))
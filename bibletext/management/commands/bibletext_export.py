@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.export import export
+from bibletext.models import VerseText
+
+
+class Command(BaseCommand):
+    args = 'output_dir [translation ...]'
+    help = ("Renders every page of the given translations (default: all registered versions) "
+            "into output_dir as static files, see bibletext.export.")
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', default=None,
+            help='Number of rendering processes. Defaults to the number of CPUs.'),
+        make_option('--incremental', action='store_true', dest='incremental', default=False,
+            help='Only render the chapters whose text changed since the last export.'),
+    )
+    
+    def handle(self, output_dir=None, *translations, **options):
+        if not output_dir:
+            raise CommandError("Give the directory to export to.")
+        versions = VerseText.registry.values()
+        if translations:
+            missing = set(translations) - set(VerseText.registry)
+            if missing:
+                raise CommandError("Unknown translation(s): %s" % ', '.join(sorted(missing)))
+            versions = [VerseText.registry[translation] for translation in translations]
+        
+        verbosity = int(options.get('verbosity', 1))
+        def progress(done, total):
+            if verbosity > 1 or (verbosity > 0 and done == total):
+                self.stdout.write("\r%d/%d chapters" % (done, total))
+        
+        for version in versions:
+            written, failed = export(version, output_dir, options['processes'], options['incremental'], progress)
+            if verbosity > 0:
+                self.stdout.write("\n%s: wrote %d pages.\n" % (version.translation, written))
+            for path in failed:
+                self.stderr.write("Could not render %s\n" % path)
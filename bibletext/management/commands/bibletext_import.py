@@ -0,0 +1,48 @@
+from itertools import chain
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.importer import BATCH_SIZE, READERS, import_verses, read
+from bibletext.models import VerseText
+from bibletext.utils import TextImportError
+
+
+class Command(BaseCommand):
+    args = 'translation file [file ...]'
+    help = ("Imports the text of a translation from JSON (eg: a fixture), CSV, OSIS or USFM files, "
+            "streaming them in batches in one transaction. See bibletext.importer.")
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None, choices=sorted(READERS),
+            help='The format of the files, when their extension doesn\'t tell: %s.' % ', '.join(sorted(READERS))),
+        make_option('--replace', action='store_true', dest='replace', default=False,
+            help='Delete the translation\'s verses first.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=BATCH_SIZE,
+            help='Verses written at a time, %d by default.' % BATCH_SIZE),
+    )
+    
+    def handle(self, translation=None, *paths, **options):
+        if translation not in VerseText.registry:
+            raise CommandError("Give a registered translation (%s) and the files to import." % ', '.join(VerseText.registry))
+        if not paths:
+            raise CommandError("Give the files to import.")
+        version = VerseText.registry[translation]
+        
+        verbosity = int(options.get('verbosity', 1))
+        def progress(done, total):
+            if verbosity > 0:
+                self.stdout.write("\r%d/%d verses" % (done, total))
+        
+        verses = chain.from_iterable(read(path, options['format']) for path in paths)
+        try:
+            written, missing = import_verses(version, verses, options['replace'], options['batch_size'], progress)
+        except (TextImportError, IOError) as e:
+            raise CommandError(e)
+        if verbosity > 0:
+            self.stdout.write("\n%s: imported %d verses.\n" % (version.translation, written))
+            if missing:
+                self.stdout.write("%d chapters of the canon weren't in the files, eg: %s %d.\n"
+                                  % (len(missing), version.bible[missing[0][0]], missing[0][1]))
+            self.stdout.write("Dropped its chapters from the cache. Restart running processes (or change the "
+                              "translation's content version, BIBLETEXT_CONTENT_VERSIONS) to drop the chapters "
+                              "they keep in memory, and pack its text store again if it has one.\n")
@@ -0,0 +1,46 @@
+import gzip
+from itertools import chain
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.importer import BATCH_SIZE, import_scripture, read_scripture_csv
+from bibletext.models import VerseText
+from bibletext.utils import TextImportError
+
+
+class Command(BaseCommand):
+    args = 'file [file ...]'
+    help = ("Imports Scripture from CSV files of content_type,object_id,start_verse[,end_verse[,version]] rows "
+            "(eg: sermons.sermon,12,John 3:16,John 3:18) in batches, in one transaction. See bibletext.importer.")
+    option_list = BaseCommand.option_list + (
+        make_option('--translation', dest='translation', default='KJV',
+            help='The translation of rows without one, KJV by default.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=BATCH_SIZE,
+            help='Scripture written at a time, %d by default.' % BATCH_SIZE),
+    )
+    
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError("Give the files to import.")
+        if options['translation'] not in VerseText.registry:
+            raise CommandError("Unknown translation: %s" % options['translation'])
+        
+        verbosity = int(options.get('verbosity', 1))
+        def progress(done):
+            if verbosity > 0:
+                self.stdout.write("\r%d scripture references" % done)
+        
+        files = []
+        try:
+            for path in paths:
+                files.append(gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb'))
+            written = import_scripture(chain.from_iterable(read_scripture_csv(f) for f in files),
+                                       options['translation'], options['batch_size'], progress)
+        except (TextImportError, IOError) as e:
+            raise CommandError(e)
+        finally:
+            for f in files:
+                f.close()
+        if verbosity > 0:
+            self.stdout.write("\nImported %d scripture references.\n" % written)
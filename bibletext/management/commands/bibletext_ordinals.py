@@ -0,0 +1,75 @@
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from bible import RangeError # python-bible module.
+
+from bibletext.models import Scripture, VerseText
+from bibletext.models.scripture import interval_key, scripture_ordinals
+
+
+class Command(BaseCommand):
+    args = '[translation ...]'
+    help = ("Fills in VerseText.ordinal, and the ordinals of Scripture, for the given "
+            "translations (default: all registered versions). Run this once on databases loaded before "
+            "the ordinal columns existed.")
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Recompute every ordinal, not just the missing ones.'),
+    )
+    
+    def handle(self, *translations, **options):
+        versions = VerseText.registry.values()
+        if translations:
+            found = [version for version in versions if version.translation in translations]
+            missing = set(translations) - set(version.translation for version in found)
+            if missing:
+                raise CommandError("Unknown translation(s): %s" % ', '.join(sorted(missing)))
+            versions = found
+        
+        for version in versions:
+            updated = self.backfill(version, options['all'])
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write("%s: set the ordinal of %d verses.\n" % (version.translation, updated))
+        
+        updated, skipped = self.backfill_scripture(versions, options['all'])
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("Set the ordinals of %d scripture references.\n" % updated)
+        for scripture in skipped:
+            self.stderr.write("Skipped Scripture %d (%s): it isn't in the canon of its version.\n"
+                              % (scripture.pk, ' - '.join(filter(None, (scripture.start_verse, scripture.end_verse)))))
+    
+    @transaction.commit_on_success
+    def backfill(self, version, recompute=False):
+        " One UPDATE per chapter: ordinal = verses preceding the chapter + verse_id. "
+        updated = 0
+        for book in version.bible:
+            for chapter in book:
+                verse_list = version.objects.filter(book_id=book.number, chapter_id=chapter.number)
+                if not recompute:
+                    verse_list = verse_list.filter(ordinal__isnull=True)
+                updated += verse_list.update(ordinal=F('verse_id') + (chapter[1].ordinal - 1))
+        return updated
+    
+    @transaction.commit_on_success
+    def backfill_scripture(self, versions, recompute=False):
+        """
+        One UPDATE per Scripture, without the pre_save parsing of the rest of its fields. Returns the
+        number updated, and the Scripture skipped for references their version's canon doesn't have.
+        """
+        scripture_list = Scripture.objects.filter(version__in=[ContentType.objects.get_for_model(version) for version in versions])
+        if not recompute:
+            scripture_list = scripture_list.filter(start_ordinal__isnull=True)
+        updated, skipped = 0, []
+        for scripture in scripture_list.only('version', 'start_verse', 'end_verse').iterator():
+            try:
+                start, end = scripture_ordinals(scripture)
+            except (IndexError, RangeError):
+                skipped.append(scripture)
+                continue
+            updated += Scripture.objects.filter(pk=scripture.pk).update(start_ordinal=start, end_ordinal=end,
+                                                                        interval_key=interval_key(start, end))
+        return updated, skipped
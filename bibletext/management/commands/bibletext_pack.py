@@ -0,0 +1,31 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.models import VerseText
+from bibletext.store import BLOCK_SIZE, pack, store_path
+
+
+class Command(BaseCommand):
+    args = '[translation ...]'
+    help = ("Packs the text of the given translations (default: all registered versions) into "
+            "BIBLETEXT_TEXT_STORE, to be read from there instead of the database. See bibletext.store.")
+    option_list = BaseCommand.option_list + (
+        make_option('--compress', action='store_true', dest='compress', default=False,
+            help='Compress the text in blocks of whole chapters, a third of the size but slower to read.'),
+        make_option('--block-size', type='int', dest='block_size', default=BLOCK_SIZE,
+            help='The least text in a compressed block, %d bytes by default (0: a block per chapter).' % BLOCK_SIZE),
+    )
+    
+    def handle(self, *translations, **options):
+        versions = VerseText.registry.values()
+        if translations:
+            missing = set(translations) - set(VerseText.registry)
+            if missing:
+                raise CommandError("Unknown translation(s): %s" % ', '.join(sorted(missing)))
+            versions = [VerseText.registry[translation] for translation in translations]
+        
+        for version in versions:
+            count = pack(version, compress=options['compress'], block_size=options['block_size'])
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write("%s: packed %d verses into %s.\n" % (version.translation, count, store_path(version)))
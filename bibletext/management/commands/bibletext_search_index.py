@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.models import VerseText
+from bibletext.search import build_index
+
+
+class Command(BaseCommand):
+    args = '[translation ...]'
+    help = ("Builds the full-text search index of the given translations (default: all registered "
+            "versions), see bibletext.search.")
+    
+    def handle(self, *translations, **options):
+        versions = VerseText.registry.values()
+        if translations:
+            missing = set(translations) - set(VerseText.registry)
+            if missing:
+                raise CommandError("Unknown translation(s): %s" % ', '.join(sorted(missing)))
+            versions = [VerseText.registry[translation] for translation in translations]
+        
+        for version in versions:
+            count = build_index(version)
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write("%s: indexed %d verses.\n" % (version.translation, count))
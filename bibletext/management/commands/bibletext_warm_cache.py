@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bibletext.caching import chapter_cache
+from bibletext.models import VerseText
+
+
+class Command(BaseCommand):
+    args = '[translation ...]'
+    help = ("Loads every chapter of the given translations (default: all registered versions) "
+            "into the shared chapter cache, see bibletext.caching.")
+    
+    def handle(self, *translations, **options):
+        versions = VerseText.registry.values()
+        if translations:
+            missing = set(translations) - set(VerseText.registry)
+            if missing:
+                raise CommandError("Unknown translation(s): %s" % ', '.join(sorted(missing)))
+            versions = [VerseText.registry[translation] for translation in translations]
+        
+        for version in versions:
+            count = chapter_cache.warm(version)
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write("%s: cached %d chapters.\n" % (version.translation, count))
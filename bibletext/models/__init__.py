@@ -1,3 +1,3 @@
 from bibles import *
 from kjv import KJV
-from scripture import Scripture
\ No newline at end of file
+from scripture import Scripture, prefetch_scripture_text, scripture_index
\ No newline at end of file
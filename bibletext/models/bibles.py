@@ -1,16 +1,38 @@
+import operator
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_syncdb, pre_save
 from django.db.utils import DatabaseError
+from django.utils.datastructures import SortedDict
 from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
 
 import bible # python-bible module. See http://github.com/jasford/python-bible
 
+from bibletext.caching import chapter_cache
+from bibletext.paging import page_size, take_page
+from bibletext.references import parse_ranges, parse_verse
+from bibletext.store import get_store
 from fields import VerseField
 
 
+# Case, whitespace and punctuation are ignored when looking up book names, see Bible.find_book.
+book_key_re = re.compile(r'[\W_]+', re.UNICODE)
+
+def book_key(name):
+    " 'St. John' -> 'stjohn', '1 Cor.' -> '1cor' "
+    return book_key_re.sub(u'', name).lower()
+
+
 class BibleBase(object):
     " Base class from which Bible, Book, and Verse implement. "
+    __slots__ = () # Chapter and Verse are lightweight views, see their __slots__.
     
     def __repr__(self):
         return u'<%s: %s>' % (self.__class__.__name__, self.__str__())
@@ -47,6 +69,8 @@ class Bible(BibleBase):
         self.name = name
         self.translation = translation # Letter code, eg: 'KJV'
         self._books = [] # Populate with self._set_books(book_data)
+        self._book_index = {} # book_key(name or abbreviation) -> Book, see self.find_book()
+        self._book_offsets = array('L', [0]) # Verses preceding each book, see Verse.ordinal.
         
         self._chapter_text = chapter_text
         self._psalm_text = psalm_text
@@ -81,8 +105,25 @@ class Bible(BibleBase):
         """
         book_num = 1
         for data in book_data:
-            self._books.append(Book(self, number=book_num, **data))
+            book = Book(self, number=book_num, **data)
+            self._books.append(book)
+            self._book_offsets.append(self._book_offsets[-1] + book.num_verses)
             book_num += 1
+        
+        self._book_index = {}
+        for book in self._books:
+            for abbreviation in book.abbreviations or []:
+                self._book_index[book_key(abbreviation)] = book
+        for book in self._books: # Names win over another book's abbreviation.
+            self._book_index[book_key(book.shortname)] = book
+            self._book_index[book_key(book.name)] = book
+    
+    def find_book(self, name):
+        """
+        Returns the Book with the given name, short name or abbreviation, or None.
+        Case, spaces and punctuation don't matter: 'St. John', 'john', '1 Cor.' and '1COR' all work.
+        """
+        return self._book_index.get(book_key(name))
 
     @property
     def num_books(self):
@@ -100,10 +141,26 @@ class Bible(BibleBase):
     
     @property
     def num_verses(self):
-        num = 0
-        for book in self:
-            num += book.num_verses
-        return num
+        return self._book_offsets[-1]
+    
+    def ordinal_of(self, book, chapter, verse):
+        " Returns the absolute position of book chapter:verse in this Bible (Genesis 1:1 is 1). "
+        if not 1 <= book <= len(self._books):
+            raise IndexError
+        book = self._books[book-1]
+        if not 1 <= chapter <= book.num_chapters or not 1 <= verse <= book._verse_counts[chapter-1]:
+            raise IndexError
+        return self._book_offsets[book.number-1] + book._chapter_offsets[chapter-1] + verse
+    
+    def verse_at(self, ordinal):
+        " Returns the Verse at the given absolute position, the inverse of ordinal_of. "
+        if not 1 <= ordinal <= self.num_verses:
+            raise IndexError
+        offset = ordinal - 1
+        book = self._books[bisect_right(self._book_offsets, offset) - 1]
+        offset -= self._book_offsets[book.number-1]
+        chapter = bisect_right(book._chapter_offsets, offset) # 1-based chapter number.
+        return Verse(Chapter(book, chapter), offset - book._chapter_offsets[chapter-1] + 1)
     
     def _get_element(self, i):
         assert 0 <= i < len(self)
@@ -118,15 +175,15 @@ class Bible(BibleBase):
             (start, end, step) = key.indices(len(self)+1)
             if start == 0:
                 raise IndexError
-            if start in range(1, len(self._books)+1):
+            if 1 <= start <= len(self._books):
                 start -= 1
-            if end in range(len(self._books)+1):
+            if 0 <= end <= len(self._books):
                 end -= 1
             return self._books[start:end:step]
 
-        if key in range(1, len(self._books)+1): # key is the logical book number (1-66).
+        if 1 <= key <= len(self._books): # key is the logical book number (1-66).
             return self._books[key-1]
-        elif key in range(-len(self._books)-1, 0): # Negative index.
+        elif -len(self._books) <= key < 0: # Negative index.
             return self._books[key]
         else:
             raise IndexError
@@ -206,17 +263,15 @@ class Book(BibleBase):
         self.name = name            
         self.shortname = self.name if not shortname else shortname
         self.abbreviations = abbreviations
-        self._chapters = []
-        chapter_num = 1
-        for verse_count in verse_counts:
-            #print chapter_num, verse_count, type(verse_count)
-            verse_list = range(1, verse_count+1)
-            verse_omissions = None
-            if omissions and chapter_num in omissions:
-                verse_omissions = omissions[chapter_num]
-            self._chapters.append(Chapter(self, chapter_num, verse_list, omissions=verse_omissions, chapter_text=chapter_text))
-            chapter_num += 1
-        self.num_chapters = len(self._chapters)
+        # Chapter and Verse objects are only created when accessed, the canon itself
+        # is no more than compact arrays of verse counts and chapter offsets.
+        self._verse_counts = array('H', verse_counts)
+        self._chapter_offsets = array('L', [0]) # Verses preceding each chapter in this book.
+        for verse_count in self._verse_counts:
+            self._chapter_offsets.append(self._chapter_offsets[-1] + verse_count)
+        self._omissions = omissions or {}
+        self._chapter_text = chapter_text
+        self.num_chapters = len(self._verse_counts)
         self.altname = altname
 
     def __unicode__(self):
@@ -224,7 +279,7 @@ class Book(BibleBase):
 
     def __len__(self):
         " Return the number of chapters. "
-        return len(self._chapters)
+        return self.num_chapters
     
     @property
     def has_one_chapter(self):
@@ -232,14 +287,11 @@ class Book(BibleBase):
     
     @property
     def num_verses(self):
-        num = 0
-        for chapter in self:
-            num += len(chapter)
-        return num
+        return self._chapter_offsets[-1]
     
     def _get_element(self, i):
         assert 0 <= i < len(self)
-        return self._chapters[i]
+        return Chapter(self, i+1)
     
     def __getitem__(self, key):
          " Get a specific chapter of this book. NB: Slices and negative indexes are supported. "
@@ -250,16 +302,16 @@ class Book(BibleBase):
              (start, end, step) = key.indices(len(self)+1)
              if start == 0:
                  raise IndexError
-             if start in range(1, len(self._chapters)+1):
+             if 1 <= start <= len(self):
                  start -= 1
-             if end in range(len(self._chapters)+1):
+             if 0 <= end <= len(self):
                  end -= 1
-             return self._chapters[start:end:step]
+             return [self._get_element(i) for i in xrange(*slice(start, end, step).indices(len(self)))]
 
-         if key in range(1, len(self._chapters)+1): # key is the logical chapter number.
-             return self._chapters[key-1]
-         elif key in range(-len(self._chapters)-1, 0): # Negative index.
-             return self._chapters[key]
+         if 1 <= key <= len(self): # key is the logical chapter number.
+             return Chapter(self, key)
+         elif -len(self) <= key < 0: # Negative index.
+             return Chapter(self, len(self)+key+1)
          else:
              raise IndexError
     
@@ -302,32 +354,47 @@ class Book(BibleBase):
 class Chapter(BibleBase):
     """
     Chapter object. Represents a chapter in a book of the Bible.
+    
+    Chapters are lightweight views onto the verse counts held by their Book and are
+    created on access, so compare them with ``==`` rather than ``is``.
 
     @args::
         `book`: :models:`bibletext.Book` that this chapter belongs to.
 
         `number`: int chapter number.
 
-        `verses`: List of the verse numbers present in this Chapter.
-
-        `chapter_text`: Defaults to `_('Chapter %d')`, and `_('Psalm %d')` for Psalms.
-
     """
-    def __init__(self, book, number, verses, omissions=None, chapter_text=None):
-        self.bible = book.bible
+    __slots__ = ('book', 'number')
+    
+    def __init__(self, book, number):
         self.book = book # Needs to know the book we're in for comparators to operate.
         self.number = number # int(chapter number)
-        if chapter_text:
-            self.chapter_text = chapter_text
+    
+    @property
+    def bible(self):
+        return self.book.bible
+    
+    @property
+    def chapter_text(self):
+        " Defaults to `_('Chapter %d')`, and `_('Psalm %d')` for Psalms. "
+        if self.book._chapter_text:
+            return self.book._chapter_text
         elif self.book.number == 19: # Psalms are Psalms, not Chapters.
-            self.chapter_text = self.bible._psalm_text
-        else:
-            self.chapter_text = self.bible._chapter_text
-        self.name = self.chapter_text % self.number
-        self._verses = []
-        for verse in verses:
-            self._verses.append(Verse(self, verse)) # NB: verse is the Verse number.
-        self.num_verses = len(self._verses)
+            return self.bible._psalm_text
+        return self.bible._chapter_text
+    
+    @property
+    def name(self):
+        return self.chapter_text % self.number
+    
+    @property
+    def num_verses(self):
+        return self.book._verse_counts[self.number-1]
+    
+    @property
+    def omissions(self):
+        " List of the verse numbers omitted from this chapter. "
+        return self.book._omissions.get(self.number, [])
 
     def __unicode__(self):
         if len(self.book) == 1: # Only one chapter to the book, omit the chapter.
@@ -341,7 +408,7 @@ class Chapter(BibleBase):
     
     def _get_element(self, i):
         assert 0 <= i < len(self)
-        return self._verses[i]
+        return Verse(self, i+1)
     
     def __getitem__(self, key):
          " Get a specific verse of this chapter. NB: Slices and negative indexes are supported. "
@@ -352,16 +419,16 @@ class Chapter(BibleBase):
              (start, end, step) = key.indices(len(self)+1)
              if start == 0:
                  raise IndexError
-             if start in range(1, len(self._verses)+1):
+             if 1 <= start <= len(self):
                  start -= 1
-             if end in range(len(self._verses)+1):
+             if 0 <= end <= len(self):
                  end -= 1
-             return self._verses[start:end:step]
+             return [self._get_element(i) for i in xrange(*slice(start, end, step).indices(len(self)))]
 
-         if key in range(1, len(self._verses)+1): # key is the logical verse number.
-             return self._verses[key-1]
-         elif key in range(-len(self._verses)-1, 0): # Negative index.
-             return self._verses[key]
+         if 1 <= key <= len(self): # key is the logical verse number.
+             return Verse(self, key)
+         elif -len(self) <= key < 0: # Negative index.
+             return Verse(self, len(self)+key+1)
          else:
              raise IndexError
     
@@ -393,6 +460,9 @@ class Chapter(BibleBase):
             return (self.book, self.number) == (other.book, other.number)
 
         return False
+    
+    def __hash__(self):
+        return hash((self.book.number, self.number))
 
     def __lt__(self, other):
         if type(self) == type(other):
@@ -413,7 +483,8 @@ class Verse(BibleBase):
     """
     Verse object - this is used for formatting purposes.
 
-    Also links in with the VerseText implementation.
+    Also links in with the VerseText implementation. Like Chapter this is a
+    lightweight view that is created on access.
 
     @args::
 
@@ -422,15 +493,33 @@ class Verse(BibleBase):
         `number`: int verse number.
 
     """
+    __slots__ = ('chapter', 'number')
+    
     def __init__(self, chapter, number):
-        self.bible = chapter.book.bible
-        self.book = chapter.book
         self.chapter = chapter
         self.number = number
+    
+    @property
+    def bible(self):
+        return self.chapter.book.bible
+    
+    @property
+    def book(self):
+        return self.chapter.book
+    
+    @property
+    def name(self):
         if len(self.book) > 1:
-            self.name = u'%s:%s' % (self.chapter.number, self.number)
-        else: # Books with one chapter.
-            self.name = unicode(self.number)
+            return u'%s:%s' % (self.chapter.number, self.number)
+        # Books with one chapter.
+        return unicode(self.number)
+    
+    @property
+    def ordinal(self):
+        " Absolute position of this verse in the canon, Genesis 1:1 being 1. "
+        book = self.chapter.book
+        return book.bible._book_offsets[book.number-1] + \
+            book._chapter_offsets[self.chapter.number-1] + self.number
     
     def __unicode__(self):
         if self.book.has_one_chapter:
@@ -468,6 +557,9 @@ class Verse(BibleBase):
 
         return False
     
+    def __hash__(self):
+        return hash((self.book.number, self.chapter.number, self.number))
+    
     def __lt__(self, other):
         if type(self) == type(other):
             if self.bible == other.bible:
@@ -480,37 +572,153 @@ class Verse(BibleBase):
 
 
 class BiblePassageManager(models.Manager):
-    " NB: verse and passage work with English at present. "
+    """
+    NB: verse and passage work with English at present.
+    
+    chapter, verse, passage and verses_many read through the chapter cache (see bibletext.caching)
+    and return lists of verses rather than querysets; use filter() etc. for queries. The verses
+    are copies of the cached ones, so they may be changed.
+    """
+    
+    def chapter(self, book_id, chapter_id):
+        " Returns the verses of the given chapter. "
+        return chapter_cache.get_chapter(self.model, int(book_id), int(chapter_id))
     
     def verse(self, reference):
         " Takes textual verse information and returns the Verse. "
-        if self.model.translation and reference[-3] != self.model.translation:
-            reference += ' '+self.model.translation
-        verse = bible.Verse(reference)
-        return self.get_query_set().get(book_id=verse.book, chapter_id=verse.chapter, verse_id=verse.verse)
+        verse = parse_verse(reference, self.model.translation)
+        return self.get_verse(verse.book, verse.chapter, verse.verse)
+    
+    def get_verse(self, book_id, chapter_id, verse_id):
+        " Returns the verse at book_id chapter_id:verse_id, raising DoesNotExist if there is none. "
+        for verse in self.chapter(book_id, chapter_id):
+            if verse.verse_id == int(verse_id):
+                return verse
+        raise self.model.DoesNotExist("%s matching query does not exist." % self.model._meta.object_name)
     
     def passage(self, start_reference, end_reference=None):
         """
         Takes textual passage information and returns the Verse(s).
-        Note: you can't just input 'Romans 1:1-2:3',
-        you'll need to do ('Romans 1:1', 'Romans 2:3') for the time being.
+        
+        Either give the start and end verses, ('Romans 1:1', 'Romans 2:3'), or a single
+        reference such as 'Romans 1:1-2:3' or 'Rom 3:23; 6:23; 10:9-13'.
         """
-        if not end_reference: # Probably just a single verse, return a list anyway.
-            end_reference = start_reference
+        return self.verses_many([(start_reference, end_reference)])[0]
+    
+    def verses_many(self, references):
+        """
+        Resolves many references with (at most) a single query.
         
-        if self.model.translation and start_reference[-3] != self.model.translation:
-            start_reference += ' '+self.model.translation
-        if self.model.translation and end_reference[-3] != self.model.translation:
-            end_reference += ' '+self.model.translation
+        Returns a list with one list of verses per reference, in the order given.
+        Each reference is anything passage() takes: a string such as 'Rom 10:9-13' or
+        'Rom 3:23; 6:23', or a (start_reference, end_reference) tuple.
+        """
+        return self.verses_in_ranges([self.ordinal_ranges(reference) for reference in references])
+    
+    def verses_in_ranges(self, references):
+        """
+        Like verses_many, for references already resolved to lists of (start, end) ordinals,
+        eg: [[(1, 31)], [(26046, 26046), (26049, 26051)]].
+        """
+        ranges = [r for ordinal_ranges in references for r in ordinal_ranges]
+        if not ranges:
+            return []
         
-        # NB: len(passage) gives us the number of Verses in the passage.
-        passage = bible.Passage(start_reference, end_reference)
-        # We'll get the number of verses from the start like so to save a db lookup:
-        in_the_beginning = 'Genesis 1:1'
-        if self.model.translation:
-            in_the_beginning += ' '+self.model.translation
-        start_pk = len(bible.Passage(in_the_beginning, start_reference))
-        return self.get_query_set().order_by('id').filter(pk__gte = start_pk)[:len(passage)]
+        chapters = []
+        for start, end in ranges:
+            chapter, last = self.model.bible.verse_at(start).chapter, self.model.bible.verse_at(end).chapter
+            chapters.append(chapter)
+            while chapter != last:
+                chapter = chapter.next
+                chapters.append(chapter)
+        chapters = sorted(set((chapter.book.number, chapter.number) for chapter in chapters))
+        found = chapter_cache.get_many(self.model, chapters)
+        verse_list = [verse for chapter in chapters for verse in found[chapter]]
+        ordinals = [verse.ordinal for verse in verse_list]
+        results = []
+        for ordinal_ranges in references:
+            verses = []
+            for start, end in ordinal_ranges:
+                verses.extend(verse_list[bisect_left(ordinals, start):bisect_right(ordinals, end)])
+            results.append(verses)
+        return results
+    
+    def iter_ranges(self, ranges, chunk_size=None):
+        """
+        Yields the verses of [(start, end), ...] ordinals in order, without holding them all.
+
+        Reads chunk_size verses at a time (BIBLETEXT_STREAM_CHUNK_SIZE, 500 by default), seeking
+        on the ordinal rather than counting an OFFSET, so the last chunk of Psalms costs what the
+        first does. The chapter cache is bypassed so a whole book doesn't push out the chapters
+        everyone else is reading; the text store is read instead when there is one.
+        """
+        chunk_size = chunk_size or getattr(settings, 'BIBLETEXT_STREAM_CHUNK_SIZE', 500)
+        store = get_store(self.model)
+        for start, end in ranges:
+            last = start - 1
+            while last < end:
+                if store:
+                    chunk = store.ordinals(self.model, last + 1, min(last + chunk_size, end))
+                    last += chunk_size
+                else:
+                    chunk = list(self.get_query_set().filter(ordinal__gt=last, ordinal__lte=end)
+                                 .order_by('ordinal')[:chunk_size])
+                    last = chunk[-1].ordinal if len(chunk) == chunk_size else end
+                for verse in chunk:
+                    yield verse
+
+    def page(self, ranges, start=None, per_page=None, max_length=None):
+        """
+        Returns a page of the verses of [(start, end), ...] ordinals, see bibletext.paging: the page
+        beginning at the ordinal start (or the first verse), and the ordinal the next page begins at,
+        or None for the last page. Reads just that page and the verse after it, eg: 51 verses.
+        """
+        per_page, max_length = page_size(per_page, max_length)
+        if start is not None:
+            ranges = [(max(first, start), last) for first, last in ranges if last >= start]
+        verse_list, following = take_page(self.iter_ranges(ranges, chunk_size=per_page + 1), per_page, max_length)
+        return verse_list, following and following.ordinal
+
+    def fetch_chapters(self, chapters):
+        " Reads the given [(book_id, chapter_id), ...] from the database in one query, bypassing the cache. "
+        canon = self.model.bible
+        ranges = [(canon.ordinal_of(book_id, chapter_id, 1), canon[book_id][chapter_id][-1].ordinal)
+                  for book_id, chapter_id in chapters]
+        found = {}
+        if ranges:
+            for verse in self.get_query_set().filter(self._ordinal_filter(ranges)).order_by('ordinal'):
+                found.setdefault((verse.book_id, verse.chapter_id), []).append(verse)
+        return found
+    
+    def ordinal_ranges(self, start_reference, end_reference=None):
+        """
+        Parses a reference (or a start and end verse) into a list of (start, end) ordinals, eg: for
+        iter_ranges() and page(). Raises RangeError or IndexError for a reference it can't place.
+        """
+        canon = self.model.bible
+        if isinstance(start_reference, (tuple, list)): # verses_many((start, end))
+            start_reference, end_reference = start_reference
+        if end_reference:
+            ranges = [(parse_verse(start_reference, self.model.translation),
+                       parse_verse(end_reference, self.model.translation))]
+        else:
+            ranges = parse_ranges(start_reference, self.model.translation)
+        return [(canon.ordinal_of(start.book, start.chapter, start.verse),
+                 canon.ordinal_of(end.book, end.chapter, end.verse)) for start, end in ranges]
+    
+    def _ordinal_filter(self, ranges):
+        " One Q covering all the (start, end) ordinal ranges, with overlapping ranges merged. "
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        single = [start for start, end in merged if start == end]
+        q = [Q(ordinal__range=(start, end)) for start, end in merged if start != end]
+        if single:
+            q.append(Q(ordinal__in=single))
+        return reduce(operator.or_, q)
 
 
 class VerseText(models.Model):
@@ -521,11 +729,17 @@ class VerseText(models.Model):
     book_id = models.PositiveIntegerField(default=1)
     chapter_id = models.PositiveIntegerField(default=1)
     verse_id = models.PositiveIntegerField(default=1)
+    # Absolute position in the canon (Genesis 1:1 is 1), see populate_verse_ordinal.
+    ordinal = models.PositiveIntegerField(blank=True, null=True, db_index=True)
     
     text = models.TextField()
     
     translation = None # Use the translation code (KJV, NKJV etc) here according to what python-bible supports.    
     bible = None # Must implement Bible() to get formattable chapters, and so forth.
+    content_version = '1' # Change this when the text is re-imported, see get_content_version.
+    
+    registry = SortedDict() # Translation code -> VerseText implementation, see register_version.
+    versions = [] # ContentType pks of the registered versions (for Scripture.version).
     
     objects = BiblePassageManager()
     
@@ -533,11 +747,19 @@ class VerseText(models.Model):
         return u'%s %s:%s' % (self.book, self.chapter.number, self.verse.number)    
     
     class Meta:
-        ordering = ('id') # Should already be: ('book_id', 'chapter_id', 'verse_id')
+        ordering = ('book_id', 'chapter_id', 'verse_id') # Not 'id', translations may be loaded in any order.
         unique_together = [('book_id', 'chapter_id', 'verse_id')]
         app_label = 'bibletext'
         abstract = True
     
+    @classmethod
+    def get_content_version(cls):
+        """
+        Identifies the current text of this translation for caching. Either the content_version
+        attribute, or BIBLETEXT_CONTENT_VERSIONS = {'KJV': '2', ...} in your settings.
+        """
+        return getattr(settings, 'BIBLETEXT_CONTENT_VERSIONS', {}).get(cls.translation, cls.content_version)
+    
     @classmethod
     def register_version(cls, *versions):
         """
@@ -548,17 +770,29 @@ class VerseText(models.Model):
                 )
         
         You can call this function as often as you like to register more bible versions.
+        Registered versions are found by translation code in VerseText.registry without
+        touching the database.
         """
-        if not hasattr(cls, 'versions'):
-            cls.versions = []
-        
         for version in versions:
+            pre_save.connect(populate_verse_ordinal, sender=version)
+            VerseText.registry[version.translation] = version
+        VerseText.register_content_types()
+    
+    @classmethod
+    def register_content_types(cls):
+        """
+        Fills in VerseText.versions with the ContentType pks of the registered versions.
+        
+        On an initial syncdb there are no tables yet, so this is tried again once syncdb is done.
+        """
+        for version in VerseText.registry.values():
             try:
-                version_content_type = ContentType.objects.get_for_model(version)
-                if version_content_type.pk not in cls.versions:
-                    cls.versions.append(version_content_type.pk)
+                pk = ContentType.objects.get_for_model(version).pk
             except DatabaseError:
-                pass # We're probably on an initial syncdb, and there are no tables created.
+                transaction.rollback_unless_managed() # Keep the connection usable for syncdb.
+                return
+            if pk not in VerseText.versions:
+                VerseText.versions.append(pk)
     
     @property
     def book(self):
@@ -598,20 +832,19 @@ class VerseText(models.Model):
         if hasattr(self, '_next_verse'):
             return self._next_verse
         try:
-            self._next_verse = self.__class__.objects.get(pk=self.pk+1)
-            return self._next_verse
-        except self.__class__.DoesNotExist:
+            self._next_verse = self.__class__.objects.filter(ordinal__gt=self.ordinal).order_by('ordinal')[0]
+        except IndexError:
             self._next_verse = None
-            return self._next_verse
+        return self._next_verse
     
     @property
     def prev_verse(self):
         if hasattr(self, '_prev_verse'):
             return self._prev_verse
-        if self.book_id == 1 and self.chapter_id == 1 and self.verse_id == 1:
+        try:
+            self._prev_verse = self.__class__.objects.filter(ordinal__lt=self.ordinal).order_by('-ordinal')[0]
+        except IndexError:
             self._prev_verse = None # Genesis 1:1 has no previous verse.
-            return self._prev_verse
-        self._prev_verse = self.__class__.objects.get(pk=self.pk-1)
         return self._prev_verse
     
     #-----------------------
@@ -640,3 +873,13 @@ class VerseText(models.Model):
         " Returns a Book object or None. "
         return self.book.prev
 
+
+def populate_verse_ordinal(sender, instance, **kwargs):
+    " Fills in VerseText.ordinal from the canon, including rows saved by loaddata. "
+    if instance.ordinal is None:
+        instance.ordinal = instance.verse.ordinal
+
+
+def register_version_content_types(sender, **kwargs):
+    VerseText.register_content_types()
+post_syncdb.connect(register_version_content_types)
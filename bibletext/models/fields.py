@@ -2,7 +2,9 @@ from django import forms
 from django.core import exceptions
 from django.db import models
 
-from bible import Verse, RangeError # python-bible module.
+from bible import RangeError # python-bible module.
+
+from bibletext.references import parse_verse
 
 
 class VerseFormField(forms.CharField):
@@ -12,7 +14,7 @@ class VerseFormField(forms.CharField):
             return super(VerseFormField, self).clean(value)
         
         try:
-            verse = Verse(value)
+            verse = parse_verse(value)
         except (RangeError, Exception) as err:
             raise forms.ValidationError(err.__str__())
         
@@ -84,7 +84,7 @@ base_bible_data = [
         'testament': 'OT',
         'verse_counts': [18, 25, 27, 44, 27, 33, 20, 29, 37, 36, 21, 21, 25, 29, 38, 20, 41, 37, 37, 21, 26, 20, 37, 20, 30],
         'name': '2 Kings',
-        'abbreviations': ['2king' '2kg 2', 'kg', '2kings', '2ki', '2 ki'],
+        'abbreviations': ['2king', '2kg', '2 kg', '2kings', '2ki', '2 ki'],
         'altname': 'The Second Book of the Kings, commonly called the Fourth Book of the Kings',
     },
     {
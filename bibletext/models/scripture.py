@@ -1,15 +1,136 @@
+import operator
+import time
+
+from django.conf import settings
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
 
 import bible # python-bible module.
 
-from bibles import Book, VerseText
+from bibletext.intervals import IntervalTree
+from bibletext.references import parse_verse
+from bibles import Book, Chapter, Verse, VerseText
 from kjv import KJV
 from fields import VerseField
 
 
+def _version(version):
+    " The VerseText model of a translation code or model, defaulting to the KJV. "
+    if version is None:
+        return KJV
+    if isinstance(version, basestring):
+        return VerseText.registry[version]
+    return version
+
+def ordinal_ranges(reference, version=None):
+    """
+    [(start, end), ...] verse ordinals in the canon of version (a model or translation code,
+    the KJV by default) of a reference: anything BiblePassageManager.passage() takes, or a
+    Book, Chapter or Verse of the canon.
+    """
+    version = _version(version)
+    if isinstance(reference, Book):
+        return [(reference[1][1].ordinal, reference[-1][-1].ordinal)]
+    if isinstance(reference, Chapter):
+        return [(reference[1].ordinal, reference[-1].ordinal)]
+    if isinstance(reference, Verse):
+        return [(reference.ordinal, reference.ordinal)]
+    return version.objects.ordinal_ranges(reference)
+
+
+# Scripture.interval_key is the start ordinal, offset by the span's length class (the bit length
+# of end - start) shifted by SPAN_SHIFT. A B-tree can't find the intervals overlapping a point
+# from their start alone without reading every one starting before it, but within a class the
+# starts are no more than 2 ** class - 1 verses before the point, so one index range per class does.
+SPAN_SHIFT = 20
+
+def interval_key(start, end):
+    return ((end - start).bit_length() << SPAN_SHIFT) + start
+
+
+class ScriptureQuerySet(QuerySet):
+    """
+    Finds Scripture by the verses it covers, through index ranges on interval_key and
+    start_ordinal. References with several parts ('Rom 3:23; 6:23') match Scripture for any
+    part. Ordinals are only comparable within a canon, so give the version if yours isn't the KJV's.
+    """
+    
+    def overlapping(self, reference, version=None):
+        " Scripture sharing at least a verse with the reference, eg: sermons on John 3. "
+        return self._filter(reference, version)
+    
+    def containing(self, reference, version=None):
+        " Scripture covering the whole reference, eg: containing('John 3:16') for a single verse. "
+        return self._filter(reference, version, containing=True)
+    
+    def within(self, reference, version=None):
+        " Scripture lying inside the reference, eg: within('Romans') for the passages in Romans. "
+        q = [Q(start_ordinal__range=(start, end), end_ordinal__lte=end) for start, end in ordinal_ranges(reference, version)]
+        return self._version(reduce(operator.or_, q), version)
+    
+    def _filter(self, reference, version, containing=False):
+        " An interval_key range for each span class, see SPAN_SHIFT. "
+        q = []
+        for start, end in ordinal_ranges(reference, version):
+            for length in xrange(_version(version).bible.num_verses.bit_length() + 1):
+                span = (1 << length) - 1 # The longest in the class.
+                if containing:
+                    if span < end - start:
+                        continue
+                    first, last, least_end = end - span, start, end
+                else:
+                    first, last, least_end = start - span, end, start
+                key = length << SPAN_SHIFT
+                q.append(Q(interval_key__range=(key + max(first, 0), key + last), end_ordinal__gte=least_end))
+        return self._version(reduce(operator.or_, q), version)
+    
+    def prefetch_scripture_text(self):
+        " Fetches the text of every Scripture in the results together, see prefetch_scripture_text(). "
+        queryset = self._clone()
+        queryset._prefetch_text = True
+        return queryset
+    
+    def iterator(self):
+        if not getattr(self, '_prefetch_text', False):
+            return super(ScriptureQuerySet, self).iterator()
+        return iter(prefetch_scripture_text(super(ScriptureQuerySet, self).iterator()))
+    
+    def _clone(self, *args, **kwargs):
+        clone = super(ScriptureQuerySet, self)._clone(*args, **kwargs)
+        clone._prefetch_text = getattr(self, '_prefetch_text', False)
+        return clone
+    
+    def _version(self, q, version):
+        queryset = self.filter(q)
+        if version is not None:
+            queryset = queryset.filter(version=ContentType.objects.get_for_model(_version(version)))
+        return queryset
+
+
+class ScriptureManager(models.Manager):
+    " See ScriptureQuerySet, whose methods are available here and on generic relations. "
+    
+    def get_query_set(self):
+        return ScriptureQuerySet(self.model, using=self._db)
+    
+    def overlapping(self, reference, version=None):
+        return self.get_query_set().overlapping(reference, version)
+    
+    def containing(self, reference, version=None):
+        return self.get_query_set().containing(reference, version)
+    
+    def within(self, reference, version=None):
+        return self.get_query_set().within(reference, version)
+    
+    def prefetch_scripture_text(self):
+        return self.get_query_set().prefetch_scripture_text()
+
+
 class Scripture(models.Model):
     "Scripture object to display the text of a passage (or verse) of scripture."
     start_verse = VerseField()
@@ -31,9 +152,16 @@ class Scripture(models.Model):
     end_chapter_id = models.PositiveIntegerField(blank=True, null=True)
     end_verse_id = models.PositiveIntegerField(blank=True, null=True)
     
+    # Positions of the first and last verse in the version's canon, see ScriptureQuerySet.
+    start_ordinal = models.PositiveIntegerField(blank=True, null=True, db_index=True)
+    end_ordinal = models.PositiveIntegerField(blank=True, null=True)
+    interval_key = models.PositiveIntegerField(blank=True, null=True, db_index=True)
+    
+    objects = ScriptureManager()
+    
     def __unicode__(self):
         if self.end_verse:
-            return bible.Passage(self.start_verse, self.end_verse).format()
+            return bible.Passage(parse_verse(self.start_verse), parse_verse(self.end_verse)).format()
         return self.start_verse
         
     class Meta:
@@ -48,27 +176,172 @@ class Scripture(models.Model):
     def end_book(self):
         self.version.bible[self.end_book_id]
     
+    def clean(self):
+        " Rejects a reference python-bible reads but the version's canon doesn't have. "
+        if self.version_id and self.start_verse:
+            try:
+                scripture_ordinals(self)
+            except IndexError:
+                raise ValidationError(u"%s isn't in the %s." % (
+                    u' - '.join(filter(None, (self.start_verse, self.end_verse))), self.get_version_model().translation))
+    
+    def get_version_model(self):
+        " The VerseText model of the version, without a query (ContentType caches them). "
+        return ContentType.objects.get_for_id(self.version_id).model_class()
+    
     def get_passage(self):
-        return self.version.model_class().objects.passage(self.start_verse, self.end_verse)    
+        " Returns the verses, unless prefetch_scripture_text() has already attached them. "
+        if not hasattr(self, '_passage'):
+            self._passage = self.get_version_model().objects.passage(self.start_verse, self.end_verse)
+        return self._passage
     passage = property(get_passage)
     
     def get_verse(self):
         "Returns the start verse object."
-        return self.version.model_class().objects.verse(self.start_verse)
+        passage = getattr(self, '_passage', None)
+        if passage and passage[0].ordinal == self.start_ordinal:
+            return passage[0]
+        return self.get_version_model().objects.verse(self.start_verse)
     verse = property(get_verse)
 
 
+def prefetch_scripture_text(scripture_list):
+    """
+    Attaches the verses of every Scripture in scripture_list (any iterable) to it, so its
+    passage and verse don't each go to the chapter cache. The chapters are read together,
+    with one query per version for those not cached. Returns the Scripture as a list::
+    
+        sermons = Sermon.objects.prefetch_related('scripture')[:50]
+        prefetch_scripture_text(scripture for sermon in sermons for scripture in sermon.scripture.all())
+    
+    The stored ordinals are used, so references are only parsed for Scripture saved before
+    they existed (see bibletext_ordinals).
+    """
+    scripture_list = list(scripture_list)
+    versions = {}
+    for scripture in scripture_list:
+        versions.setdefault(scripture.version_id, []).append(scripture)
+    for version_id, group in versions.items():
+        version = ContentType.objects.get_for_id(version_id).model_class()
+        references = []
+        for scripture in group:
+            if scripture.start_ordinal is not None:
+                references.append([(scripture.start_ordinal, scripture.end_ordinal)])
+            else:
+                references.append(ordinal_ranges((scripture.start_verse, scripture.end_verse or None), version))
+        for scripture, verses in zip(group, version.objects.verses_in_ranges(references)):
+            scripture._passage = verses
+    return scripture_list
+
+
+class ScriptureIndex(object):
+    """
+    Every Scripture's ordinals in an in-memory IntervalTree, to answer the hottest lookups
+    without a query. The methods return [(content_type_id, object_id), ...] of the objects
+    with matching Scripture, in canonical order, or just the object ids of a given model::
+    
+        Sermon.objects.filter(pk__in=scripture_index.overlapping('John 3', model=Sermon))
+    
+    The tree is rebuilt after Scripture is saved or deleted in this process, and at most
+    BIBLETEXT_SCRIPTURE_INDEX_TIMEOUT seconds (default 300) after changes made elsewhere.
+    """
+    
+    def __init__(self):
+        self.clear()
+    
+    def clear(self):
+        self._tree, self._built = None, 0
+    
+    def tree(self):
+        timeout = getattr(settings, 'BIBLETEXT_SCRIPTURE_INDEX_TIMEOUT', 300)
+        tree = self._tree
+        if tree is None or time.time() - self._built > timeout:
+            rows = Scripture.objects.filter(start_ordinal__isnull=False).values_list(
+                'start_ordinal', 'end_ordinal', 'version', 'content_type', 'object_id')
+            tree = IntervalTree([(start, end, (version_id, content_type_id, object_id))
+                                 for start, end, version_id, content_type_id, object_id in rows.iterator()])
+            self._tree, self._built = tree, time.time()
+        return tree
+    
+    def overlapping(self, reference, version=None, model=None):
+        " See ScriptureQuerySet.overlapping. "
+        return self._lookup('overlapping', reference, version, model)
+    
+    def containing(self, reference, version=None, model=None):
+        " See ScriptureQuerySet.containing. "
+        return self._lookup('containing', reference, version, model)
+    
+    def within(self, reference, version=None, model=None):
+        " See ScriptureQuerySet.within. "
+        return self._lookup('within', reference, version, model)
+    
+    def _lookup(self, relation, reference, version, model):
+        tree = self.tree()
+        version_id = version is not None and ContentType.objects.get_for_model(_version(version)).pk
+        content_type_id = model is not None and ContentType.objects.get_for_model(model).pk
+        found, seen = [], set()
+        for start, end in ordinal_ranges(reference, version):
+            for value in getattr(tree, relation)(start, end):
+                if version_id and value[0] != version_id or content_type_id and value[1] != content_type_id:
+                    continue
+                value = value[2] if model is not None else value[1:]
+                if value not in seen:
+                    seen.add(value)
+                    found.append(value)
+        return found
+
+scripture_index = ScriptureIndex()
+
+
+def clear_scripture_index(sender, **kwargs):
+    scripture_index.clear()
+post_save.connect(clear_scripture_index, sender=Scripture)
+post_delete.connect(clear_scripture_index, sender=Scripture)
+
+
+def scripture_ordinals(scripture):
+    " The (start, end) ordinals of a Scripture's verses in its version's canon. "
+    canon = ContentType.objects.get_for_id(scripture.version_id).model_class().bible
+    start = parse_verse(scripture.start_verse)
+    start = canon.ordinal_of(start.book, start.chapter, start.verse)
+    if not scripture.end_verse:
+        return start, start
+    end = parse_verse(scripture.end_verse)
+    return start, canon.ordinal_of(end.book, end.chapter, end.verse)
+
+
+def scripture_details(start, end, canon):
+    """
+    The fields of a Scripture derived from its start and end (or None) python-bible Verses,
+    as {name: value}. Raises IndexError if either isn't in the canon. With canon None, the
+    ordinals are left out (None).
+    """
+    details = {
+        'start_book_id': start.book, 'start_chapter_id': start.chapter, 'start_verse_id': start.verse,
+        'end_book_id': end and end.book, 'end_chapter_id': end and end.chapter, 'end_verse_id': end and end.verse,
+        'start_ordinal': None, 'end_ordinal': None, 'interval_key': None,
+    }
+    if canon is not None:
+        start_ordinal = canon.ordinal_of(start.book, start.chapter, start.verse)
+        end_ordinal = canon.ordinal_of(end.book, end.chapter, end.verse) if end else start_ordinal
+        details.update(start_ordinal=start_ordinal, end_ordinal=end_ordinal,
+                       interval_key=interval_key(start_ordinal, end_ordinal))
+    return details
+
+
 def populate_scripture_details(sender, instance, **kwargs):
-    start = bible.Verse(instance.start_verse)
-    instance.start_book_id = start.book
-    instance.start_chapter_id = start.chapter
-    instance.start_verse_id = start.verse
-    if instance.end_verse:
-        end = bible.Verse(instance.end_verse)
-        if start.book == end.book:
-            instance.end_book_id = instance.start_book_id
-        else:
-            instance.end_book_id = end.book
-        instance.end_chapter_id = end.chapter
-        instance.end_verse_id = end.verse
-pre_save.connect(populate_scripture_details, sender=Scripture)
\ No newline at end of file
+    """
+    Fills in the derived fields on save. See bibletext.importer.import_scripture to skip this in bulk.
+    A reference that isn't in the version's canon (see Scripture.clean) is saved without ordinals,
+    so the ordinal lookups leave it out.
+    """
+    canon = ContentType.objects.get_for_id(instance.version_id).model_class().bible
+    start = parse_verse(instance.start_verse)
+    end = parse_verse(instance.end_verse) if instance.end_verse else None
+    try:
+        details = scripture_details(start, end, canon)
+    except IndexError:
+        details = scripture_details(start, end, None)
+    for name, value in details.items():
+        setattr(instance, name, value)
+pre_save.connect(populate_scripture_details, sender=Scripture)
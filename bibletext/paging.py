@@ -0,0 +1,54 @@
+"""
+Keyset pagination of verses.
+
+A page is named by its first verse (a verse number in a chapter, or an ordinal in a passage)
+rather than by its number, and is read by seeking to that verse (see BiblePassageManager.page)
+rather than skipping every verse before it with OFFSET. The last page of a long passage costs
+what the first does, and a page's URL shows the same verses for as long as the text and the
+settings stay the same, so pages are cached like any other.
+
+Pages hold up to ``per_page`` verses and, given ``max_length``, no more verses than fit in that
+many characters of text, so pages of long verses and short ones come out about the same size.
+
+Settings::
+
+    BIBLETEXT_PAGE_SIZE: Verses a page of a passage. Defaults to 50.
+    BIBLETEXT_PAGE_LENGTH: Characters of text a page of a passage. Defaults to None (no limit).
+    BIBLETEXT_CHAPTER_PAGE_SIZE, BIBLETEXT_CHAPTER_PAGE_LENGTH: The same for the chapter view,
+    which shows whole chapters unless one of them is set.
+"""
+from itertools import islice
+
+from django.conf import settings
+
+
+def page_size(per_page=None, max_length=None):
+    " per_page and max_length, defaulting to BIBLETEXT_PAGE_SIZE and BIBLETEXT_PAGE_LENGTH. "
+    return (per_page or getattr(settings, 'BIBLETEXT_PAGE_SIZE', 50),
+            max_length or getattr(settings, 'BIBLETEXT_PAGE_LENGTH', None))
+
+
+def take_page(verses, per_page=None, max_length=None):
+    """
+    Reads the page at the start of verses (any iterable, read no further than the verse after the
+    page). Returns the page's list of verses, and the first verse of the next page or None.
+    A page has at least one verse, however long.
+    """
+    per_page, max_length = page_size(per_page, max_length)
+    page, length = [], 0
+    for verse in verses:
+        if page and (len(page) == per_page or (max_length and length + len(verse.text) > max_length)):
+            return page, verse
+        page.append(verse)
+        length += len(verse.text)
+    return page, None
+
+
+def split_pages(verse_list, per_page=None, max_length=None):
+    " The pages of a list of verses (eg: a chapter), as lists of verses. "
+    pages, start = [], 0
+    while start < len(verse_list):
+        page = take_page(islice(verse_list, start, None), per_page, max_length)[0]
+        pages.append(page)
+        start += len(page)
+    return pages
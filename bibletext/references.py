@@ -0,0 +1,116 @@
+"""
+Parsing of free-form (and compound) scripture references into verse ranges.
+
+Book names are still resolved by python-bible, this only splits up references
+like 'Rom 3:23; 6:23; 10:9-13' or 'Romans 1:1 - 1 Corinthians 2:3'.
+
+python-bible's parsing is regex heavy and the same references come up over and
+over again, so parsed references are kept in ``reference_cache``; check
+``reference_cache.info()`` for the hit rate and size it with the
+BIBLETEXT_REFERENCE_CACHE_SIZE setting.
+"""
+import re
+
+from django.conf import settings
+
+import bible # python-bible module.
+
+from bibletext.lru import LRUCache
+
+
+reference_cache = LRUCache(getattr(settings, 'BIBLETEXT_REFERENCE_CACHE_SIZE', 2048))
+
+
+# Separators between the parts of a compound reference, and between the start and end of a range.
+part_separator_re = re.compile(r'[;,]')
+range_separator_re = re.compile(u'\\s*[-\u2013\u2014]\\s*', re.UNICODE)
+
+# 'Romans 3:23', '1 Cor. 2', '6:23', '13'. The book and verse are both optional.
+part_re = re.compile(r'^(?P<book>\d?\s*[^\d\s:.][^\d:]*?)?\s*(?P<chapter>\d+)(?:\s*[:.]\s*(?P<verse>\d+))?$', re.UNICODE)
+
+
+def parse_verse(reference, translation=None):
+    """
+    Returns the python-bible Verse for a textual reference, eg: parse_verse('Jn 3:16', 'KJV').
+    
+    Parsed verses are cached and shared, so treat them as read only.
+    """
+    if translation:
+        reference = u'%s %s' % (reference, translation)
+    return reference_cache.get_or_set(('verse', _normalize(reference)), bible.Verse, reference)
+
+
+def parse_ranges(reference, translation=None):
+    """
+    Splits a textual reference into a list of (start, end) python-bible Verses.
+
+        'Rom 3:23; 6:23; 10:9-13' gives Romans 3:23-3:23, Romans 6:23-6:23 and Romans 10:9-10:13.
+        'Romans 1:1 - 1 Corinthians 2:3', 'Psalm 23-25' and 'Jude 5, 7' are also understood.
+
+    A book or chapter left out of a part is carried over from the part before it;
+    a part without a verse is the whole chapter.
+    """
+    return reference_cache.get_or_set(('ranges', _normalize(reference), translation),
+                                      _parse_ranges, reference, translation)
+
+
+def _normalize(reference):
+    " python-bible ignores case and extra whitespace, so the cache does too. "
+    return u' '.join(reference.split()).lower()
+
+
+def _parse_ranges(reference, translation):
+    ranges = []
+    context = (None, None, False) # (book, chapter, whether the last part named a verse)
+    for part in part_separator_re.split(reference):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = range_separator_re.split(part)
+        if len(bounds) > 2:
+            raise bible.RangeError("We can't make sense of your passage reference: %s" % part)
+        start, context = _parse_part(bounds[0], context, translation)
+        end, context = _parse_part(bounds[-1], context, translation, end=True)
+        if (start.book, start.chapter, start.verse) > (end.book, end.chapter, end.verse):
+            raise bible.RangeError("The passage ends before it starts: %s" % part)
+        ranges.append((start, end))
+    if not ranges:
+        raise bible.RangeError("We can't find a scripture reference in: %s" % reference)
+    return tuple(ranges)
+
+
+def _parse_part(text, context, translation, end=False):
+    " Returns the python-bible Verse for one side of a range, and the context for the next part. "
+    match = part_re.match(text)
+    if not match:
+        raise bible.RangeError("We can't make sense of your chapter:verse reference: %s" % text)
+    name, number, verse = match.group('book', 'chapter', 'verse')
+    book, chapter, has_verse = context
+    number = int(number)
+
+    if name:
+        book, has_verse = name.strip(), False
+    elif book is None:
+        raise bible.RangeError("We can't find that book of the Bible: %s" % text)
+
+    if verse is not None:
+        chapter, verse, has_verse = number, int(verse), True
+    elif has_verse: # 'Rom 3:23, 25'
+        verse = number
+    else: # 'Psalm 23', or 'Jude 5' since Jude only has the one chapter.
+        chapter = number
+
+    first = _verse(book, 1, 1, translation) # Resolves the book name.
+    verse_counts = first.bible[first.book-1]['verse_counts']
+    if verse is None and len(verse_counts) == 1:
+        chapter, verse, has_verse = 1, number, True
+    if chapter > len(verse_counts):
+        raise bible.RangeError("There are not that many chapters in %s" % book)
+    if verse is None: # The whole chapter.
+        verse = verse_counts[chapter-1] if end else 1
+
+    return bible.Verse(first.book, chapter, verse, translation), (book, chapter, has_verse)
+
+
+def _verse(book, chapter, verse, translation):
+    return parse_verse(u'%s %d:%d' % (book, chapter, verse), translation)
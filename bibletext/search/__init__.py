@@ -0,0 +1,143 @@
+"""
+Full-text search of the verse text, eg::
+
+    from bibletext.search import search
+    results = search(KJV, '"in the beginning" OR light', page=1)
+    for hit in results:
+        print hit.verse, hit.score, hit.highlighted
+
+See bibletext.search.query for the query syntax. The backend is set by BIBLETEXT_SEARCH_BACKEND:
+the memory-mapped index files of bibletext.search.inverted (the default), or the database's own
+full-text search with bibletext.search.db. Either way results are paged and highlighted the same.
+"""
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.importlib import import_module
+from django.utils.safestring import mark_safe
+
+from bibletext.caching import chapter_cache
+from bibletext.search.query import QueryError, normalize, parse, terms, word_re
+from bibletext.utils import SearchError
+
+
+_backend = None
+
+def get_backend():
+    " The configured search backend, created once per process. "
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'BIBLETEXT_SEARCH_BACKEND', 'bibletext.search.inverted.InvertedIndexBackend')
+        module, name = path.rsplit('.', 1)
+        _backend = getattr(import_module(module), name)()
+    return _backend
+
+
+def highlight(text, words):
+    " The text, HTML escaped, with the given (normalized) words in <mark> tags. "
+    parts = []
+    end = 0
+    for match in word_re.finditer(text):
+        if normalize(match.group()) in words:
+            parts.append(escape(text[end:match.start()]))
+            parts.append(u'<mark>%s</mark>' % escape(match.group()))
+            end = match.end()
+    parts.append(escape(text[end:]))
+    return mark_safe(u''.join(parts))
+
+
+class SearchHit(object):
+    " A matching verse (a VerseText instance), its relevance, and the words searched for. "
+    __slots__ = ('verse', 'score', 'words')
+
+    def __init__(self, verse, score, words=()):
+        self.verse = verse
+        self.score = score
+        self.words = words
+
+    @property
+    def highlighted(self):
+        " The verse's text with the words searched for in <mark> tags. "
+        return highlight(self.verse.text, self.words)
+
+
+class SearchResults(object):
+    " A page of search results, best first. Iterate over it for the SearchHits. "
+
+    def __init__(self, version, query, page, per_page, count, hits):
+        self.version = version
+        self.query = query
+        self.page = page
+        self.per_page = per_page
+        self.count = count
+        self.hits = hits
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    @property
+    def num_pages(self):
+        return max(1, (self.count + self.per_page - 1) // self.per_page)
+
+    @property
+    def start_index(self):
+        " The 1-based number of the first hit on this page. "
+        return (self.page - 1) * self.per_page + 1 if self.hits else 0
+
+    @property
+    def has_next(self):
+        return self.page < self.num_pages
+
+    @property
+    def has_previous(self):
+        return self.page > 1
+
+    @property
+    def next_page(self):
+        return self.page + 1
+
+    @property
+    def previous_page(self):
+        return self.page - 1
+
+
+def search(version, query, page=1, per_page=None):
+    """
+    Searches the text of a translation, returning a page of SearchResults.
+
+    @args::
+
+        `version`: The VerseText implementation to search, eg: KJV.
+
+        `query`: eg: 'love NOT hate'. Raises QueryError if it can't be made sense of.
+
+        `page`, `per_page`: Which page of results. per_page defaults to BIBLETEXT_SEARCH_PAGE_SIZE, or 20.
+
+    """
+    if per_page is None:
+        per_page = getattr(settings, 'BIBLETEXT_SEARCH_PAGE_SIZE', 20)
+    page = max(1, int(page))
+    tree = parse(query)
+    words = terms(tree)
+    count, found = get_backend().search(version, tree, words, (page - 1) * per_page, per_page)
+    return SearchResults(version, query, page, per_page, count, hits(version, found, frozenset(words)))
+
+
+def hits(version, found, words=()):
+    " Turns [(ordinal, score), ...] into SearchHits, reading the verses through the chapter cache. "
+    references = [(ordinal, version.bible.verse_at(ordinal)) for ordinal, score in found]
+    chapters = chapter_cache.get_many(version, set((verse.chapter.book.number, verse.chapter.number)
+                                                   for ordinal, verse in references))
+    by_ordinal = {}
+    for ordinal, verse in references:
+        for verse_text in chapters[(verse.chapter.book.number, verse.chapter.number)]:
+            if verse_text.verse_id == verse.number:
+                by_ordinal[ordinal] = verse_text
+    return [SearchHit(by_ordinal[ordinal], score, words) for ordinal, score in found if ordinal in by_ordinal]
+
+
+def build_index(version):
+    " (Re)builds the search index of a translation, for the backends that keep one. "
+    return get_backend().build(version)
@@ -0,0 +1,189 @@
+"""
+A search backend that leaves the searching to the database, so there's no index file to
+ship to every server. Set BIBLETEXT_SEARCH_BACKEND = 'bibletext.search.db.DatabaseBackend'.
+
+    SQLite:     An FTS5 table shadowing each verse table (<table>_fts), kept up to date by
+                triggers, so verses saved or imported any which way are searchable at once.
+    PostgreSQL: A tsvector column generated from the text (PostgreSQL 12+), with a GIN index.
+                BIBLETEXT_SEARCH_CONFIG is the text search configuration, 'simple' by default
+                (no stemming or stop words, like the inverted index).
+
+``manage.py bibletext_search_index`` creates these (and fills them from the existing text).
+The database's tokenizer decides what a word is, so results can differ slightly from those
+of bibletext.search.inverted, eg: for words with apostrophes.
+"""
+from django.conf import settings
+from django.db import connections, transaction
+
+from bibletext.utils import SearchError
+
+
+class DatabaseBackend(object):
+    " Searches with SQLite's FTS5 or PostgreSQL's full-text search, depending on the verse table's database. "
+
+    def build(self, version):
+        " Creates (or refreshes) the search table or column of a translation. Returns the number of verses. "
+        using = version.objects.db
+        self._backend(version).build(version, connections[using])
+        transaction.commit_unless_managed(using=using)
+        return version.objects.count()
+
+    def search(self, version, tree, terms, offset, limit):
+        """
+        Returns (the number of matching verses, [(ordinal, score), ...]) for the verses from offset
+        to offset + limit, best first. Verses that score the same stay in canonical order.
+        """
+        connection = connections[version.objects.db]
+        count, rows = self._backend(version).search(version, connection, tree, terms, offset, limit)
+        found = []
+        for book_id, chapter_id, verse_id, score in rows:
+            try:
+                found.append((version.bible.ordinal_of(book_id, chapter_id, verse_id), score))
+            except IndexError:
+                pass # Not in the canon.
+        return count, found
+
+    def _backend(self, version):
+        vendor = connections[version.objects.db].vendor
+        if vendor not in VENDORS:
+            raise SearchError("The database search backend doesn't support %s, use bibletext.search.inverted." % vendor)
+        return VENDORS[vendor]
+
+
+class SQLiteFTS5(object):
+
+    def names(self, version, connection):
+        " The quoted names of the verse table and its FTS5 table, and the verse table's name. "
+        quote = connection.ops.quote_name
+        table = version._meta.db_table
+        return quote(table), quote('%s_fts' % table), table
+
+    def build(self, version, connection):
+        table, fts, name = self.names(version, connection)
+        cursor = connection.cursor()
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(text, content='%s', content_rowid='id')"
+                       % (fts, name))
+        for trigger, event, sql in (
+                ('ai', 'AFTER INSERT', "INSERT INTO %(fts)s(rowid, text) VALUES (new.id, new.text);"),
+                ('ad', 'AFTER DELETE', "INSERT INTO %(fts)s(%(fts)s, rowid, text) VALUES ('delete', old.id, old.text);"),
+                ('au', 'AFTER UPDATE OF text', "INSERT INTO %(fts)s(%(fts)s, rowid, text) VALUES ('delete', old.id, old.text); "
+                                               "INSERT INTO %(fts)s(rowid, text) VALUES (new.id, new.text);")):
+            cursor.execute("CREATE TRIGGER IF NOT EXISTS %s %s ON %s BEGIN %s END"
+                           % (connection.ops.quote_name('%s_fts_%s' % (name, trigger)), event, table,
+                              sql % {'fts': fts}))
+        cursor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts))
+
+    def search(self, version, connection, tree, terms, offset, limit):
+        table, fts, name = self.names(version, connection)
+        cursor = connection.cursor()
+        expression = self.expression(tree)
+        if expression is not None: # The usual case: FTS5 does the matching and the ranking.
+            cursor.execute("SELECT COUNT(*) FROM %s WHERE %s MATCH %%s" % (fts, fts), [expression])
+            count = cursor.fetchone()[0]
+            cursor.execute("SELECT v.book_id, v.chapter_id, v.verse_id, -bm25(%s) FROM %s JOIN %s v ON v.id = %s.rowid "
+                           "WHERE %s MATCH %%s ORDER BY bm25(%s), v.book_id, v.chapter_id, v.verse_id LIMIT %%s OFFSET %%s"
+                           % (fts, fts, table, fts, fts, fts), [expression, limit, offset])
+            return count, cursor.fetchall()
+
+        # A NOT that FTS5 can't express (it has no "everything but"): match in SQL, rank by the other words.
+        where, params = self.where(tree, fts)
+        cursor.execute("SELECT COUNT(*) FROM %s v WHERE %s" % (table, where), params)
+        count = cursor.fetchone()[0]
+        ranks, rank_params = "(SELECT NULL AS rowid, 0.0 AS score)", []
+        if terms:
+            ranks = "(SELECT rowid, -bm25(%s) AS score FROM %s WHERE %s MATCH %%s)" % (fts, fts, fts)
+            rank_params = [u' OR '.join(self.quote(term) for term in terms)]
+        cursor.execute("SELECT v.book_id, v.chapter_id, v.verse_id, COALESCE(r.score, 0.0) AS score FROM %s v "
+                       "LEFT JOIN %s r ON r.rowid = v.id WHERE %s "
+                       "ORDER BY score DESC, v.book_id, v.chapter_id, v.verse_id LIMIT %%s OFFSET %%s" % (table, ranks, where),
+                       rank_params + params + [limit, offset])
+        return count, cursor.fetchall()
+
+    def quote(self, *words):
+        return u'"%s"' % u' '.join(words).replace(u'"', u'""')
+
+    def expression(self, node):
+        " The FTS5 query for a parsed query, or None if it has a NOT that isn't part of an AND. "
+        kind = node[0]
+        if kind == 'term':
+            return self.quote(node[1])
+        if kind == 'phrase':
+            return self.quote(*node[1])
+        if kind == 'not':
+            return None
+        if kind == 'or':
+            parts = [self.expression(child) for child in node[1]]
+            return None if None in parts else u'(%s)' % u' OR '.join(parts)
+        positive = [self.expression(child) for child in node[1] if child[0] != 'not']
+        negative = [self.expression(child[1]) for child in node[1] if child[0] == 'not']
+        if not positive or None in positive or None in negative:
+            return None
+        expression = u'(%s)' % u' AND '.join(positive)
+        if negative:
+            expression = u'(%s NOT (%s))' % (expression, u' OR '.join(negative))
+        return expression
+
+    def where(self, node, fts):
+        " A WHERE clause on the verse table (as v) for a parsed query, with its parameters. "
+        expression = self.expression(node)
+        if expression is not None:
+            return "v.id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)" % (fts, fts), [expression]
+        if node[0] == 'not':
+            where, params = self.where(node[1], fts)
+            return "NOT (%s)" % where, params
+        parts, params = [], []
+        for child in node[1]:
+            where, child_params = self.where(child, fts)
+            parts.append('(%s)' % where)
+            params.extend(child_params)
+        return (' OR ' if node[0] == 'or' else ' AND ').join(parts), params
+
+
+class PostgreSQLTsvector(object):
+
+    def config(self):
+        return getattr(settings, 'BIBLETEXT_SEARCH_CONFIG', 'simple')
+
+    def build(self, version, connection):
+        quote = connection.ops.quote_name
+        table = version._meta.db_table
+        cursor = connection.cursor()
+        cursor.execute("ALTER TABLE %s ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                       "GENERATED ALWAYS AS (to_tsvector(%%s::regconfig, coalesce(text, ''))) STORED"
+                       % quote(table), [self.config()])
+        cursor.execute("CREATE INDEX IF NOT EXISTS %s ON %s USING GIN (search_vector)"
+                       % (quote('%s_search_vector' % table), quote(table)))
+
+    def search(self, version, connection, tree, terms, offset, limit):
+        table = connection.ops.quote_name(version._meta.db_table)
+        query, params = self.tsquery(tree)
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM %s WHERE search_vector @@ (%s)" % (table, query), params)
+        count = cursor.fetchone()[0]
+        cursor.execute("SELECT book_id, chapter_id, verse_id, ts_rank(search_vector, query.q) AS score "
+                       "FROM %s, (SELECT %s AS q) AS query WHERE search_vector @@ query.q "
+                       "ORDER BY score DESC, book_id, chapter_id, verse_id LIMIT %%s OFFSET %%s"
+                       % (table, query), params + [limit, offset])
+        return count, cursor.fetchall()
+
+    def tsquery(self, node):
+        " An SQL tsquery expression for a parsed query, with its parameters. "
+        kind = node[0]
+        if kind in ('term', 'phrase'):
+            words = node[1] if kind == 'phrase' else (node[1],)
+            return "phraseto_tsquery(%s::regconfig, %s)", [self.config(), u' '.join(words)]
+        if kind == 'not':
+            query, params = self.tsquery(node[1])
+            return "!!(%s)" % query, params
+        parts, params = [], []
+        for child in node[1]:
+            query, child_params = self.tsquery(child)
+            parts.append('(%s)' % query)
+            params.extend(child_params)
+        return (' || ' if kind == 'or' else ' && ').join(parts), params
+
+
+VENDORS = {
+    'sqlite': SQLiteFTS5(),
+    'postgresql': PostgreSQLTsvector(),
+}
@@ -0,0 +1,391 @@
+"""
+An inverted index of a translation's text, in one file per translation that is memory-mapped
+rather than read in, so opening it costs next to nothing whatever the size of the text.
+
+File layout (all little-endian)::
+
+    header      HEADER, below.
+    lengths     uint16 per ordinal: the number of words in that verse (0 if it isn't in the text).
+    terms       The UTF-8 encoded words, concatenated in sorted order.
+    entries     5 x uint32 per word: its offset and length in terms, the offset of its postings,
+                the number of verses it's in, and its number of occurrences.
+    postings    Per word: the uint32 ordinals of the verses it's in, its float32 BM25 weight in
+                each of them, uint32 indexes into those ordered by weight (best first), and a
+                uint32 (ordinal << POSITION_BITS | position) per occurrence.
+
+The weights, their order and the positions are precomputed so that a query is mostly set
+operations done in C: a phrase is an intersection of occurrences shifted by one position per
+word, and the best verses for a single word are simply the first few in weight order.
+
+Build them with ``manage.py bibletext_search_index``.
+"""
+import math
+import mmap
+import operator
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from heapq import heappush, heapreplace, nlargest
+from itertools import compress, imap, izip, repeat
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from bibletext.lru import LRUCache
+from bibletext.search.query import tokenize
+from bibletext.utils import SearchError
+
+
+HEADER = struct.Struct('<4sHHIIIdIIII')
+ENTRY = struct.Struct('<5I')
+MAGIC = 'BTIX'
+FORMAT_VERSION = 1
+
+POSITION_BITS = 12 # Words after the 4096th of a verse can't start a phrase; no verse comes close.
+K1 = 1.2 # BM25 parameters.
+B = 0.75
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _read_array(typecode, data):
+    values = array(typecode)
+    values.fromstring(data)
+    return _little_endian(values)
+
+
+def _contains(values, value):
+    " Whether the sorted array values holds value. "
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+def build_index(version, path):
+    """
+    Tokenizes the text of a translation and writes its index to path (replacing any index
+    already there, atomically). Returns the number of verses indexed.
+    """
+    if version.bible.num_verses >> (32 - POSITION_BITS):
+        raise SearchError("The %s has too many verses to index." % version.translation)
+    postings = {} # word -> (ordinals, occurrences, locations)
+    lengths = array('H', [0]) * (version.bible.num_verses + 1)
+    verses = version.objects.order_by('book_id', 'chapter_id', 'verse_id').values_list(
+                'book_id', 'chapter_id', 'verse_id', 'text')
+    for book_id, chapter_id, verse_id, text in verses.iterator():
+        try:
+            ordinal = version.bible.ordinal_of(book_id, chapter_id, verse_id)
+        except IndexError:
+            continue # Not in the canon, so it can't be linked to either.
+        words = tokenize(text)
+        lengths[ordinal] = min(len(words), 0xffff)
+        locations = {}
+        for position, word in enumerate(words[:1 << POSITION_BITS]):
+            locations.setdefault(word, []).append(ordinal << POSITION_BITS | position)
+        for word, found in locations.iteritems():
+            entry = postings.get(word)
+            if entry is None:
+                entry = postings[word] = (array('I'), array('H'), array('I'))
+            entry[0].append(ordinal)
+            entry[1].append(len(found))
+            entry[2].extend(found)
+
+    num_docs = len([length for length in lengths if length])
+    average_length = float(sum(lengths)) / (num_docs or 1)
+    norms = [K1 * (1 - B + B * length / average_length) for length in lengths]
+
+    terms = sorted((word.encode('utf-8'), word) for word in postings)
+    entries = array('I')
+    term_data = []
+    posting_data = []
+    term_offset = posting_offset = 0
+    for encoded, word in terms:
+        ordinals, occurrences, locations = postings[word]
+        idf = math.log(1 + (num_docs - len(ordinals) + 0.5) / (len(ordinals) + 0.5))
+        weights = array('f', (idf * count * (K1 + 1) / (count + norms[ordinal])
+                              for ordinal, count in izip(ordinals, occurrences)))
+        ranking = array('I', sorted(xrange(len(ordinals)), key=weights.__getitem__, reverse=True))
+        entries.extend((term_offset, len(encoded), posting_offset, len(ordinals), len(locations)))
+        term_data.append(encoded)
+        term_offset += len(encoded)
+        for values in (ordinals, weights, ranking, locations):
+            data = _little_endian(values).tostring()
+            posting_data.append(data)
+            posting_offset += len(data)
+
+    lengths_offset = HEADER.size
+    terms_offset = lengths_offset + len(lengths) * lengths.itemsize
+    entries_offset = terms_offset + term_offset
+    postings_offset = entries_offset + len(entries) * entries.itemsize
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, num_docs, len(lengths) - 1, len(terms), average_length,
+                            lengths_offset, terms_offset, entries_offset, postings_offset))
+        f.write(_little_endian(lengths).tostring())
+        f.write(''.join(term_data))
+        f.write(_little_endian(entries).tostring())
+        for data in posting_data:
+            f.write(data)
+    os.rename(temporary, path)
+    return num_docs
+
+
+class Postings(object):
+    " The verses a word is in, its weight in each, and where exactly it is. "
+    __slots__ = ('ordinals', 'weights', 'ranking', 'locations', '_ordinal_set', '_weight_map', '_location_set')
+
+    def __init__(self, ordinals, weights, ranking, locations):
+        self.ordinals = ordinals
+        self.weights = weights
+        self.ranking = ranking
+        self.locations = locations
+        self._ordinal_set = self._weight_map = self._location_set = None
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def ordinal_set(self):
+        " frozenset of the ordinals, made on first use. "
+        if self._ordinal_set is None:
+            self._ordinal_set = frozenset(self.ordinals)
+        return self._ordinal_set
+
+    def location_set(self):
+        " frozenset of the locations, made on first use. "
+        if self._location_set is None:
+            self._location_set = frozenset(self.locations)
+        return self._location_set
+
+    def weight_map(self):
+        " {ordinal: BM25 weight}, made on first use. "
+        if self._weight_map is None:
+            self._weight_map = dict(izip(self.ordinals, self.weights))
+        return self._weight_map
+
+
+class InvertedIndex(object):
+    " A memory-mapped index file, see build_index(). Safe to share between threads. "
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, format_version, _, self.num_docs, self.max_ordinal, self.num_terms, self.average_length,
+         self._lengths_offset, self._terms_offset, self._entries_offset, self._postings_offset
+        ) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self.close()
+            raise SearchError("%s isn't a search index this version of bibletext can read, rebuild it." % path)
+        self._postings = LRUCache(getattr(settings, 'BIBLETEXT_SEARCH_POSTINGS_CACHE_SIZE', 256))
+        self._all = None
+
+    def close(self):
+        " Unmaps the file, which closes the map's handle on it (the file itself is closed once mapped). "
+        self._map.close()
+
+    def entry(self, word):
+        " Binary searches the sorted words for (offset, length, postings offset, verses, occurrences). "
+        encoded = word.encode('utf-8')
+        low, high = 0, self.num_terms
+        while low < high:
+            middle = (low + high) // 2
+            entry = ENTRY.unpack_from(self._map, self._entries_offset + middle * ENTRY.size)
+            start = self._terms_offset + entry[0]
+            term = self._map[start:start + entry[1]]
+            if term < encoded:
+                low = middle + 1
+            elif term > encoded:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def postings(self, word):
+        " The Postings of a normalized word, or None if it isn't in the text. "
+        postings = self._postings.get(word)
+        if postings is None:
+            entry = self.entry(word)
+            if entry is None:
+                return None
+            _, _, offset, count, total = entry
+            start = self._postings_offset + offset
+            values = []
+            for typecode, size in (('I', count), ('f', count), ('I', count), ('I', total)):
+                end = start + size * 4
+                values.append(_read_array(typecode, self._map[start:end]))
+                start = end
+            postings = Postings(*values)
+            self._postings.set(word, postings)
+        return postings
+
+    def all_ordinals(self):
+        " Every verse in the index, for NOT queries. "
+        if self._all is None:
+            lengths = _read_array('H', self._map[self._lengths_offset:self._terms_offset])
+            self._all = frozenset(ordinal for ordinal, length in enumerate(lengths) if length)
+        return self._all
+
+    def matches(self, node):
+        """
+        The ordinals of the verses matching a parsed query, see bibletext.search.query.
+        The (frozen)set returned may be cached, so don't change it.
+        """
+        kind = node[0]
+        if kind == 'term':
+            postings = self.postings(node[1])
+            return postings.ordinal_set() if postings else frozenset()
+        if kind == 'phrase':
+            return self.phrase(node[1])
+        if kind == 'not':
+            return self.all_ordinals() - self.matches(node[1])
+        if kind == 'or':
+            return frozenset().union(*[self.matches(child) for child in node[1]])
+        # 'and': intersect the positive parts, smallest first, then take away the NOT'ed ones.
+        positive = [child for child in node[1] if child[0] != 'not']
+        negative = [child[1] for child in node[1] if child[0] == 'not']
+        if positive:
+            sets = sorted((self.matches(child) for child in positive), key=len)
+            found = sets[0]
+            for other in sets[1:]:
+                if not found:
+                    break
+                found = found & other
+        else:
+            found = self.all_ordinals()
+        for child in negative:
+            if not found:
+                break
+            found = found - self.matches(child)
+        return found
+
+    def phrase(self, words):
+        " The verses with the words next to each other, in order. "
+        postings = [self.postings(word) for word in words]
+        if not all(postings):
+            return set()
+        # Where the phrase could start: each word's locations, less its place in the phrase.
+        starts = None
+        for offset, other in sorted(enumerate(postings), key=lambda item: len(item[1].locations)):
+            if starts is None:
+                starts = set(imap(operator.sub, other.locations, repeat(offset)))
+            elif len(starts) < 64: # Few left: look them up in the sorted locations.
+                starts = set(start for start in starts if _contains(other.locations, start + offset))
+            else:
+                present = imap(other.location_set().__contains__, imap(operator.add, starts, repeat(offset)))
+                starts = set(compress(starts, present))
+            if not starts:
+                return set()
+        return set(imap(operator.rshift, starts, repeat(POSITION_BITS)))
+
+    def top(self, word, count):
+        " The count best verses for a single word, as [(ordinal, score), ...]. "
+        postings = self.postings(word)
+        if not postings:
+            return []
+        return [(postings.ordinals[i], postings.weights[i]) for i in postings.ranking[:count]]
+
+    def best(self, words, matches, count):
+        """
+        The count best of the matching verses, by the sum of the given words' BM25 weights,
+        as [(ordinal, score), ...]. Verses that score the same stay in canonical order.
+
+        Walks the words' verses best first, scoring the matching ones, and stops once no verse
+        further down could make the top count (Fagin's threshold algorithm). If that takes too
+        long, say for an uncommon combination of common words, every match is scored instead.
+        """
+        postings = filter(None, imap(self.postings, words))
+        maps = [each.weight_map() for each in postings]
+        count = min(count, len(matches))
+        if not count:
+            return []
+        top = [] # Heap of the (score, -ordinal) of the best verses so far.
+        seen = set()
+        budget = len(matches) // (len(postings) or 1)
+        for depth in xrange(max([len(each) for each in postings] or [0])):
+            if depth > budget:
+                return self._score_all(maps, matches, count)
+            frontier = 0.0 # The most a verse not seen yet could score.
+            for each in postings:
+                if depth < len(each.ranking):
+                    i = each.ranking[depth]
+                    frontier += each.weights[i]
+                    ordinal = each.ordinals[i]
+                    if ordinal in matches and ordinal not in seen:
+                        seen.add(ordinal)
+                        entry = (sum([weights.get(ordinal, 0.0) for weights in maps]), -ordinal)
+                        if len(top) < count:
+                            heappush(top, entry)
+                        elif entry > top[0]:
+                            heapreplace(top, entry)
+            if len(top) == count and top[0][0] > frontier:
+                break
+        best = [(-ordinal, score) for score, ordinal in sorted(top, reverse=True)]
+        if len(best) < count: # Matches with none of the words (eg: "lord OR NOT the") score nothing.
+            best.extend((ordinal, 0.0) for ordinal in sorted(matches - seen)[:count - len(best)])
+        return best
+
+    def _score_all(self, maps, matches, count):
+        ordinals = list(matches)
+        columns = [imap(weights.get, ordinals, repeat(0.0)) for weights in maps]
+        scores = array('d', imap(sum, izip(*columns)) if len(columns) > 1 else columns[0])
+        candidates = izip(scores, ordinals)
+        if count < len(scores):
+            # Only the verses scoring at least the count'th best score need sorting.
+            threshold = nlargest(count, scores)[-1]
+            candidates = compress(candidates, imap(operator.ge, scores, repeat(threshold)))
+        best = sorted((-score, ordinal) for score, ordinal in candidates)[:count]
+        return [(ordinal, -score) for score, ordinal in best]
+
+
+class InvertedIndexBackend(object):
+    """
+    Searches the index files in the BIBLETEXT_SEARCH_INDEX_DIR directory, one per translation.
+    Indexes are opened on first use and reopened when the file is rebuilt.
+    """
+
+    def __init__(self):
+        self._indexes = {} # translation -> (modification time, InvertedIndex)
+
+    def path(self, version):
+        directory = getattr(settings, 'BIBLETEXT_SEARCH_INDEX_DIR', None)
+        if not directory:
+            raise ImproperlyConfigured("Set BIBLETEXT_SEARCH_INDEX_DIR to the directory to keep the search indexes in.")
+        return os.path.join(directory, '%s.idx' % version.translation)
+
+    def build(self, version):
+        " Builds the index of the given translation. Returns the number of verses indexed. "
+        return build_index(version, self.path(version))
+
+    def get_index(self, version):
+        path = self.path(version)
+        try:
+            modified = os.stat(path).st_mtime
+        except OSError:
+            raise SearchError("There's no search index for the %s, run manage.py bibletext_search_index." % version.translation)
+        opened = self._indexes.get(version.translation)
+        if opened is None or opened[0] != modified:
+            # The old index isn't closed: other threads may be searching it. It's unmapped once
+            # the last of them lets go of it.
+            opened = self._indexes[version.translation] = (modified, InvertedIndex(path))
+        return opened[1]
+
+    def search(self, version, tree, terms, offset, limit):
+        """
+        Returns (the number of matching verses, [(ordinal, score), ...]) for the verses from offset
+        to offset + limit, best first. Verses that score the same stay in canonical order.
+        """
+        index = self.get_index(version)
+        if tree[0] == 'term':
+            postings = index.postings(tree[1])
+            return len(postings or ()), index.top(tree[1], offset + limit)[offset:]
+        matches = index.matches(tree)
+        return len(matches), index.best(terms, matches, offset + limit)[offset:]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Tokenizing of verse text and parsing of search queries, shared by the search backends.
+
+Queries are words, "quoted phrases", AND, OR, NOT (or a leading -) and parentheses.
+Words next to each other must all match, eg::
+
+    love NOT hate
+    "in the beginning" OR (faith AND hope)
+    -the lord
+"""
+import re
+
+from bibletext.utils import SearchError
+
+
+# Words, keeping apostrophes inside them ("LORD's", "wouldn't").
+word_re = re.compile(u"[^\\W_]+(?:['’][^\\W_]+)*", re.UNICODE)
+query_token_re = re.compile(u'"[^"]*"?|[()]|-(?=\\S)|[^\\s()"]+', re.UNICODE)
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+
+class QueryError(SearchError):
+    " The search can't be made sense of. "
+
+
+def normalize(word):
+    " Lowercases a word and drops a possessive 's, so 'LORD's' is found by 'lord'. "
+    word = word.lower().replace(u'’', u"'")
+    if word.endswith(u"'s"):
+        word = word[:-2]
+    return word
+
+
+def tokenize(text):
+    " The normalized words of text, in order. Their index in the list is their position. "
+    return [normalize(word) for word in word_re.findall(text)]
+
+
+# The parsed query is a tree of tuples:
+#   ('term', word), ('phrase', (word, ...)), ('and', [node, ...]), ('or', [node, ...]), ('not', node)
+
+def parse(query):
+    " Parses a query string into a tree, see above. Raises QueryError if it can't be made sense of. "
+    tokens = query_token_re.findall(query)
+    parser = _Parser(tokens)
+    node = parser.parse_or()
+    if parser.peek() is not None:
+        raise QueryError("Unexpected %r in the search." % parser.peek())
+    if node is None:
+        raise QueryError("There is nothing to search for.")
+    return node
+
+
+def terms(node):
+    " The words of a parsed query that count towards the ranking (ie: that aren't NOT'ed). "
+    kind = node[0]
+    if kind == 'term':
+        return [node[1]]
+    if kind == 'phrase':
+        return list(node[1])
+    if kind == 'not':
+        return []
+    words = []
+    for child in node[1]:
+        words.extend(word for word in terms(child) if word not in words)
+    return words
+
+
+class _Parser(object):
+    " Recursive descent: or := and (OR and)*; and := not ([AND] not)*; not := (NOT|-) not | atom "
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def peek(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+
+    def next(self):
+        token = self.peek()
+        self.index += 1
+        return token
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.next()
+            nodes.append(self.parse_and())
+        return self._combine('or', nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() not in (None, 'OR', ')'):
+            if self.peek() == 'AND':
+                self.next()
+            nodes.append(self.parse_not())
+        return self._combine('and', nodes)
+
+    def parse_not(self):
+        if self.peek() in ('NOT', '-'):
+            self.next()
+            node = self.parse_not()
+            return node and ('not', node)
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.next()
+        if token is None:
+            raise QueryError("The search ends too soon.")
+        if token == '(':
+            node = self.parse_or()
+            if self.next() != ')':
+                raise QueryError("A bracket isn't closed.")
+            return node
+        if token == ')':
+            raise QueryError("A bracket isn't opened.")
+        if token in OPERATORS:
+            raise QueryError("%s needs something to search for." % token)
+        words = tokenize(token)
+        if len(words) > 1: # A quoted phrase, or eg: 'long-suffering'.
+            return ('phrase', tuple(words))
+        return words and ('term', words[0]) or None # Punctuation alone is ignored.
+
+    def _combine(self, kind, nodes):
+        nodes = [node for node in nodes if node]
+        if not nodes:
+            return None
+        if len(nodes) == 1:
+            return nodes[0]
+        return (kind, nodes)
@@ -0,0 +1,254 @@
+"""
+A read-only text store: each translation's verses packed into one file, read through mmap, so
+serving the text needs no database and every process shares the one copy in the page cache.
+
+Set BIBLETEXT_TEXT_STORE to a directory and pack the translations into it after each import::
+
+    python manage.py bibletext_pack [--compress] [KJV ...]
+
+chapter_cache (and so KJV.objects.chapter(), verse(), passage(), verses_many(), the views,
+template tags and search) then reads chapters from the store instead of the shared cache and
+the database. A translation without a packed file, or packed under another content version
+(see VerseText.get_content_version), is still read from the database.
+
+File layout, little-endian::
+
+    header      HEADER: magic, format version, flags, verses in the canon, blocks, content version.
+    offsets     uint32 * (verses + 1): where the UTF-8 text of the verse with each ordinal
+                starts (and the last one ends) in the text. Verses missing from the
+                database have no text and aren't read back.
+    pks         uint32 * verses: the primary keys of the verses.
+    blocks      Compressed files only. uint32 * blocks: the ordinal of each block's first
+                verse, then uint32 * (blocks + 1): where each block starts in the text.
+    text        The text of every verse in canonical order; when compressed, in zlib
+                compressed blocks of whole chapters (at least block_size bytes of text each).
+
+Offsets are read from the map as they're needed; only the block index is loaded up front.
+Decompressed blocks are kept in an LRU of BIBLETEXT_TEXT_STORE_CACHE_SIZE (default 64) blocks
+per store. Compressed, a translation takes less than half the space and reading a chapter that
+isn't in the LRU takes about 40% longer; ``manage.py bibletext_benchmark_store`` measures both.
+"""
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from codecs import utf_8_decode
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from bibletext.lru import LRUCache
+
+
+HEADER = struct.Struct('<4sHHII32s')
+MAGIC = 'BTTX'
+FORMAT_VERSION = 2
+COMPRESSED = 1 # flags
+BLOCK_SIZE = 4096
+
+# The columns of VerseText, in order. Instances are made positionally when a translation has no
+# others (as Django does when reading rows), which takes half the time of keyword arguments.
+VERSE_FIELDS = ('id', 'book_id', 'chapter_id', 'verse_id', 'ordinal', 'text')
+
+
+def store_path(version):
+    directory = getattr(settings, 'BIBLETEXT_TEXT_STORE', None)
+    if not directory:
+        raise ImproperlyConfigured("Set BIBLETEXT_TEXT_STORE to the directory to keep the packed texts in.")
+    return os.path.join(directory, '%s.text' % version.translation)
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+
+def pack(version, path=None, compress=False, block_size=BLOCK_SIZE):
+    """
+    Packs a translation's text from the database into its store file (atomically). Returns the
+    verse count. With `compress` the text is zlib compressed in blocks of whole chapters, at
+    least `block_size` bytes of text each (0 for a block per chapter).
+    """
+    path = path or store_path(version)
+    bible = version.bible
+    total = bible.num_verses
+    offsets = array('I', [0]) * (total + 1)
+    pks = array('I', [0]) * total
+    chunks = []
+    size = 0
+    previous = 0 # The ordinal of the last verse read, verses in between have no text.
+    verses = version.objects.order_by('book_id', 'chapter_id', 'verse_id').values_list(
+                'pk', 'book_id', 'chapter_id', 'verse_id', 'text')
+    count = 0
+    for pk, book_id, chapter_id, verse_id, text in verses.iterator():
+        try:
+            ordinal = bible.ordinal_of(book_id, chapter_id, verse_id)
+        except IndexError:
+            continue # Not in the canon.
+        for missing in xrange(previous + 1, ordinal):
+            offsets[missing] = size
+        data = text.encode('utf-8')
+        chunks.append(data)
+        size += len(data)
+        offsets[ordinal] = size
+        pks[ordinal - 1] = pk
+        previous = ordinal
+        count += 1
+    for missing in xrange(previous + 1, total + 1):
+        offsets[missing] = size
+
+    firsts = array('I')
+    starts = array('I', [0])
+    if compress:
+        text = ''.join(chunks)
+        chunks = []
+        first = 1
+        for book in bible:
+            for chapter in book:
+                last = first + chapter.num_verses - 1
+                if not firsts or offsets[first - 1] - offsets[firsts[-1] - 1] >= block_size:
+                    if firsts:
+                        chunks.append(zlib.compress(text[offsets[firsts[-1] - 1]:offsets[first - 1]], 9))
+                        starts.append(starts[-1] + len(chunks[-1]))
+                    firsts.append(first)
+                first = last + 1
+        chunks.append(zlib.compress(text[offsets[firsts[-1] - 1]:], 9))
+        starts.append(starts[-1] + len(chunks[-1]))
+
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, COMPRESSED if compress else 0, total, len(firsts),
+                            str(version.get_content_version())))
+        f.write(_little_endian(offsets))
+        f.write(_little_endian(pks))
+        if compress:
+            f.write(_little_endian(firsts))
+            f.write(_little_endian(starts))
+        for data in chunks:
+            f.write(data)
+    os.rename(temporary, path)
+    return count
+
+
+class TextStore(object):
+    " A packed text file, see pack(). Safe to share between threads. "
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, flags, self.num_verses, num_blocks, content_version = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ImproperlyConfigured("%s isn't a text store this version of bibletext can read, pack it again." % path)
+        self.content_version = content_version.rstrip('\0')
+        self.compressed = bool(flags & COMPRESSED)
+        self._offsets = HEADER.size
+        self._pks = self._offsets + 4 * (self.num_verses + 1)
+        self._text = self._pks + 4 * self.num_verses
+        if self.compressed:
+            index = struct.unpack_from('<%dI' % (2 * num_blocks + 1), self._map, self._text)
+            self._firsts, self._starts = index[:num_blocks], index[num_blocks:]
+            self._text += 4 * len(index)
+            self._blocks = LRUCache(getattr(settings, 'BIBLETEXT_TEXT_STORE_CACHE_SIZE', 64))
+
+    def close(self):
+        self._map.close()
+
+    def block(self, number):
+        " The decompressed text of a block, and the ordinal of its first verse. "
+        data = self._blocks.get(number)
+        if data is None:
+            start = self._text + self._starts[number]
+            data = zlib.decompress(self._map[start:self._text + self._starts[number+1]])
+            self._blocks.set(number, data)
+        return data, self._firsts[number]
+
+    def verses(self, first, last):
+        " [(ordinal, pk, text), ...] of the verses from ordinal first to last that have text. "
+        count = last - first + 1
+        offsets = struct.unpack_from('<%dI' % (count + 1), self._map, self._offsets + 4 * (first - 1))
+        pks = struct.unpack_from('<%dI' % count, self._map, self._pks + 4 * (first - 1))
+        found = []
+        if not self.compressed:
+            text = self._text
+            for i in xrange(count):
+                if pks[i]: # Decoded straight from the map, the bytes aren't copied first.
+                    start = text + offsets[i]
+                    found.append((first + i, pks[i], utf_8_decode(buffer(self._map, start, text + offsets[i+1] - start))[0]))
+            return found
+
+        number = bisect_right(self._firsts, first) - 1
+        data, block_first = self.block(number)
+        base = -struct.unpack_from('<I', self._map, self._offsets + 4 * (block_first - 1))[0]
+        for i in xrange(count):
+            ordinal = first + i
+            if number + 1 < len(self._firsts) and ordinal >= self._firsts[number + 1]: # Into the next block.
+                number += 1
+                data, block_first = self.block(number)
+                base = -offsets[i] # The block starts at this verse.
+            if pks[i]:
+                start = base + offsets[i]
+                found.append((ordinal, pks[i], utf_8_decode(buffer(data, start, base + offsets[i+1] - start))[0]))
+        return found
+
+    def text(self, ordinal):
+        " The text of a verse, or None if it had none. "
+        verses = self.verses(ordinal, ordinal)
+        return verses[0][2] if verses else None
+
+    def chapters(self, version, chapters):
+        " Returns {(book_id, chapter_id): [verses], ...} like BiblePassageManager.fetch_chapters. "
+        bible = version.bible
+        make = _factory(version)
+        found = {}
+        for book_id, chapter_id in chapters:
+            first = bible.ordinal_of(book_id, chapter_id, 1)
+            verses = self.verses(first, first + bible[book_id][chapter_id].num_verses - 1)
+            found[(book_id, chapter_id)] = [make(pk, book_id, chapter_id, ordinal - first + 1, ordinal, text)
+                                            for ordinal, pk, text in verses]
+        return found
+
+    def ordinals(self, version, first, last):
+        " Returns the verses with ordinals first to last, in order. "
+        bible = version.bible
+        make = _factory(version)
+        found = []
+        for ordinal, pk, text in self.verses(first, last):
+            verse = bible.verse_at(ordinal)
+            found.append(make(pk, verse.chapter.book.number, verse.chapter.number, verse.number, ordinal, text))
+        return found
+
+
+def _factory(version):
+    " Makes instances of version from VERSE_FIELDS values, positionally when the fields allow. "
+    if tuple(field.attname for field in version._meta.fields) != VERSE_FIELDS:
+        return lambda *values: version(**dict(zip(VERSE_FIELDS, values)))
+    return version
+
+
+_stores = {} # translation -> (modification time, TextStore)
+
+def get_store(version):
+    """
+    The TextStore of a translation, reopened when it has been packed again, or None when
+    BIBLETEXT_TEXT_STORE isn't set or the translation isn't packed under its current content version.
+    """
+    if not getattr(settings, 'BIBLETEXT_TEXT_STORE', None):
+        return None
+    try:
+        modified = os.stat(store_path(version)).st_mtime
+    except OSError:
+        return None
+    opened = _stores.get(version.translation)
+    if opened is None or opened[0] != modified:
+        opened = _stores[version.translation] = (modified, TextStore(store_path(version)))
+    store = opened[1]
+    if store.content_version != str(version.get_content_version()):
+        return None
+    return store
@@ -1,13 +1,16 @@
 from django import template
-from django.db.models import Count
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.safestring import mark_safe, SafeUnicode
 
 from bibletext.models import KJV
-from bibletext.utils import BookError, find_book
+from bibletext.utils import BookError, check_verse_counts, find_book
 
 
 register = template.Library()
 
+_checked_versions = {} # translation -> the error, or None. See the BIBLETEXT_CHECK_VERSE_COUNTS setting.
+
 @register.inclusion_tag('bibletext/books.html')
 def books(bible=KJV):
     """
@@ -39,6 +42,11 @@ def chapters(book, bible=KJV):
     Uses :template:`bibletext/chapters.html` to render the chapter numbers.
     You override this template.
     
+    The chapters and their verse counts come from the canon, without a database query.
+    Set BIBLETEXT_CHECK_VERSE_COUNTS = True to have the counts checked against the
+    database once per process, raising ImproperlyConfigured for an incomplete import (checked
+    once too: restart the process after importing the rest).
+    
     @args
         
         ``book``: The book to list chapters from.
@@ -76,7 +84,17 @@ def chapters(book, bible=KJV):
                 'chapters' : None
             }
     
+    if getattr(settings, 'BIBLETEXT_CHECK_VERSE_COUNTS', False):
+        if bible.translation not in _checked_versions: # The result is kept, so a bad text isn't counted every render.
+            mismatches = check_verse_counts(bible)
+            _checked_versions[bible.translation] = None
+            if mismatches:
+                _checked_versions[bible.translation] = "The %s text doesn't match its canon: %s" % (bible.translation,
+                    ', '.join('%s:%s has %s verses, not %s' % (b, c, found, expected) for b, c, expected, found in mismatches[:10]))
+        if _checked_versions[bible.translation]:
+            raise ImproperlyConfigured(_checked_versions[bible.translation])
+    
     return {
         'book': book,
-        'chapters' : bible.objects.filter(book_id=book.number).values('chapter_id').annotate(num_verses=Count('verse_id'))
+        'chapters' : [{'chapter_id': chapter.number, 'num_verses': len(chapter), 'chapter': chapter} for chapter in book]
     }
\ No newline at end of file
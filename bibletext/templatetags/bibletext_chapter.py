@@ -44,7 +44,7 @@ def chapter(book, chapter=1, bible=KJV):
                 'bible': None,
                 'book': None,
                 'chapter': None,
-                'verse_list' : bible.objects.none()
+                'verse_list' : []
             }
             
     elif type(book) in (SafeUnicode, str, unicode):
@@ -58,17 +58,17 @@ def chapter(book, chapter=1, bible=KJV):
                 'bible': None,
                 'book': None,
                 'chapter': None,
-                'verse_list' : bible.objects.none()
+                'verse_list' : []
             }
     
     try:
-        verse_list = bible.objects.filter(book_id=book.number, chapter_id=int(chapter))
-    except bible.DoesNotExist:
-        verse_list = bible.objects.none()
+        verse_list = bible.objects.chapter(book.number, chapter)
+    except (IndexError, bible.DoesNotExist):
+        verse_list = []
     
     return {
         'bible': bible,
         'book': book,
         'chapter': chapter,
-        'verse_list' : bible.objects.filter(book_id=book.number, chapter_id=int(chapter))
+        'verse_list' : verse_list
     }
\ No newline at end of file
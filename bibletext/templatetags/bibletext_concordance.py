@@ -0,0 +1,61 @@
+from django import template
+from django.core.exceptions import ImproperlyConfigured
+
+from bibletext.concordance import lookup
+from bibletext.models import KJV
+from bibletext.utils import ConcordanceError
+
+
+register = template.Library()
+
+def find_entry(bible, word):
+    " The concordance entry for word, or None, also when there's no concordance to look it up in. "
+    try:
+        return lookup(bible, word)
+    except (ConcordanceError, ImproperlyConfigured):
+        return None
+
+
+@register.inclusion_tag('bibletext/concordance.html')
+def concordance(word, bible=KJV, limit=100):
+    """
+    Renders the concordance entry for a word of :model:`bibletext.KJV` (or another ``bible``):
+    how often it's used, in which books, and links to (the first ``limit``) verses using it.
+    
+    Uses :template:`bibletext/concordance.html` to render the entry.
+    You override this template.
+    
+    @args
+        
+        ``word``: The word to look up, in any case. eg: 'grace'. Renders as a word that isn't used
+        when there's no concordance of the translation.
+        
+        ``bible``: The model object of the translation. Defaults to the :model:`bibletext.KJV` text.
+        
+        ``limit``: The most verses to link to. Defaults to 100.
+    
+    Usage::
+        
+        {% concordance 'grace' %}, {% concordance 'grace' MyTranslation 20 %}
+    """
+    entry = find_entry(bible, word)
+    
+    return {
+        'word': word,
+        'entry': entry,
+        'verse_list': [bible.bible.verse_at(ordinal) for ordinal in entry.ordinals[:limit]] if entry else [],
+        'bible': bible,
+    }
+
+@register.simple_tag
+def word_count(word, bible=KJV):
+    """
+    Outputs how many times a word is used in :model:`bibletext.KJV` (or another ``bible``), or 0
+    when there's no concordance of it.
+    
+    Usage::
+        
+        {% word_count 'grace' %}, {% word_count 'grace' MyTranslation %}
+    """
+    entry = find_entry(bible, word)
+    return entry.occurrences if entry else 0
@@ -0,0 +1,47 @@
+from django import template
+from django.utils.html import escape
+from django.utils.safestring import SafeData, mark_safe
+
+from bibletext.autolink import link_references as link
+from bibletext.models import KJV
+from bibletext.utils import lookup_translation
+
+
+register = template.Library()
+
+def _link(value, bible, preview, autoescape):
+    if bible is None:
+        bible = KJV
+    elif isinstance(bible, basestring):
+        bible = lookup_translation(bible)
+    if autoescape and not isinstance(value, SafeData):
+        value = escape(value)
+    return mark_safe(link(value, bible, preview))
+
+@register.filter(needs_autoescape=True)
+def link_references(value, bible=None, autoescape=None):
+    """
+    Links the scripture references in some text or HTML to their verses in :model:`bibletext.KJV`
+    (or another ``bible``). Text that isn't marked safe is escaped first, like ``urlize``.
+
+    @args
+
+        ``bible``: The model object, or translation ('KJV'), to link to. Defaults to the KJV.
+
+    Usage::
+
+        {{ sermon.notes|link_references }}, {{ sermon.notes|link_references:'KJV' }}
+    """
+    return _link(value, bible, False, autoescape)
+
+@register.filter(needs_autoescape=True)
+def preview_references(value, bible=None, autoescape=None):
+    """
+    Like ``link_references``, but the links also carry the text of the (first) verse in their
+    title, and the full reference in ``data-reference``, for hover previews.
+
+    Usage::
+
+        {{ sermon.notes|preview_references }}, {{ sermon.notes|preview_references:MyTranslation }}
+    """
+    return _link(value, bible, True, autoescape)
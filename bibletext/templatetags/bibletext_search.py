@@ -0,0 +1,40 @@
+from django import template
+from django.core.exceptions import ImproperlyConfigured
+
+from bibletext.models import KJV
+from bibletext.search import SearchError, search
+
+
+register = template.Library()
+
+@register.inclusion_tag('bibletext/_search_results.html')
+def search_verses(query, bible=KJV, limit=10):
+    """
+    Renders the verses of :model:`bibletext.KJV` (or another ``bible``) best matching a search.
+    
+    Uses :template:`bibletext/_search_results.html` to render the verses.
+    You override this template.
+    
+    @args
+        
+        ``query``: The search, eg: 'love NOT hate'. See bibletext.search for the syntax.
+        Nothing is rendered if it can't be made sense of, or there's no search index.
+        
+        ``bible``: The model object of the translation you want to search.
+        Defaults to the :model:`bibletext.KJV` text.
+        
+        ``limit``: The most verses to show. Defaults to 10.
+    
+    Usage::
+        
+        {% search_verses 'faith hope charity' %}, {% search_verses '"the good shepherd"' MyTranslation 5 %}
+    """
+    try:
+        results = search(bible, query, per_page=limit)
+    except (SearchError, ImproperlyConfigured): # A bad query (QueryError), or no index to search.
+        results = None
+    
+    return {
+        'results': results,
+        'bible': bible,
+    }
@@ -4,6 +4,7 @@ from django.utils.safestring import mark_safe
 from bible import Passage # python-bible module.
 
 from bibletext.models import KJV
+from bibletext.references import parse_verse
 
 
 register = template.Library()
@@ -35,7 +36,7 @@ def verse(reference, bible=KJV):
     }
 
 @register.inclusion_tag('bibletext/passage.html')
-def passage(start_reference, end_reference=None, bible=KJV):
+def passage(start_reference, end_reference=None, bible=KJV, limit=None):
     """
     Renders a passage from :model:`bibletext.KJV` (or another ``bible``)
     
@@ -51,18 +52,27 @@ def passage(start_reference, end_reference=None, bible=KJV):
         
         ``bible``: The model object of the translation you want to quote from.
         Defaults to the :model:`bibletext.KJV` text.
+        
+        ``limit``: Show at most this many verses of the passage, and `more`, see bibletext.paging.
     
     Usage::
         
-        {% passage 'John 3:16' 'John 3:18' %}, {% passage 'John 3:16' 'John 3:18' MyTranslation %}
+        {% passage 'John 3:16' 'John 3:18' %}, {% passage 'John 3:16' 'John 3:18' MyTranslation %},
+        {% passage 'Psalm 119:1' 'Psalm 119:176' limit=8 %}
     """
     if end_reference in (None, ''):
         end_reference = start_reference
-    verse_list = bible.objects.passage(start_reference, end_reference)
-    passage = Passage(start_reference, end_reference) # Call {{ passage.format }} for the scripture reference.
+    following = None
+    if limit:
+        verse_list, following = bible.objects.page(bible.objects.ordinal_ranges(start_reference, end_reference),
+                                                   per_page=int(limit))
+    else:
+        verse_list = bible.objects.passage(start_reference, end_reference)
+    passage = Passage(parse_verse(start_reference), parse_verse(end_reference)) # Call {{ passage.format }} for the scripture reference.
     
     return {
         'verse_list' : verse_list,
         'passage': passage,
+        'more': following is not None,
         'bible': bible,
     }
\ No newline at end of file
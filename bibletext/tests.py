@@ -2,9 +2,63 @@
 Unit Tests for django-bibletext.
 """
 
-from django.test import TestCase
+import json
+import os
+import random
+import shutil
+import tempfile
+from StringIO import StringIO
 
-from bibletext.models import KJV
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.http import Http404
+from django.template import Template, loader
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from bible import RangeError # python-bible module.
+
+from bibletext import autolink, concordance, store, views
+from bibletext.export import chapter_paths, export_paths, remove_stale_pages
+from bibletext.autolink import find_references, link_references
+from bibletext.caching import chapter_cache
+from bibletext.importer import import_scripture, import_verses, read_csv, read_scripture_csv, read_usfm
+from bibletext.intervals import IntervalTree
+from bibletext.lru import LRUCache
+from bibletext.templatetags import bibletext_books
+from bibletext.templatetags.bibletext_concordance import concordance as concordance_tag, word_count
+from bibletext.templatetags.bibletext_search import search_verses
+from bibletext.models import KJV, Scripture, scripture_index
+from bibletext.references import parse_ranges, parse_verse
+from bibletext.search import highlight
+from bibletext.search.db import DatabaseBackend
+from bibletext.search.inverted import InvertedIndex, InvertedIndexBackend, build_index
+from bibletext.search.query import QueryError, parse, terms
+from bibletext.utils import BookError, TextImportError, find_book
+
+
+VERSES = (
+    (1, 1, 1, u"In the beginning God created the heaven and the earth."),
+    (1, 1, 3, u"And God said, Let there be light: and there was light."),
+    (19, 23, 1, u"The LORD is my shepherd; I shall not want."),
+    (43, 3, 16, u"For God so loved the world, that he gave his only begotten Son."),
+)
+
+def create_verses(verses=VERSES):
+    " A few verses of the KJV, for the tests that need text. "
+    for book_id, chapter_id, verse_id, text in verses:
+        KJV.objects.create(book_id=book_id, chapter_id=chapter_id, verse_id=verse_id, text=text)
+
+def usfm(verses):
+    " A USFM file of the given verses of Jude, with a note, a heading and word attributes to leave out. "
+    lines = [u'\\id JUD Jude', u'\\c 1', u'\\s1 A heading', u'\\p']
+    lines.extend(u'\\v %d Verse\\f + \\fr 1:%d \\ft a note\\f* \\w %d|strong="G1"\\w*.' % (verse, verse, verse)
+                 for verse in verses)
+    return StringIO(u'\n'.join(lines).encode('utf-8'))
 
 
 class KJVModels(TestCase):
@@ -17,3 +71,617 @@ class KJVModels(TestCase):
         " Tests length operations. "
         self.failUnlessEqual(KJV.bible.num_verses, KJV.objects.all().count())
         
+
+
+class Canon(TestCase):
+    
+    def test_lazy_views(self):
+        " Chapters and verses are created on access but compare by value. "
+        john = KJV.bible[43]
+        self.failUnlessEqual(john[3], john[3])
+        self.failUnlessEqual(john[3][16], KJV.bible[43][3][16])
+        self.failUnlessEqual(len(set([john[3][16], john[3][16]])), 1)
+        self.failUnlessEqual(john[3][16].next, john[3][17])
+        self.failUnlessEqual(john[-1][-1], john[21][25])
+        self.failUnlessEqual(KJV.bible[19][119].name, 'Psalm 119')
+    
+    def test_counts(self):
+        " Verse counts come from the compact canon arrays. "
+        self.failUnlessEqual(len(KJV.bible[19][119]), 176)
+        self.failUnlessEqual(KJV.bible[1].num_verses, 1533)
+        self.failUnlessEqual(KJV.bible.num_verses, 31102)
+    
+    def test_check_verse_counts(self):
+        " An incomplete text is counted once per process, and the error kept for later renders. "
+        create_verses()
+        bibletext_books._checked_versions.clear()
+        with self.settings(BIBLETEXT_CHECK_VERSE_COUNTS=True):
+            self.assertRaises(ImproperlyConfigured, bibletext_books.chapters, 1)
+            with self.assertNumQueries(0):
+                self.assertRaises(ImproperlyConfigured, bibletext_books.chapters, 1)
+        bibletext_books._checked_versions.clear()
+    
+    def test_ordinals(self):
+        " ordinal_of and verse_at are inverses over the whole canon. "
+        bible = KJV.bible
+        self.failUnlessEqual(bible.ordinal_of(1, 1, 1), 1)
+        self.failUnlessEqual(bible.ordinal_of(2, 1, 1), 1534)
+        self.failUnlessEqual(bible.verse_at(1533), bible[1][50][26])
+        self.failUnlessEqual(bible.verse_at(bible.num_verses), bible[-1][-1][-1])
+        for ordinal in (1, 1534, 16075, 31102):
+            self.failUnlessEqual(bible.verse_at(ordinal).ordinal, ordinal)
+        self.assertRaises(IndexError, bible.ordinal_of, 1, 1, 32)
+        self.assertRaises(IndexError, bible.verse_at, 0)
+        self.assertRaises(IndexError, bible.__getitem__, 67)
+
+
+
+class Ordinals(TestCase):
+    
+    def setUp(self):
+        create_verses(VERSES + (
+            (1, 1, 31, u"And God saw every thing that he had made, and, behold, it was very good."),
+            (1, 2, 1, u"Thus the heavens and the earth were finished, and all the host of them."),
+            (1, 50, 26, u"So Joseph died, being an hundred and ten years old."),
+            (2, 1, 1, u"Now these are the names of the children of Israel, which came into Egypt."),
+        ))
+        chapter_cache.clear()
+    
+    def tearDown(self):
+        chapter_cache.clear()
+    
+    def passage(self, reference):
+        return [unicode(verse) for verse in KJV.objects.passage(reference)]
+    
+    def test_passages(self):
+        " Verses are saved with their ordinals, and passages read by ordinal across chapters and books. "
+        for verse in KJV.objects.all():
+            self.failUnlessEqual(verse.ordinal, KJV.bible.ordinal_of(verse.book_id, verse.chapter_id, verse.verse_id))
+        self.failUnlessEqual(self.passage('Genesis 1:1-3'), [u'Genesis 1:1', u'Genesis 1:3'])
+        self.failUnlessEqual(self.passage('Genesis 1:3-2:1'), [u'Genesis 1:3', u'Genesis 1:31', u'Genesis 2:1'])
+        self.failUnlessEqual(self.passage('Genesis 50:26 - Exodus 1:1'), [u'Genesis 50:26', u'Exodus 1:1'])
+    
+    def test_outside_canon(self):
+        " References python-bible reads but the canon doesn't have are rejected by clean(), saved without ordinals, and skipped. "
+        kjv = ContentType.objects.get_for_model(KJV)
+        scripture = Scripture(start_verse='3Jn 1:15', version=kjv, content_type=kjv, object_id=1)
+        self.assertRaises(ValidationError, scripture.clean)
+        scripture.save()
+        self.failUnlessEqual((scripture.start_book_id, scripture.start_ordinal, scripture.interval_key), (64, None, None))
+        Scripture.objects.create(start_verse='John 3:16', version=kjv, content_type=kjv, object_id=2)
+        Scripture.objects.update(start_ordinal=None)
+        stderr = StringIO()
+        call_command('bibletext_ordinals', 'KJV', verbosity=0, stderr=stderr)
+        self.failUnlessEqual(Scripture.objects.get(object_id=2).start_ordinal, KJV.bible[43][3][16].ordinal)
+        self.failUnless(('Scripture %d' % scripture.pk) in stderr.getvalue())
+        self.failUnlessEqual(self.passage('Genesis 1:31; Exodus 1:1'), [u'Genesis 1:31', u'Exodus 1:1'])
+    
+    def test_backfill(self):
+        " bibletext_ordinals fills in missing ordinals, and with --all recomputes every one. "
+        expected = sorted(KJV.objects.values_list('pk', 'ordinal'))
+        KJV.objects.update(ordinal=None)
+        call_command('bibletext_ordinals', 'KJV', verbosity=0)
+        self.failUnlessEqual(sorted(KJV.objects.values_list('pk', 'ordinal')), expected)
+        KJV.objects.filter(book_id=2).update(ordinal=1)
+        call_command('bibletext_ordinals', 'KJV', verbosity=0)
+        self.failIfEqual(sorted(KJV.objects.values_list('pk', 'ordinal')), expected)
+        call_command('bibletext_ordinals', 'KJV', verbosity=0, all=True)
+        self.failUnlessEqual(sorted(KJV.objects.values_list('pk', 'ordinal')), expected)
+        self.failUnlessEqual(self.passage('Genesis 50:26 - Exodus 1:1'), [u'Genesis 50:26', u'Exodus 1:1'])
+    
+    def test_outside_canon(self):
+        " References python-bible reads but the canon doesn't have are rejected by clean(), saved without ordinals, and skipped. "
+        kjv = ContentType.objects.get_for_model(KJV)
+        scripture = Scripture(start_verse='3Jn 1:15', version=kjv, content_type=kjv, object_id=1)
+        self.assertRaises(ValidationError, scripture.clean)
+        scripture.save()
+        self.failUnlessEqual((scripture.start_book_id, scripture.start_ordinal, scripture.interval_key), (64, None, None))
+        Scripture.objects.create(start_verse='John 3:16', version=kjv, content_type=kjv, object_id=2)
+        Scripture.objects.update(start_ordinal=None)
+        stderr = StringIO()
+        call_command('bibletext_ordinals', 'KJV', verbosity=0, stderr=stderr)
+        self.failUnlessEqual(Scripture.objects.get(object_id=2).start_ordinal, KJV.bible[43][3][16].ordinal)
+        self.failUnless(('Scripture %d' % scripture.pk) in stderr.getvalue())
+
+
+class References(TestCase):
+    
+    def format(self, reference):
+        return [(start.format(), end.format()) for start, end in parse_ranges(reference, 'KJV')]
+    
+    def test_compound(self):
+        " Books and chapters carry over between the parts of a compound reference. "
+        self.failUnlessEqual(self.format('Rom 3:23; 6:23; 10:9-13'), [
+            ('Romans 3:23', 'Romans 3:23'), ('Romans 6:23', 'Romans 6:23'), ('Romans 10:9', 'Romans 10:13')])
+        self.failUnlessEqual(self.format('Rom 3:23, 25'), [('Romans 3:23', 'Romans 3:23'), ('Romans 3:25', 'Romans 3:25')])
+        self.failUnlessEqual(self.format('Romans 1:1 - 1 Corinthians 2:3'), [('Romans 1:1', '1 Corinthians 2:3')])
+    
+    def test_whole_chapters(self):
+        self.failUnlessEqual(self.format('Psalm 23-24'), [('Psalms 23:1', 'Psalms 24:10')])
+        self.failUnlessEqual(self.format('Jude 5'), [('Jude 1:5', 'Jude 1:5')])
+    
+    def test_cache(self):
+        " Equivalent references share one parsed Verse. "
+        self.failUnless(parse_verse('John 3:16', 'KJV') is parse_verse('  john 3:16', 'KJV'))
+        cache = LRUCache(2)
+        for key in ('a', 'b', 'a', 'c'):
+            cache.get_or_set(key, unicode, key)
+        self.failUnless('b' not in cache and 'a' in cache and 'c' in cache)
+        self.failUnlessEqual(cache.info(), {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2})
+    
+    def test_errors(self):
+        self.assertRaises(RangeError, parse_ranges, '6:23')
+        self.assertRaises(RangeError, parse_ranges, 'Rom 3:23-4')
+    
+    def test_find_book(self):
+        " Book names and abbreviations ignore case, spaces and punctuation. "
+        john = KJV.bible[43]
+        for name in ('St. John', 'john', 'JN', 'John 3:16'):
+            self.failUnlessEqual(find_book(name), john)
+        self.failUnlessEqual(find_book('1 Cor.'), KJV.bible[46])
+        self.failUnlessEqual(KJV.bible.find_book('Hezekiah'), None)
+        self.assertRaises(BookError, find_book, 'Hezekiah')
+
+    def test_find_references(self):
+        " References in free text, with the book and chapter carried over, and look-alikes left alone. "
+        text = u'See Jn. 3:16 and Rom 8:28-30; 10:9, 13. Psalm 23 - he is 5, 1 Cor 2:3-3:4, Gen 99:1 and Jude 5.'
+        self.failUnlessEqual([(text[found.start:found.end], unicode(found)) for found in find_references(text)], [
+            (u'Jn. 3:16', u'John 3:16'), (u'Rom 8:28-30', u'Romans 8:28-30'), (u'10:9', u'Romans 10:9'),
+            (u'13', u'Romans 10:13'), (u'Psalm 23', u'Psalms 23'), (u'1 Cor 2:3-3:4', u'1 Corinthians 2:3-3:4'),
+            (u'Jude 5', u'Jude 5')])
+
+    def test_link_references(self):
+        " Links skip markup and existing links. "
+        self.failUnlessEqual(link_references(u'<p title="Gen 1:1">Gen 1:1, <a href="/">John 3:16</a></p>'),
+            u'<p title="Gen 1:1"><a href="%s" class="bibletext-reference">Gen 1:1</a>, <a href="/">John 3:16</a></p>'
+            % KJV.bible[1][1][1].get_absolute_url())
+    
+    def test_automaton(self):
+        " Only the characters of book names are remembered in the shared automaton. "
+        goto, fail, outputs, alphabet = autolink._automaton(KJV.bible)
+        link_references(u'\u4e2d\u6587 \u00e9 John 3:16 \u2603')
+        self.failIf(set(u'\u4e2d\u6587\u00e9\u2603') & set(character for transitions in goto for character in transitions))
+        self.failUnless(u'j' in goto[0])
+
+
+
+class Search(TestCase):
+    
+    def setUp(self):
+        create_verses()
+        self.path = os.path.join(tempfile.mkdtemp(), 'KJV.idx')
+        build_index(KJV, self.path)
+        self.index = InvertedIndex(self.path)
+    
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(os.path.dirname(self.path))
+    
+    def find(self, query):
+        tree = parse(query)
+        matches = self.index.matches(tree)
+        return [KJV.bible.verse_at(ordinal).name for ordinal, score in self.index.best(terms(tree), matches, 10)]
+    
+    def test_query(self):
+        self.failUnlessEqual(parse(u'"In the" OR -LORD\'s'), ('or', [('phrase', (u'in', u'the')), ('not', ('term', u'lord'))]))
+        self.failUnlessEqual(parse(u'a (b c)'), ('and', [('term', u'a'), ('and', [('term', u'b'), ('term', u'c')])]))
+        for query in (u'(light', u'light)', u'OR', u'...'):
+            self.assertRaises(QueryError, parse, query)
+    
+    def test_search(self):
+        self.failUnlessEqual(self.find(u'light'), [u'1:3'])
+        self.failUnlessEqual(self.find(u'god'), [u'1:1', u'1:3', u'3:16']) # Shorter verses first.
+        self.failUnlessEqual(self.find(u'"the earth"'), [u'1:1'])
+        self.failUnlessEqual(self.find(u'"earth the"'), [])
+        self.failUnlessEqual(self.find(u'god NOT light'), [u'1:1', u'3:16'])
+        self.failUnlessEqual(self.find(u'shepherd OR begotten'), [u'23:1', u'3:16'])
+        self.failUnlessEqual(self.find(u'NOT god'), [u'23:1'])
+    
+    def test_highlight(self):
+        self.failUnlessEqual(highlight(u"The LORD's <light>.", frozenset([u'lord', u'light'])),
+                             u"The <mark>LORD&#39;s</mark> &lt;<mark>light</mark>&gt;.")
+    
+    def test_unavailable(self):
+        " Without an index (or anywhere to keep one) the view and the tag show that, rather than erroring. "
+        backend = InvertedIndexBackend()
+        for directory in (os.path.dirname(self.path) + '-missing', None):
+            with self.settings(BIBLETEXT_SEARCH_INDEX_DIR=directory):
+                response = views.search(RequestFactory().get('/KJV/search/', {'q': 'light'}))
+                self.failUnless('bibletext-search-error' in response.content)
+                self.failUnlessEqual(search_verses(u'light')['results'], None)
+        with self.settings(BIBLETEXT_SEARCH_INDEX_DIR=os.path.dirname(self.path)):
+            index = backend.get_index(KJV)
+            os.utime(self.path, (0, 0))
+            self.failIf(backend.get_index(KJV) is index)
+            self.failUnless(index.postings(u'light')) # Still there for searches already holding it.
+        self.assertRaises(Http404, views.search, RequestFactory().get('/KJV/search/', {'q': 'light', 'page': 'x'}))
+
+
+
+
+class Concordance(TestCase):
+    
+    def test_incremental(self):
+        " Counts and verses stay right when only some chapters are read again. "
+        create_verses()
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'KJV.concordance')
+        try:
+            self.failUnlessEqual(concordance.build_concordance(KJV, path)[0], 3)
+            self.failUnlessEqual(concordance.build_concordance(KJV, path), (0, 0))
+            KJV.objects.filter(book_id=43).update(text=u"God is light.")
+            self.failUnlessEqual(concordance.build_concordance(KJV, path)[0], 1)
+            words = concordance.Concordance(path, KJV.bible)
+            god = words.lookup(u'GOD')
+            self.failUnlessEqual((god.occurrences, god.verse_count), (3, 3))
+            self.failUnlessEqual([(book.number, count) for book, count in god.book_counts], [(1, 2), (43, 1)])
+            self.failUnlessEqual([unicode(verse) for verse in words.lookup(u'light').verses],
+                                 [u'Genesis 1:3', u'John 3:16'])
+            self.failUnlessEqual(words.lookup(u'begotten'), None)
+            self.failUnlessEqual(words.most_common(2), [(u'the', 4), (u'and', 3)])
+            words.close()
+        finally:
+            shutil.rmtree(directory)
+    
+    def test_tags(self):
+        " Without a concordance (or anywhere to keep one) the tags show a word that isn't used. "
+        directory = tempfile.mkdtemp()
+        try:
+            for setting in (directory, None):
+                with self.settings(BIBLETEXT_CONCORDANCE_DIR=setting, BIBLETEXT_SEARCH_INDEX_DIR=None):
+                    self.failUnlessEqual(concordance_tag(u'god')['verse_list'], [])
+                    self.failUnlessEqual(word_count(u'god'), 0)
+        finally:
+            shutil.rmtree(directory)
+
+
+class Import(TestCase):
+
+    def test_import(self):
+        " Verses are imported with their ordinals, leaving out notes, headings and word attributes. "
+        written, missing = import_verses(KJV, read_usfm(usfm(range(1, 26))))
+        self.failUnlessEqual(written, 25)
+        self.failUnlessEqual(len(missing), sum(len(book) for book in KJV.bible) - 1)
+        verse = KJV.objects.get(book_id=65, chapter_id=1, verse_id=24)
+        self.failUnlessEqual((verse.ordinal, verse.text), (KJV.bible[65][1][24].ordinal, u'Verse 24.'))
+
+    def test_batches(self):
+        " Batches bigger than SQLite takes in one statement are written in several. "
+        genesis = [(1, chapter.number, verse.number, u'Verse.') for chapter in KJV.bible[1] for verse in chapter]
+        self.failUnlessEqual(import_verses(KJV, genesis, batch_size=2000)[0], len(genesis))
+        self.failUnlessEqual(KJV.objects.filter(book_id=1).count(), len(genesis))
+
+    def test_verse_counts(self):
+        " Chapters are checked against the canon. "
+        self.assertRaises(TextImportError, import_verses, KJV, read_usfm(usfm(range(1, 25))))
+        self.assertRaises(TextImportError, import_verses, KJV, read_csv(['Jude,1,26,Not in the canon.']))
+        for rows, line in ((['Jude'], 1), (['book,chapter,verse,text', 'Jude,1,1,Verse 1.', 'Jude,1'], 3)):
+            try:
+                list(read_csv(rows))
+            except TextImportError as e:
+                self.failUnless(str(e).startswith('Line %d has' % line), e)
+            else:
+                self.fail("A short row was read.")
+
+    def test_import_scripture(self):
+        " Scripture is written with the fields save() would fill in, or not at all if a row is bad. "
+        rows = ['object_id,content_type,start_verse,end_verse', '1,bibletext.kjv,John 3:16,', '2,bibletext.kjv,Jn 3:16,John 4:2']
+        self.failUnlessEqual(import_scripture(read_scripture_csv(rows), batch_size=1), 2)
+        imported = Scripture.objects.order_by('object_id')
+        saved = Scripture(**dict((field.attname, getattr(imported[1], field.attname)) for field in Scripture._meta.fields
+                                 if field.attname not in ('id', 'end_book_id', 'start_ordinal')))
+        saved.save()
+        self.failUnlessEqual([(s.start_book_id, s.start_verse_id, s.end_book_id, s.start_ordinal, s.interval_key) for s in imported],
+                             [(43, 16, None, KJV.bible[43][3][16].ordinal, KJV.bible[43][3][16].ordinal)] +
+                             [(43, 16, 43, saved.start_ordinal, saved.interval_key)] * 2)
+        bad = ['bibletext.kjv,3,John 3:16', 'bibletext.kjv,4,John 3:99', 'no.such,5,John 3:16', 'bibletext.kjv,6,John 3:18,John 3:16']
+        try:
+            import_scripture(read_scripture_csv(bad), batch_size=2)
+        except TextImportError as e:
+            self.failUnlessEqual(unicode(e).count(u'Row '), 3)
+        else:
+            self.fail("The bad rows weren't found.")
+        self.failIf(Scripture.objects.filter(object_id=3).exists())
+        many = ['bibletext.kjv,%d,John 3:16' % object_id for object_id in range(100, 300)]
+        self.failUnlessEqual(import_scripture(read_scripture_csv(many)), 200) # More than SQLite takes in one statement.
+
+
+
+class Caching(TestCase):
+
+    def setUp(self):
+        chapter_cache.invalidate(KJV)
+
+    def tearDown(self):
+        chapter_cache.invalidate(KJV)
+
+    def test_complete_chapters(self):
+        " Only chapters with every verse are cached, and each caller gets copies of the cached verses. "
+        create_verses()
+        for i in range(2):
+            with self.assertNumQueries(1):
+                self.failUnlessEqual(len(KJV.objects.chapter(1, 1)), 2)
+        create_verses([(65, 1, verse_id, u'Verse %d.' % verse_id) for verse_id in range(1, 26)])
+        KJV.objects.chapter(65, 1)
+        with self.assertNumQueries(0):
+            verse_list = KJV.objects.chapter(65, 1)
+        verse_list[0].text = u'Changed.'
+        self.failUnlessEqual(KJV.objects.chapter(65, 1)[0].text, u'Verse 1.')
+
+    def test_import(self):
+        " Importing a translation drops its cached chapters. "
+        create_verses([(65, 1, verse_id, u'Old %d.' % verse_id) for verse_id in range(1, 26)])
+        self.failUnlessEqual(KJV.objects.chapter(65, 1)[0].text, u'Old 1.')
+        import_verses(KJV, read_usfm(usfm(range(1, 26))), replace=True)
+        self.failUnlessEqual(KJV.objects.chapter(65, 1)[0].text, u'Verse 1.')
+
+
+class TextStore(TestCase):
+
+    def setUp(self):
+        create_verses()
+
+    def test_store(self):
+        " Packed chapters are read without the database, unless packed under another content version. "
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(BIBLETEXT_TEXT_STORE=directory):
+                self.failUnlessEqual(store.pack(KJV), 4)
+                john = KJV.objects.get(book_id=43)
+                chapter_cache.clear()
+                with self.assertNumQueries(0):
+                    self.failUnlessEqual([(verse.verse_id, verse.text) for verse in KJV.objects.chapter(1, 1)],
+                                         [(1, VERSES[0][3]), (3, VERSES[1][3])])
+                    verse = KJV.objects.verse('John 3:16')
+                self.failUnlessEqual((verse.pk, verse.ordinal, verse.text), (john.pk, john.ordinal, john.text))
+                self.failUnless(store.get_store(KJV).text(KJV.bible.ordinal_of(1, 1, 2)) is None)
+                with override_settings(BIBLETEXT_CONTENT_VERSIONS={'KJV': 'changed'}):
+                    self.failUnless(store.get_store(KJV) is None)
+        finally:
+            chapter_cache.clear()
+            shutil.rmtree(directory)
+
+    def test_compressed(self):
+        " A compressed store reads the same verses as a raw one, across its blocks. "
+        directory = tempfile.mkdtemp()
+        try:
+            store.pack(KJV, os.path.join(directory, 'raw'))
+            store.pack(KJV, os.path.join(directory, 'compressed'), compress=True, block_size=0)
+            raw, compressed = store.TextStore(os.path.join(directory, 'raw')), store.TextStore(os.path.join(directory, 'compressed'))
+            self.failUnless(compressed.compressed and not raw.compressed)
+            everything = compressed.verses(1, KJV.bible.num_verses)
+            self.failUnlessEqual([text for ordinal, pk, text in everything], [verse[3] for verse in VERSES])
+            self.failUnlessEqual(everything, raw.verses(1, KJV.bible.num_verses))
+            first = KJV.bible.ordinal_of(1, 1, 1)
+            self.failUnlessEqual(compressed.verses(first + 1, first + 40), raw.verses(first + 1, first + 40)) # Gen 1-2.
+            raw.close()
+            compressed.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+class ScriptureRanges(TestCase):
+
+    def setUp(self):
+        kjv = ContentType.objects.get_for_model(KJV)
+        self.scripture = {}
+        for object_id, (start, end) in enumerate([('John 3:1', 'John 3:21'), ('John 3:16', ''),
+                                                  ('John 2:23', 'John 4:2'), ('Romans 8:28', 'Romans 8:39')]):
+            self.scripture[object_id] = Scripture.objects.create(start_verse=start, end_verse=end, version=kjv,
+                                                                 content_type=kjv, object_id=object_id)
+
+    def test_queries(self):
+        " Overlap, containment and point queries, on the database and the in-memory index. "
+        self.failUnlessEqual((self.scripture[1].start_ordinal, self.scripture[1].end_ordinal),
+                             (KJV.bible.ordinal_of(43, 3, 16),) * 2)
+        queries = [
+            ('overlapping', 'John 3:17-4:1', [2, 0]),
+            ('overlapping', KJV.bible[43][3], [2, 0, 1]),
+            ('overlapping', 'John 1; Rom 8:30', [3]),
+            ('containing', 'John 3:16', [2, 0, 1]),
+            ('containing', 'John 3:1-4:1', [2]),
+            ('within', 'John 3', [0, 1]),
+            ('within', KJV.bible[45], [3]),
+        ]
+        for relation, reference, object_ids in queries:
+            self.failUnlessEqual(sorted(scripture.object_id for scripture in getattr(Scripture.objects, relation)(reference)),
+                                 sorted(object_ids))
+            self.failUnlessEqual(getattr(scripture_index, relation)(reference, model=KJV), object_ids)
+        self.failUnlessEqual(sorted(Scripture.objects.overlapping('John 3:16', 'KJV').filter(object_id__gt=0)
+                                    .values_list('object_id', flat=True)), [1, 2])
+        self.scripture[2].delete()
+        self.failUnlessEqual(scripture_index.containing('John 3:16', model=KJV), [0, 1])
+
+    def test_prefetch_text(self):
+        " The text of every Scripture is read with one query, and attached to each. "
+        create_verses()
+        chapter_cache.clear()
+        try:
+            with self.assertNumQueries(2):
+                scripture_list = list(Scripture.objects.prefetch_scripture_text().filter(object_id__in=[1, 3]))
+                self.failUnlessEqual([[verse.text for verse in scripture.passage] for scripture in scripture_list],
+                                     [[VERSES[3][3]], []])
+                self.failUnlessEqual(scripture_list[0].verse.pk, scripture_list[0].passage[0].pk)
+        finally:
+            chapter_cache.clear()
+
+    def test_interval_tree(self):
+        " The tree agrees with comparing every interval. "
+        rand = random.Random(1)
+        intervals = []
+        for value in xrange(500):
+            start = rand.randint(1, 1000)
+            intervals.append((start, start + rand.randint(0, 50), value))
+        tree = IntervalTree(intervals)
+        for i in xrange(200):
+            start = rand.randint(1, 1000)
+            end = start + rand.randint(0, 20)
+            self.failUnlessEqual(sorted(tree.overlapping(start, end)), sorted(v for s, e, v in intervals if s <= end and e >= start))
+            self.failUnlessEqual(sorted(tree.containing(start, end)), sorted(v for s, e, v in intervals if s <= start and e >= end))
+            self.failUnlessEqual(sorted(tree.within(start, end)), sorted(v for s, e, v in intervals if s >= start and e <= end))
+
+
+
+class Api(TestCase):
+    urls = 'bibletext.urls'
+
+    def setUp(self):
+        create_verses()
+
+    def get(self, url, status=200):
+        response = self.client.get(url)
+        self.failUnlessEqual((response.status_code, response['Content-Type']), (status, 'application/json'))
+        return json.loads(response.content)
+
+    def test_chapter(self):
+        " Chapters and verses come with the canon's details. "
+        data = self.get('/api/KJV/1/1/')
+        self.failUnlessEqual([verse['verse'] for verse in data['verses']], [1, 3])
+        self.failUnlessEqual((data['chapter']['num_verses'], data['chapter']['book']['name'], data['chapter']['prev']),
+                             (31, 'Genesis', None))
+        self.failUnlessEqual(data['chapter']['next']['url'], '/api/KJV/1/2/')
+        self.failUnlessEqual(self.get('/api/KJV/43/3/16/')['verse']['text'], VERSES[3][3])
+        self.get('/api/KJV/43/3/17/', 404)
+        self.get('/api/KJV/1/51/', 404)
+
+    def test_references(self):
+        " Passages, and many references at once where one bad reference doesn't spoil the rest. "
+        data = self.get('/api/KJV/passage/?ref=Gen+1:1-3%3B+Ps+23')
+        self.failUnlessEqual([chapter['name'] for chapter in data['chapters']], ['Chapter 1', 'Psalm 23'])
+        self.failUnlessEqual(len(data['verses']), 3)
+        self.get('/api/KJV/passage/?ref=Hezekiah+1:1', 400)
+        data = self.get('/api/KJV/references/?ref=John+3:16&ref=Gen+99:1&ref=Gen+1:1')
+        self.failUnlessEqual([len(result.get('verses', [])) for result in data['results']], [1, 0, 1])
+        self.failUnless('error' in data['results'][1])
+
+    def test_stream(self):
+        " Long passages are read a chunk of verses at a time and sent a chapter at a time. "
+        with self.assertNumQueries(2):
+            self.failUnlessEqual([verse.verse_id for verse in KJV.objects.iter_ranges([(1, 3)], chunk_size=1)], [1, 3])
+        with self.settings(BIBLETEXT_API_STREAM_VERSES=0):
+            data = self.get('/api/KJV/passage/?ref=Gen+1:1-3%3B+Ps+23')
+        self.failUnlessEqual([chapter['name'] for chapter in data['chapters']], ['Chapter 1', 'Psalm 23'])
+        self.failUnlessEqual([verse['text'] for verse in data['verses']], [text for b, c, v, text in VERSES[:3]])
+        response = self.client.get('/KJV/passage/?ref=Genesis+1:1+-+Psalm+150:6')
+        content = response.content # Once: it's read from an iterator.
+        self.failUnless(content.index('Genesis 1</a>') < content.index(str(VERSES[1][3]))
+                        < content.index('Psalms 23</a>') < content.rindex('</div>'))
+
+    def test_stream_fallback(self):
+        " A passage template without {{ verse_list_html }} is rendered whole, with the verses and context processors. "
+        class Loader(object):
+            def get_template(self, name):
+                if name == 'passage.html':
+                    return Template(u'{{ processed }}:{% for verse in verse_list %}{{ verse.verse_id }},{% endfor %}')
+                return loader.get_template(name)
+        request = RequestFactory().get('/KJV/passage/', {'ref': 'Gen 1:1-3'})
+        response = views.passage(request, template_name='passage.html', template_loader=Loader(),
+                                 context_processors=[lambda request: {'processed': 'yes'}])
+        self.failUnlessEqual(response.content, 'yes:1,3,')
+
+    def test_pages(self):
+        " Pages seek to their first verse, by count or by length, and link to the next with stable URLs. "
+        with self.assertNumQueries(1):
+            verse_list, following = KJV.objects.page([(1, KJV.bible.num_verses)], per_page=2)
+        self.failUnlessEqual(([verse.verse_id for verse in verse_list], following), ([1, 3], KJV.bible.ordinal_of(19, 23, 1)))
+        self.failUnlessEqual([verse.book_id for verse in KJV.objects.page([(1, KJV.bible.num_verses)], following)[0]], [19, 43])
+        self.failUnlessEqual(len(KJV.objects.page([(1, KJV.bible.num_verses)], per_page=10, max_length=60)[0]), 1)
+        data = self.get('/api/KJV/passage/?ref=Gen+1:1-3&per_page=1')
+        self.failUnlessEqual(([verse['verse'] for verse in data['verses']], data['next']),
+                             ([1], '/api/KJV/passage/?ref=Gen+1%3A1-3&from=3&per_page=1'))
+        self.failUnlessEqual(self.get(data['next'])['next'], None)
+        chapter_cache.clear()
+        with self.settings(BIBLETEXT_CHAPTER_PAGE_SIZE=1):
+            self.failUnless('href="/KJV/1/1/from/3/"' in self.client.get('/KJV/1/1/').content)
+            self.failUnless(VERSES[1][3] in self.client.get('/KJV/1/1/from/3/').content)
+            for asked, canonical in (('/KJV/1/1/from/5/', '/KJV/1/1/from/3/'), ('/KJV/1/1/from/1/', '/KJV/1/1/'),
+                                     ('/KJV/1/1/?from=3', '/KJV/1/1/from/3/'), ('/KJV/1/1/?from=1', '/KJV/1/1/')):
+                response = self.client.get(asked)
+                self.failUnlessEqual((response.status_code, response['Location']), (302, 'http://testserver' + canonical))
+            self.failUnlessEqual(chapter_paths(KJV, 1, 1)[:3], ['/KJV/1/1/', '/KJV/1/1/from/3/', '/KJV/1/'])
+        self.failUnlessEqual(self.client.get('/KJV/1/1/from/3/')['Location'], 'http://testserver/KJV/1/1/')
+        chapter_cache.clear()
+
+    def test_conditional_get(self):
+        " Pages get ETags only when asked for, and not the same one for another visitor or release. "
+        self.failIf(self.client.get('/KJV/1/1/').has_header('ETag'))
+        with self.settings(BIBLETEXT_CONDITIONAL_GET=True):
+            etag = self.client.get('/KJV/1/1/')['ETag']
+            self.failUnlessEqual(self.client.get('/KJV/1/1/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.failUnlessEqual(self.client.get('/KJV/1/1/', HTTP_IF_NONE_MATCH=etag, HTTP_COOKIE='sessionid=1').status_code, 200)
+            with self.settings(BIBLETEXT_ETAG_VERSION='2'):
+                self.failUnlessEqual(self.client.get('/KJV/1/1/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_export(self):
+        " A page that fails to render is reported with the rest, not left to end the export. "
+        output_dir = tempfile.mkdtemp()
+        try:
+            self.failUnlessEqual(export_paths((output_dir, ['/KJV/1/1/', '/KJV/1/1/2/', '/KJV/1/1/3/'])), (2, ['/KJV/1/1/2/']))
+            self.failUnless(os.path.exists(os.path.join(output_dir, 'KJV', '1', '1', '3', 'index.html')))
+            for start in ('3', '7'):
+                os.makedirs(os.path.join(output_dir, 'KJV', '1', '1', 'from', start))
+            remove_stale_pages(output_dir, ['/KJV/1/1/', '/KJV/1/1/from/3/', '/KJV/1/1/1/'])
+            self.failUnlessEqual(os.listdir(os.path.join(output_dir, 'KJV', '1', '1', 'from')), ['3'])
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_fragments(self):
+        " The verses of a view given context processors are rendered with them too, not cached without them. "
+        calls = []
+        def processor(request):
+            calls.append(request)
+            return {}
+        request = RequestFactory().get('/KJV/1/1/')
+        views.chapter(request, '1', '1', context_processors=[processor])
+        views.verse(request, '1', '1', '3', context_processors=[processor])
+        self.failUnlessEqual(len(calls), 4)
+        self.failUnless(VERSES[1][3] in views.verse(request, '1', '1', '3').content)
+
+
+
+VENDOR = connections[KJV.objects.db].vendor
+
+class SearchDatabase(TransactionTestCase):
+    """
+    The database backend creates tables and columns, which the test transaction won't roll back.
+    Run the tests with a PostgreSQL (12+) database as well as SQLite to cover both.
+    """
+    
+    def setUp(self):
+        create_verses()
+        self.backend = DatabaseBackend()
+    
+    def tearDown(self):
+        cursor = connections[KJV.objects.db].cursor()
+        if VENDOR == 'sqlite':
+            for trigger in ('ai', 'ad', 'au'):
+                cursor.execute('DROP TRIGGER IF EXISTS bibletext_kjv_fts_%s' % trigger)
+            cursor.execute('DROP TABLE IF EXISTS bibletext_kjv_fts')
+        elif VENDOR == 'postgresql':
+            cursor.execute('ALTER TABLE bibletext_kjv DROP COLUMN IF EXISTS search_vector') # And its index.
+            transaction.commit_unless_managed(using=KJV.objects.db)
+    
+    def find(self, query):
+        tree = parse(query)
+        count, found = self.backend.search(KJV, tree, terms(tree), 0, 10)
+        return sorted(KJV.bible.verse_at(ordinal).name for ordinal, score in found)
+    
+    def check_backend(self):
+        self.backend.build(KJV)
+        self.failUnlessEqual(self.find(u'god'), [u'1:1', u'1:3', u'3:16'])
+        self.failUnlessEqual(self.find(u'"the earth"'), [u'1:1'])
+        self.failUnlessEqual(self.find(u'god NOT light'), [u'1:1', u'3:16'])
+        self.failUnlessEqual(self.find(u'lord OR NOT god'), [u'23:1'])
+        KJV.objects.filter(book_id=19).update(text=u"The LORD is my shepherd; I shall not want for light.")
+        self.failUnlessEqual(self.find(u'light'), [u'1:3', u'23:1'])
+    
+    @unittest.skipUnless(VENDOR == 'sqlite', "Needs SQLite.")
+    def test_sqlite_fts5(self):
+        " The FTS5 table finds the same verses, and its triggers keep it in sync with the verse table. "
+        self.check_backend()
+    
+    @unittest.skipUnless(VENDOR == 'postgresql', "Needs PostgreSQL 12+.")
+    def test_postgresql_tsvector(self):
+        " The generated tsvector column finds the same verses, and follows the text as it changes. "
+        self.check_backend()
+        self.failUnlessEqual(self.find(u'"earth the"'), [])
@@ -1,10 +1,20 @@
 from django.conf.urls.defaults import *
 
 
-urlpatterns = patterns('bibletext.views',
+urlpatterns = patterns('bibletext.api',
+    url(r'^api/(?P<version>\w{2,12})/passage/$', 'passage', name='bibletext_api_passage'),
+    url(r'^api/(?P<version>\w{2,12})/references/$', 'references', name='bibletext_api_references'),
+    url(r'^api/(?P<version>\w{2,12})/(?P<book_id>\d+)/(?P<chapter_id>\d+)/$', 'chapter', name='bibletext_api_chapter'),
+    url(r'^api/(?P<version>\w{2,12})/(?P<book_id>\d+)/(?P<chapter_id>\d+)/(?P<verse_id>\d+)/$', 'verse', name='bibletext_api_verse'),
+)
+
+urlpatterns += patterns('bibletext.views',
     url(r'^$', 'bible_list', name='bibletext_bible_list'),
     url(r'^(?P<version>\w{2,12})/$', 'bible', name='bibletext_bible_detail'),
+    url(r'^(?P<version>\w{2,12})/search/$', 'search', name='bibletext_search'),
+    url(r'^(?P<version>\w{2,12})/passage/$', 'passage', name='bibletext_passage'),
     url(r'^(?P<version>\w{2,12})/(?P<book_id>\d+)/$', 'book', name='bibletext_book_detail'),
     url(r'^(?P<version>\w{2,12})/(?P<book_id>\d+)/(?P<chapter_id>\d+)/$', 'chapter', name='bibletext_chapter_detail'),
+    url(r'^(?P<version>\w{2,12})/(?P<book_id>\d+)/(?P<chapter_id>\d+)/from/(?P<start>\d+)/$', 'chapter', name='bibletext_chapter_page'),
     url(r'^(?P<version>\w{2,12})/(?P<book_id>\d+)/(?P<chapter_id>\d+)/(?P<verse_id>\d+)/$', 'verse', name='bibletext_verse_detail'),
 )
@@ -1,50 +1,78 @@
-from re import error
+import re
+from hashlib import md5
+from itertools import groupby
+from operator import itemgetter
 
-from django.contrib.contenttypes.models import ContentType
-
-from bible import data, book_re # python-bible module.
+from django.db.models import Count
 
 from models import VerseText, KJV
 
 
+# The chapter and verse following a book name, eg: ' 3:16' in 'John 3:16'.
+chapter_verse_re = re.compile(r'\s+\d[\d\s:.-]*$')
+
+
 # Exceptions
 class BibleError(Exception):
     pass
 
-def BookError(BibleError):
+class BookError(BibleError):
+    pass
+
+class SearchError(BibleError):
+    pass
+
+class ConcordanceError(BibleError):
+    pass
+
+class TextImportError(BibleError):
     pass
 
 
 def find_book(book, bible=KJV):
     " Find the book reference and return the :model:`bibletext.Book` "
-    try:
-        # Does the text look like a book reference?
-        b = book_re.search(book).group(0)
-    except error:
+    found = bible.bible.find_book(chapter_verse_re.sub(u'', book))
+    if found is None:
         raise BookError("Could not find that book of the Bible: %s." % book)
-        
-    # Try to find the book listed as a book name or abbreviation
-    bible_data = data.bible_data(bible.translation)
-    b = b.rstrip('.').lower().strip()
-    for i, book_data in enumerate(bible_data):
-        if book_data['name'].lower() == b:
-            found = i + 1
-            break
-        else:
-            for abbr in book_data['abbrs']:
-                if abbr == b:
-                    found = i + 1
-                    break
-    try:
-        return bible.bible[found]
-    except:
-        raise BookError("Could not find that book of the Bible: %d." % book)
+    return found
 
 
 def lookup_translation(version):
     " Returns the VerseText implementation based on the translation string ('KJV', 'ASV', etc) "
-    bible_content_types = ContentType.objects.filter(pk__in=VerseText.versions)
-    for bible_content_type in bible_content_types:
-        if bible_content_type.model_class().translation == version:
-            return bible_content_type.model_class()
-    return KJV # Default to the KJV text to keep it simple.
+    return VerseText.registry.get(version, KJV) # Default to the KJV text to keep it simple.
+
+
+def check_verse_counts(version=KJV):
+    """
+    Compares the verses in the database against the canon's verse counts.
+    
+    Returns a list of (book, chapter, expected, found) for every chapter that differs,
+    so an empty list means the translation was imported completely.
+    """
+    found = dict(((row['book_id'], row['chapter_id']), row['num_verses']) for row in
+                 version.objects.values('book_id', 'chapter_id').order_by().annotate(num_verses=Count('verse_id')))
+    mismatches = []
+    for book in version.bible:
+        for chapter in book:
+            count = found.pop((book.number, chapter.number), 0)
+            if count != len(chapter):
+                mismatches.append((book.number, chapter.number, len(chapter), count))
+    for (book_id, chapter_id), count in sorted(found.items()): # Chapters the canon doesn't have.
+        mismatches.append((book_id, chapter_id, 0, count))
+    return mismatches
+
+
+def chapter_texts(version=KJV):
+    " Yields (book_id, chapter_id, [(verse_id, text), ...]) for every chapter of a translation, in one query. "
+    verses = version.objects.order_by('book_id', 'chapter_id', 'verse_id').values_list(
+                'book_id', 'chapter_id', 'verse_id', 'text')
+    for (book_id, chapter_id), rows in groupby(verses.iterator(), itemgetter(0, 1)):
+        yield book_id, chapter_id, [(verse_id, text) for _, _, verse_id, text in rows]
+
+
+def chapter_hash(verses):
+    " An md5 hex digest of a chapter's [(verse_id, text), ...], to tell when it has changed. "
+    digest = md5()
+    for verse_id, text in verses:
+        digest.update((u'%d %s\n' % (verse_id, text)).encode('utf-8'))
+    return digest.hexdigest()
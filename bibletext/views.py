@@ -1,18 +1,125 @@
-from django.contrib.contenttypes.models import ContentType
+from bisect import bisect_right
+from hashlib import md5
+from itertools import groupby
+
+from django.conf import settings
 from django.core.xheaders import populate_xheaders
 from django.core.paginator import Paginator, InvalidPage
-from django.core.exceptions import ObjectDoesNotExist
-from django.http import Http404, HttpResponse
-from django.shortcuts import get_object_or_404
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.template import loader, RequestContext
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
 
 from bible import Verse, RangeError, book_re # python-bible module.
 from bible.data import bible_data
 
+from caching import fragment_cache
 from models import Scripture, KJV, VerseText
-from utils import lookup_translation
+from paging import split_pages
+from search import QueryError, SearchError, search as search_verses
+from utils import chapter_hash, lookup_translation
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError: # Django < 1.5 sends an HttpResponse of an iterator as it is iterated.
+    StreamingHttpResponse = HttpResponse
+
+# Where the streamed verses go in a page, see passage.
+STREAM_MARKER = u'<!-- bibletext:verses -->'
+
+
+def render_verses(request, bible, template_name, parts, context, extra_context=None, context_processors=None):
+    """
+    Renders a fragment of verses, eg: "bibletext/_verse_list.html", through the fragment cache.
+    
+    ``parts`` must identify the ``context``, eg: (page template name, book, chapter). A digest of
+    the text of its verse_list (or verse) is added, so a fragment never outlives the text it shows.
+    
+    Cached fragments are rendered with the context alone, as the stock templates need nothing else.
+    Given extra_context or context_processors, or with BIBLETEXT_FRAGMENT_CACHE = False (eg: for
+    overridden templates that use what the context processors add), the fragment is rendered
+    uncached with a RequestContext instead, like the page around it.
+    """
+    if extra_context or context_processors or not getattr(settings, 'BIBLETEXT_FRAGMENT_CACHE', True):
+        c = RequestContext(request, context, context_processors)
+        for key, value in (extra_context or {}).items():
+            c[key] = value() if callable(value) else value
+        return mark_safe(render_to_string(template_name, context_instance=c))
+    verses = context['verse_list'] if 'verse_list' in context else [context['verse']]
+    parts = tuple(parts) + (chapter_hash((verse.ordinal, verse.text) for verse in verses),)
+    return fragment_cache.render(bible, template_name, parts, context)
+
+
+def page_etag(request, *parts):
+    """
+    An ETag for the page asked for by request, from parts (eg: a translation and its content
+    version), BIBLETEXT_ETAG_VERSION, the page's URL and the request's cookies. Or None, with
+    BIBLETEXT_CONDITIONAL_GET off (the default).
+    
+    The cookies stand in for what else a page may show (the user, their messages, a CSRF token),
+    as Vary: Cookie does for caches. Change BIBLETEXT_ETAG_VERSION (eg: to the release being
+    deployed) when the templates change, so pages rendered with the old ones aren't answered 304.
+    """
+    if not getattr(settings, 'BIBLETEXT_CONDITIONAL_GET', False):
+        return None
+    parts += (getattr(settings, 'BIBLETEXT_ETAG_VERSION', u''), request.get_full_path(), request.META.get('HTTP_COOKIE', ''))
+    return md5(u':'.join(unicode(part) for part in parts).encode('utf-8')).hexdigest()
 
 
+def version_etag(request, version=KJV, book_id=None, chapter_id=None, verse_id=None, **kwargs):
+    """
+    An ETag for a page of the given version from its content version, see page_etag. The URL's
+    query string picks the page of a chapter.
+    
+    The text of a translation doesn't change between imports, so repeat visitors get a 304 before
+    any template or verse is touched. Pages that aren't in the canon get no ETag (they 404).
+    """
+    if type(version) in (str, unicode):
+        version = lookup_translation(version)
+    try:
+        reference = version.bible
+        for number in (book_id, chapter_id, verse_id):
+            if number is not None:
+                reference = reference[int(number)]
+    except IndexError:
+        return None
+    return page_etag(request, version.translation, version.get_content_version())
+
+
+def query_etag(request, version=KJV, **kwargs):
+    " Like version_etag, but the query string picks the verses too. "
+    if type(version) in (str, unicode):
+        version = lookup_translation(version)
+    return page_etag(request, version.translation, version.get_content_version())
+
+
+def render_chapters(request, bible, verses, template_name, template_loader=loader, extra_context=None,
+        context_processors=None):
+    """
+    Renders an iterator of verses with template_name a chapter at a time, yielding the HTML of
+    each chapter as its verses are read, so only one chapter is ever held. The context processors
+    are run once, for the first chapter, and their context kept for the rest.
+    """
+    t = template_loader.get_template(template_name)
+    c = RequestContext(request, {'bible': bible}, context_processors)
+    for key, value in (extra_context or {}).items():
+        c[key] = value() if callable(value) else value
+    for (book_id, chapter_id), verse_list in groupby(verses, lambda verse: (verse.book_id, verse.chapter_id)):
+        c.update({'verse_list': list(verse_list), 'chapter': bible.bible[book_id][chapter_id]})
+        yield t.render(c)
+        c.pop()
+
+
+def bible_list_etag(request, **kwargs):
+    " The bible list changes with the registered versions and their content versions. "
+    return page_etag(request, *(u'%s:%s' % (version.translation, version.get_content_version())
+                                for version in VerseText.registry.values()))
+
+
+@condition(etag_func=bible_list_etag)
 def bible_list(request, template_name=None, template_loader=loader, extra_context=None,
         context_processors=None, template_object_name='bible_list', mimetype=None):
     """
@@ -24,10 +131,7 @@ def bible_list(request, template_name=None, template_loader=loader, extra_contex
     """
     if extra_context is None: extra_context = {}
     
-    bible_list = []
-    bible_content_types = ContentType.objects.filter(pk__in=VerseText.versions)
-    for bible_content_type in bible_content_types:
-        bible_list.append(bible_content_type.model_class().bible)
+    bible_list = [version.bible for version in VerseText.registry.values()]
     
     if not template_name:
         template_name = "bibletext/bible_list.html"
@@ -43,6 +147,7 @@ def bible_list(request, template_name=None, template_loader=loader, extra_contex
     return HttpResponse(t.render(c), mimetype=mimetype)
 
 
+@condition(etag_func=version_etag)
 def bible(request, version=KJV, template_name=None,
         template_loader=loader, extra_context=None, context_processors=None,
         template_object_name='bible', mimetype=None):
@@ -78,6 +183,7 @@ def bible(request, version=KJV, template_name=None,
     return HttpResponse(t.render(c), mimetype=mimetype)
 
 
+@condition(etag_func=version_etag)
 def book(request, book_id, version=KJV, template_name=None,
         template_loader=loader, extra_context=None, context_processors=None,
         template_object_name='book', mimetype=None):
@@ -107,7 +213,7 @@ def book(request, book_id, version=KJV, template_name=None,
     try:
         book = bible.bible[book_id]
         chapter = bible.bible[book_id][1] # First chapter of the given book.
-        verse_list = bible.objects.filter(book_id=book_id, chapter_id=1)
+        verse_list = bible.objects.chapter(book_id, 1)
     except (IndexError, bible.DoesNotExist):
         raise Http404("Book not found in the %s." % bible.translation)
     
@@ -118,6 +224,9 @@ def book(request, book_id, version=KJV, template_name=None,
         template_object_name: book,
         'chapter': chapter,
         'verse_list': verse_list,
+        'verse_list_html': render_verses(request, bible, "bibletext/_verse_list.html", (template_name, book_id, 1),
+                                         {'verse_list': verse_list, 'chapter': chapter, 'bible': bible},
+                                         extra_context, context_processors),
         'bible': bible,
     }, context_processors)
     for key, value in extra_context.items():
@@ -128,12 +237,49 @@ def book(request, book_id, version=KJV, template_name=None,
     return HttpResponse(t.render(c), mimetype=mimetype)
 
 
+def chapter_page_url(chapter, start):
+    " The URL of the page of a chapter starting at verse number start, the chapter's own for its first page. "
+    if start == 1:
+        return chapter.get_absolute_url()
+    return reverse('bibletext_chapter_page', kwargs={'version': chapter.book.bible.translation,
+                                                     'book_id': chapter.book.number, 'chapter_id': chapter.number,
+                                                     'start': start})
+
+
+def chapter_pages(request, chapter, verse_list, per_page=None, max_length=None, start=None):
+    """
+    Splits a chapter's verses into pages (see bibletext.paging) and picks the one start, the
+    number of its first verse, asks for. Returns (the page's verses, the pages as dicts of first,
+    last, url and current), or (the URL to redirect to, None) when start isn't the canonical start
+    of a page. Pages have URLs of their own, see chapter_page_url, so they can be exported as files.
+    GET[from] is read when there's no start, and redirected to its page's URL.
+    """
+    pages = split_pages(verse_list, per_page or len(verse_list), max_length)
+    if not pages:
+        return verse_list, []
+    starts = [page[0].verse_id for page in pages]
+    try:
+        first = int(start or request.GET.get('from', starts[0]))
+    except ValueError:
+        raise Http404("Page not found.")
+    number = max(bisect_right(starts, first) - 1, 0) # Or the page the verse is in.
+    url = lambda number: chapter_page_url(chapter, number and starts[number] or 1)
+    if starts[number] != first or 'from' in request.GET or (start is not None) != bool(number):
+        return url(number), None
+    return pages[number], [{'first': page[0].verse_id, 'last': page[-1].verse_id, 'url': url(i), 'current': i == number}
+                           for i, page in enumerate(pages)]
+
+
+@condition(etag_func=version_etag)
 def chapter(request, book_id, chapter_id, version=KJV, template_name=None,
         template_loader=loader, extra_context=None, context_processors=None,
-        template_object_name='verse_list', mimetype=None):
+        template_object_name='verse_list', mimetype=None, per_page=None, max_length=None, start=None):
     """
     Renders an entire chapter based on the given book and chapter.
     
+    With per_page (or BIBLETEXT_CHAPTER_PAGE_SIZE) or max_length (or BIBLETEXT_CHAPTER_PAGE_LENGTH)
+    set, renders a page of the chapter instead, see chapter_pages and bibletext.paging.
+    
     @args::
         
         `book_id`: (int) Pk of the Book to be used.
@@ -142,6 +288,10 @@ def chapter(request, book_id, chapter_id, version=KJV, template_name=None,
         
         `version`: The Bible version to be used. You can use either the actual object or a string
         representing the translation attribute (eg: KJV or 'KJV')
+        
+        `per_page`: (int) Verses a page. `max_length`: (int) Characters of text a page.
+        
+        `start`: (int) The number of the first verse of the page, eg: 97 for `19/119/from/97/`.
     
     """
     if extra_context is None: extra_context = {}
@@ -159,15 +309,34 @@ def chapter(request, book_id, chapter_id, version=KJV, template_name=None,
     
     try:
         chapter = bible.bible[book_id][chapter_id]
-        verse_list = bible.objects.filter(book_id=book_id, chapter_id=chapter_id)
+        verse_list = bible.objects.chapter(book_id, chapter_id)
     except (IndexError, bible.DoesNotExist):
         raise Http404("Chapter not found in the given book of %s." % bible.translation)
     
     if not template_name:
         template_name = "bibletext/chapter_detail.html"
+    parts = (template_name, book_id, chapter_id)
+    pages = None
+    per_page = per_page or getattr(settings, 'BIBLETEXT_CHAPTER_PAGE_SIZE', None)
+    max_length = max_length or getattr(settings, 'BIBLETEXT_CHAPTER_PAGE_LENGTH', None)
+    if per_page or max_length:
+        verse_list, pages = chapter_pages(request, chapter, verse_list, per_page, max_length, start)
+        if pages is None: # Not permanent: the pages move when the settings (or the text) change.
+            return HttpResponseRedirect(verse_list)
+        if len(pages) < 2:
+            pages = None
+        else:
+            parts += (verse_list[0].verse_id,)
+    elif start is not None:
+        return HttpResponseRedirect(chapter.get_absolute_url())
+    
     t = template_loader.get_template(template_name)
     c = RequestContext(request, {
         template_object_name: verse_list,
+        'verse_list_html': render_verses(request, bible, "bibletext/_verse_list.html", parts,
+                                         {'verse_list': verse_list, 'chapter': chapter, 'bible': bible},
+                                         extra_context, context_processors),
+        'pages': pages,
         'book': chapter.book,
         'chapter': chapter,
         'bible': bible,
@@ -180,6 +349,7 @@ def chapter(request, book_id, chapter_id, version=KJV, template_name=None,
     return HttpResponse(t.render(c), mimetype=mimetype)
 
 
+@condition(etag_func=version_etag)
 def verse(request, book_id, chapter_id, verse_id, version=KJV, template_name=None,
         template_loader=loader, extra_context=None, context_processors=None,
         template_object_name='verse', mimetype=None):
@@ -205,13 +375,20 @@ def verse(request, book_id, chapter_id, verse_id, version=KJV, template_name=Non
     else:
         bible = version # Perhaps we were sent a VerseText implementation like the KJV.
     
-    verse = get_object_or_404(bible, book_id=book_id, chapter_id=chapter_id, verse_id=verse_id)
+    book_id, chapter_id, verse_id = int(book_id), int(chapter_id), int(verse_id)
+    
+    try:
+        verse = bible.objects.get_verse(book_id, chapter_id, verse_id)
+    except (IndexError, bible.DoesNotExist):
+        raise Http404("Verse not found in the %s." % bible.translation)
 
     if not template_name:
         template_name = "bibletext/verse_detail.html"
     t = template_loader.get_template(template_name)
     c = RequestContext(request, {
         template_object_name: verse,
+        'verse_html': render_verses(request, bible, "bibletext/_verse.html", (template_name, book_id, chapter_id, verse_id),
+                                    {'verse': verse, 'bible': bible}, extra_context, context_processors),
         'book': verse.book,
         'chapter': verse.chapter,
         'bible': bible,
@@ -224,6 +401,121 @@ def verse(request, book_id, chapter_id, verse_id, version=KJV, template_name=Non
     return HttpResponse(t.render(c), mimetype=mimetype)
 
 
+def search(request, version=KJV, template_name=None,
+        template_loader=loader, extra_context=None, context_processors=None,
+        template_object_name='results', mimetype=None):
+    """
+    Renders a page of the verses matching GET[q], see bibletext.search for the query syntax.
+
+    @args::
+
+        `version`: The Bible version to be used. You can use either the actual object or a string
+        representing the translation attribute (eg: KJV or 'KJV')
+
+        GET[q]: eg: `love NOT hate`, `"in the beginning"`. GET[page]: The page of results.
+
+    """
+    if extra_context is None: extra_context = {}
+
+    if type(version) in (str, unicode):
+        bible = lookup_translation(version)
+    else:
+        bible = version # Perhaps we were sent a VerseText implementation like the KJV.
+
+    query = request.GET.get('q', u'').strip()
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise Http404("Page not found.")
+    results = error = None
+    if query:
+        try:
+            results = search_verses(bible, query, page)
+        except QueryError as e:
+            error = unicode(e)
+        except (SearchError, ImproperlyConfigured): # eg: the index hasn't been built.
+            error = u"Search isn't available at the moment."
+
+    if not template_name:
+        template_name = "bibletext/search.html"
+    t = template_loader.get_template(template_name)
+    c = RequestContext(request, {
+        template_object_name: results,
+        'query': query,
+        'error': error,
+        'bible': bible,
+    }, context_processors)
+    for key, value in extra_context.items():
+        if callable(value):
+            c[key] = value()
+        else:
+            c[key] = value
+    return HttpResponse(t.render(c), mimetype=mimetype)
+
+@condition(etag_func=query_etag)
+def passage(request, version=KJV, template_name=None,
+        template_loader=loader, extra_context=None, context_processors=None,
+        template_object_name='reference', mimetype=None):
+    """
+    Renders the verses of GET[ref], however long, eg: `Psalm 1:1-150:6` or
+    `Genesis 1:1 - Exodus 40:38`.
+    
+    The page is streamed: the template is rendered first, with {{ verse_list_html }} standing in
+    for the verses, then each chapter is rendered with "bibletext/_passage_chapter.html" and sent
+    as its verses are read (see BiblePassageManager.iter_ranges). Memory use doesn't grow with the
+    length of the passage. Middleware that reads response.content (eg: GZipMiddleware) undoes that.
+    A template that leaves out {{ verse_list_html }} is rendered whole instead, with the verse_list.
+    
+    @args::
+        
+        `version`: The Bible version to be used. You can use either the actual object or a string
+        representing the translation attribute (eg: KJV or 'KJV')
+        
+        GET[ref]: Anything KJV.objects.passage() takes, eg: `Rom 3:23; 6:23; 10:9-13`.
+    
+    """
+    if extra_context is None: extra_context = {}
+    
+    if type(version) in (str, unicode):
+        bible = lookup_translation(version)
+    else:
+        bible = version # Perhaps we were sent a VerseText implementation like the KJV.
+    
+    reference = request.GET.get('ref', u'').strip()
+    try:
+        ranges = bible.objects.ordinal_ranges(reference)
+    except (RangeError, IndexError):
+        raise Http404("Passage not found in the %s." % bible.translation)
+    
+    if not template_name:
+        template_name = "bibletext/passage_detail.html"
+    t = template_loader.get_template(template_name)
+    c = RequestContext(request, {
+        template_object_name: reference,
+        'verse_list_html': mark_safe(STREAM_MARKER),
+        'bible': bible,
+    }, context_processors)
+    for key, value in extra_context.items():
+        if callable(value):
+            c[key] = value()
+        else:
+            c[key] = value
+    head, marker, tail = t.render(c).partition(STREAM_MARKER)
+    chapters = lambda verses: render_chapters(request, bible, verses, "bibletext/_passage_chapter.html",
+                                              template_loader, extra_context, context_processors)
+    
+    if not marker: # A template without {{ verse_list_html }}: render it again with the verses.
+        c['verse_list'] = list(bible.objects.iter_ranges(ranges))
+        c['verse_list_html'] = mark_safe(u''.join(chapters(c['verse_list'])))
+        return HttpResponse(t.render(c), mimetype=mimetype)
+    
+    def stream():
+        yield head
+        for html in chapters(bible.objects.iter_ranges(ranges)):
+            yield html
+        yield tail
+    return StreamingHttpResponse(stream(), mimetype=mimetype)
+
 
 # TODO: Finish what I had started here. This is currently non-functional..
 def passage_lookup(request, version, template_name=None, template_loader=loader,